@@ -180,6 +180,7 @@ def main():
     parser.add_argument("-d", "--dataview", action="store_true",    help="Send the data to DataView viewe (deprecated)")
     parser.add_argument('-v', '--verbose',  action='store_true',    help='Verbose processing')
     parser.add_argument(  "--skip-report",  action="store_true",    help='Skip creating report.pdf')
+    parser.add_argument(  "--cache",        action="store_true",    help='Cache the decoded session in cdi_output/.uncrater_cache for later analyses')
     parser.add_argument('-b', '--backend',  default='DCBEmu',          help='What to command. Possible values: DCBEmu (DCB Emulator), DCB (DCB), coreloop (coreloop running on PC)')
     parser.add_argument('-g', '--awg',      default='None',          help='AWG backend to use. Possible values: None, lab7, ssl')
     parser.add_argument('--operator',       default=default_user(), help='Operator name (for the report)')
@@ -287,7 +288,7 @@ def main():
         # Create an instance of the test with the loaded options
         analysis_options = opt2dict(args.analysis_options)
         t = T(options, analysis_options)
-        C = uc.Collection(os.path.join(workdir, "cdi_output"),cut_to_hello=t.need_cut_to_hello)
+        C = uc.Collection(os.path.join(workdir, "cdi_output"),cut_to_hello=t.need_cut_to_hello, cache=args.cache)
 
         def read_and_fix(fn, max_lines=200, max_line_length=2000):
             try:
@@ -112,7 +112,7 @@ def run(args):
     while True:
         try:
         #print ('refreshing')
-            C.refresh(quiet=False)
+            C.refresh(quiet=False, incremental=True)
         except: 
             pass
         if (adc):
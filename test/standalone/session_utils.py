@@ -0,0 +1,135 @@
+import binascii
+import os
+import struct
+
+import numpy as np
+
+from uncrater.coreloop import pycoreloop_307
+from uncrater.c_utils import encode_10plus6, encode_4_into_5
+
+ps = pycoreloop_307.pystruct
+appId = pycoreloop_307.appId
+
+
+class SessionWriter:
+    """Writes packets into a cdi_output directory the way BackendBase.save_data does."""
+
+    def __init__(self, out_dir):
+        self.out_dir = str(out_dir)
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.packet_count = 0
+
+    def save_data(self, appid, data):
+        fname = os.path.join(self.out_dir, f"{self.packet_count:05d}_{appid:04x}.bin")
+        with open(fname, "wb") as f:
+            f.write(bytes(data))
+        self.packet_count += 1
+
+    def hello(self):
+        hello = ps.startup_hello()
+        hello.SW_version = 0x307
+        self.save_data(appId.AppID_uC_Start, hello)
+
+    def heartbeat(self, count):
+        hb = ps.heartbeat()
+        hb.packet_count = count
+        hb.time_32 = 1000 * count
+        hb.magic = b"BRNMRL"
+        self.save_data(appId.AppID_uC_Heartbeat, hb)
+
+    def housekeeping(self, hk_type, unique_packet_id=0):
+        hk = getattr(ps, f"housekeeping_data_{hk_type}")()
+        hk.base.version = ps.VERSION_ID
+        hk.base.unique_packet_id = unique_packet_id
+        hk.base.housekeeping_type = hk_type
+        if hk_type == 0:
+            hk.core_state.base.time_32 = unique_packet_id
+        if hk_type == 1:
+            for i, adc in enumerate(hk.ADC_stat):
+                adc.valid_count = 100
+                adc.sumv = 100 * (0x1FFF + i)
+                adc.sumv2 = 100 * (0x1FFF + i) ** 2 + 400
+        self.save_data(appId.AppID_uC_Housekeeping, hk)
+
+    def spectrum(self, unique_packet_id, fmt=ps.OUTPUT_32BIT, weight=1, errors=0, skip=(), bad_crc=(), spurious=(),
+                 rng=None):
+        """Writes a metadata packet followed by 16 products, returns the integer spectra.
+        Products in spurious carry trailing bytes that are not covered by their CRC."""
+        rng = np.random.default_rng(unique_packet_id) if rng is None else rng
+        meta = ps.meta_data()
+        meta.version = ps.VERSION_ID
+        meta.unique_packet_id = unique_packet_id
+        meta.base.format = fmt
+        meta.base.weight = weight
+        meta.base.errors = errors
+        meta.base.Navgf = 1
+        meta.base.time_32 = 4096 * unique_packet_id
+        meta.base.tr_start, meta.base.tr_stop, meta.base.tr_avg_shift = 0, 32, 1
+        self.save_data(appId.AppID_MetaData, meta)
+        spectra = np.zeros((16, 2048), dtype=np.int64)
+        for product in range(16):
+            if product < 4:
+                data = rng.integers(0, 2**31, size=2048).astype(np.uint32)
+            else:
+                data = rng.integers(-(2**30), 2**30, size=2048).astype(np.int32)
+            if fmt == ps.OUTPUT_32BIT:
+                payload = data.tobytes()
+            elif fmt == ps.OUTPUT_16BIT_10_PLUS_6:
+                payload = encode_10plus6(data.view(np.int32)).tobytes()
+            else:
+                payload = encode_4_into_5(data.view(np.int32)).tobytes()
+            crc = binascii.crc32(payload) ^ (1 if product in bad_crc else 0)
+            spectra[product] = data
+            if product in spurious:
+                payload += bytes(16)
+            if product not in skip:
+                self.save_data(appId.AppID_SpectraHigh + product, struct.pack("<II", unique_packet_id, crc) + payload)
+        return spectra
+
+    def tr_spectrum(self, unique_packet_id, rng=None):
+        rng = np.random.default_rng(unique_packet_id) if rng is None else rng
+        for product in range(16):
+            payload = encode_10plus6(rng.integers(-(2**20), 2**20, size=64).astype(np.int32)).tobytes()
+            crc = binascii.crc32(payload)
+            self.save_data(appId.AppID_SpectraTRHigh + product, struct.pack("<II", unique_packet_id, crc) + payload)
+
+    def cal_data(self, unique_packet_id, rng=None):
+        """Writes the 3 calibrator data pages, returns the complex data, gNacc and gphase."""
+        rng = np.random.default_rng(unique_packet_id) if rng is None else rng
+        real, imag = rng.integers(-(2**30), 2**30, size=(2, 2048), dtype=np.int32)
+        gNacc, gphase = int(rng.integers(1, 100)), rng.integers(-(2**30), 2**30, size=1024, dtype=np.int32)
+        pages = [real, imag, np.concatenate(([gNacc], gphase)).astype(np.int32)]
+        for page, words in enumerate(pages):
+            header = struct.pack("<III", unique_packet_id, 0, 0)
+            self.save_data(appId.AppID_Calibrator_Data + page, header + words.astype("<i4").tobytes())
+        return (real + 1j * imag).reshape(4, 512), gNacc, gphase
+
+    def cal_debug(self, unique_packet_id, skip=(), rng=None):
+        """Writes the 8 pages of a calibrator debug cycle, returns the 8 payloads as words."""
+        rng = np.random.default_rng(unique_packet_id) if rng is None else rng
+        pages = rng.integers(0, 2**32, size=(8, 3 * 1024), dtype=np.uint32)
+        meta = ps.calibrator_metadata()
+        for i in range(2):
+            meta.error_reg.cal_phaser_err[i] = 0x04030201 * (i + 1)
+        for i in range(16):
+            meta.error_reg.averager_err[i] = i
+        pages[0].view(np.uint8)[2048:2048 + len(bytes(meta))] = np.frombuffer(bytes(meta), dtype=np.uint8)
+        for page in range(8):
+            if page not in skip:
+                header = struct.pack("<III", unique_packet_id, 0, 0)
+                self.save_data(appId.AppID_Calibrator_Debug + page, header + pages[page].astype("<u4").tobytes())
+        return pages
+
+
+def make_session(out_dir, nspectra=4):
+    writer = SessionWriter(out_dir)
+    writer.hello()
+    spectra = []
+    for i in range(nspectra):
+        writer.heartbeat(i)
+        writer.housekeeping(0, unique_packet_id=i)
+        writer.housekeeping(1, unique_packet_id=i)
+        spectra.append(writer.spectrum(100 + i, weight=i + 1))
+        if i % 2 == 0:
+            writer.tr_spectrum(100 + i)
+    return writer, np.array(spectra)
@@ -88,6 +88,28 @@ def test_lz_lens(utils_lib):
 
 
 
+def test_batch(utils_lib):
+    lz_pool = [0, 1, 2, 13, 14, 15, 16, 17, 18, 19, 20, 30, 31, 32]
+    lzs_signs_lens = []
+    for _ in range(4096):
+        lz = random.choice(lz_pool)
+        is_neg = True if lz == 0 else random.choice([True, False])
+        lzs_signs_lens.append((lz, is_neg, 1))
+    a = random_array(lzs_signs_lens=lzs_signs_lens)
+
+    a_compressed = utils_lib["encode_func"](a)
+    assert a_compressed.shape == (a.size // 4 * 5,)
+    one_at_a_time = np.concatenate([encode_array(a[i:i + 4], utils_lib) for i in range(0, a.size, 4)])
+    np.testing.assert_array_equal(a_compressed, one_at_a_time)
+
+    a_back = decode_array(a_compressed, utils_lib)
+    assert a_back.dtype == np.int32
+    assert all_close(a, a_back)
+    assert first_k_bits_match(a, a_back, MATCHING_BITS)
+    for i in range(0, a_compressed.size, 5):
+        np.testing.assert_array_equal(decode_array(a_compressed[i:i + 5], utils_lib), a_back[i // 5 * 4:i // 5 * 4 + 4])
+
+
 if __name__ == "__main__":
     pass
     # np.random.seed(42)
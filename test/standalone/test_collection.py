@@ -0,0 +1,390 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+import uncrater as uc
+from session_utils import SessionWriter, make_session
+
+
+def load(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return uc.Collection(str(path), **kwargs)
+
+
+@pytest.fixture
+def session(tmp_path):
+    writer, spectra = make_session(tmp_path / "cdi_output")
+    return tmp_path / "cdi_output", spectra
+
+
+def test_spectra(session):
+    path, spectra = session
+    C = load(path)
+    assert C.num_spectra_packets() == len(spectra)
+    assert C.has_all_products() and C.all_spectra_crc_ok() and C.all_meta_error_free()
+    weights = np.arange(1, len(spectra) + 1)
+    np.testing.assert_allclose(C.np_spectra(), spectra / weights[:, None, None])
+    assert C.num_tr_spectra_packets() == 2
+    assert C.np_tr_spectra().shape == (2 * 16, 4, 16)
+
+
+def test_column(session):
+    path, spectra = session
+    C = load(path)
+    np.testing.assert_array_equal(C.column("base.weight"), C.get_meta("base.weight"))
+    np.testing.assert_array_equal(C.column("unique_packet_id"), 100 + np.arange(len(spectra)))
+    np.testing.assert_array_equal(C.column("time"), C.get_meta("time"))
+    np.testing.assert_array_equal(C.column("time", uc.Packet_Housekeep, hk_type=0), [P.time for P in C.housekeeping_packets if P.hk_type == 0])
+    assert C.column("base.ADC_stat.sumv").shape == (len(spectra), 4)
+    np.testing.assert_array_equal(C.column("core_state.base.time_32", uc.Packet_Housekeep, hk_type=0), np.arange(len(spectra)))
+    np.testing.assert_array_equal(C.column("packet_count", uc.Packet_Heartbeat), np.arange(len(spectra)))
+    assert C.meta_records()["base"]["weight"].dtype == np.uint16
+    assert C.housekeeping_records(1).shape == (len(spectra),)
+    assert C.spectra[0]["meta"]["base.no_such.field"] is None
+    with pytest.raises(AttributeError):
+        C.spectra[0]["meta"]["base.no_such_field"]
+
+
+def test_adc_stats(session):
+    path, spectra = session
+    C = load(path)
+    meta = C.spectra[0]["meta"]
+    assert "adc_rms" not in vars(meta)
+    for packet_type, hk_type, prefix in ((uc.Packet_Metadata, None, "adc_"), (uc.Packet_Housekeep, 0, ""), (uc.Packet_Housekeep, 1, "")):
+        packets = C._select_packets(packet_type, hk_type)
+        stats = C.adc_stats(packet_type, hk_type)
+        for k in uc.adc_stat_keys:
+            np.testing.assert_array_equal(stats[k], [getattr(P, prefix + k) for P in packets])
+            np.testing.assert_array_equal(C.column(prefix + k, packet_type, hk_type), stats[k])
+            assert stats[k].shape == (len(spectra), 4)
+    for packet_type, hk_type in ((uc.Packet_Metadata, None), (uc.Packet_Housekeep, 0)):
+        telemetry = C.telemetry(packet_type, hk_type)
+        for k in uc.telemetry_keys:
+            np.testing.assert_array_equal(telemetry[k], [getattr(P, "telemetry_" + k) for P in C._select_packets(packet_type, hk_type)])
+    assert "adc_rms" in vars(meta) and "adc_rms" in dir(meta)
+    assert C.housekeeping_records(1)["ADC_stat"]["valid_count"].any()
+
+
+def test_incremental_refresh(session, tmp_path):
+    path, spectra = session
+    files = sorted(path.glob("*.bin"))
+    live = tmp_path / "live"
+    live.mkdir()
+    C = load(live)
+    # copy the session over in chunks that split spectra and TR spectra
+    for start in range(0, len(files), 7):
+        for fn in files[start:start + 7]:
+            (live / fn.name).write_bytes(fn.read_bytes())
+        with contextlib.redirect_stdout(io.StringIO()):
+            C.refresh(incremental=True)
+    full = load(path)
+    assert len(C) == len(full) == len(files)
+    assert C.num_spectra_packets() == len(spectra)
+    assert C.num_tr_spectra_packets() == full.num_tr_spectra_packets()
+    assert C.num_housekeeping_packets() == full.num_housekeeping_packets()
+    np.testing.assert_array_equal(C.np_spectra(), full.np_spectra())
+    np.testing.assert_array_equal(C.np_tr_spectra(), full.np_tr_spectra())
+    np.testing.assert_array_equal(C.column("base.weight"), full.column("base.weight"))
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"reorder_gap": 50}])
+def test_incremental_calibrator(tmp_path, kwargs):
+    writer, _ = make_session(tmp_path / "cdi_output", nspectra=1)
+    data = [writer.cal_data(10 + i) for i in range(3)]
+    for i in range(3):
+        writer.cal_debug(20 + i)
+    files = sorted((tmp_path / "cdi_output").glob("*.bin"))
+    live = tmp_path / "live"
+    live.mkdir()
+    C = load(live, cache=False, **kwargs)
+    # refreshes split the calibrator units, by unique_packet_id their late pages join them
+    for start in range(0, len(files), 5):
+        for fn in files[start:start + 5]:
+            (live / fn.name).write_bytes(fn.read_bytes())
+        with contextlib.redirect_stdout(io.StringIO()):
+            C.refresh(incremental=True)
+    np.testing.assert_array_equal(C.calib_data, [d[0] for d in data])
+    np.testing.assert_array_equal(C.calib_gNacc, [d[1] for d in data])
+    np.testing.assert_array_equal(C.calib_gphase, [d[2] for d in data])
+    full = load(tmp_path / "cdi_output", cache=False)
+    for name in ("calib_data", "cd_drift", "cd_powertop0", "cd_snr3", "cd_error_averager"):
+        np.testing.assert_array_equal(getattr(C, name), getattr(full, name))
+    assert not C.calib_data.flags.writeable and not C.cd_drift.flags.writeable
+    if kwargs:
+        stats = C.assembly_stats()
+        assert all(stats[family]["orphaned"] == 0 for family in ("cal_data", "cal_debug"))
+        assert stats["cal_debug"]["late"] > 0
+
+
+def test_lazy(session):
+    path, spectra = session
+    C = load(path, lazy=True)
+    assert len(C.index) == len(C.files) == len(C)
+    assert list(C.index["seq"]) == list(range(len(C)))
+    np.testing.assert_array_equal(C.column("packet_count", uc.Packet_Heartbeat), np.arange(len(spectra)))
+    assert not any(P._is_read for S in C.spectra for P in S.values())
+    full = load(path)
+    assert C.spectra[0]["meta"].keys() == full.spectra[0]["meta"].keys()
+    np.testing.assert_array_equal(C.np_spectra(), full.np_spectra())
+    np.testing.assert_array_equal(C.np_tr_spectra(), full.np_tr_spectra())
+    np.testing.assert_array_equal(C.column("base.weight"), full.column("base.weight"))
+    assert C.all_spectra_crc_ok()
+
+
+def test_cache(session):
+    path, spectra = session
+    writer = SessionWriter(path)
+    writer.packet_count = len(list(path.glob("*.bin")))
+    writer.cal_data(10)
+    writer.cal_debug(11)
+    C = load(path)
+    assert not (path / ".uncrater_cache").exists()
+    C = load(path, cache=True)
+    assert len(list((path / ".uncrater_cache").glob("*.npz"))) == 1
+    cached = load(path, cache=True)
+    assert cached._read_lazily and not C._read_lazily
+    np.testing.assert_array_equal(cached.np_spectra(), C.np_spectra())
+    np.testing.assert_array_equal(cached.np_spectra(1, 3), C.np_spectra(1, 3))
+    np.testing.assert_array_equal(cached.np_tr_spectra(channel=2), C.np_tr_spectra(channel=2))
+    np.testing.assert_array_equal(cached.np_tr_spectra(1), C.np_tr_spectra(1))
+    np.testing.assert_array_equal(cached.column("base.ADC_stat.sumv"), C.column("base.ADC_stat.sumv"))
+    np.testing.assert_array_equal(cached.housekeeping_records(1), C.housekeeping_records(1))
+    for name in ("calib_data", "calib_gNacc", "calib_gphase", "cd_drift", "cd_powertop0", "cd_error_averager"):
+        np.testing.assert_array_equal(getattr(cached, name), getattr(C, name))
+    assert cached.cd_errors[0].averager_err[7] == 7
+    assert not any(P._is_read for S in cached.spectra for P in S.values())
+    assert not any(P._is_read for P in cached.calib_debug[0][1:])
+    assert not load(path, cache=False)._read_lazily
+
+    # an incremental refresh continues the restored arrays, only the new packets are decoded
+    writer.spectrum(300)
+    writer.cal_debug(12)
+    with contextlib.redirect_stdout(io.StringIO()):
+        cached.refresh(incremental=True)
+    full = load(path)
+    np.testing.assert_array_equal(cached.np_spectra(), full.np_spectra())
+    np.testing.assert_array_equal(cached.column("base.weight"), full.column("base.weight"))
+    np.testing.assert_array_equal(cached.cd_powertop0, full.cd_powertop0)
+    assert not any(P._is_read for S in cached.spectra[:-1] for P in S.values())
+    assert all(P._is_read for P in cached.spectra[-1].values())
+
+    # new files make the cache stale, it is rebuilt and replaces the old one
+    assert not load(path, cache=True)._read_lazily
+    assert len(list((path / ".uncrater_cache").glob("*.npz"))) == 1
+    assert load(path, cache=True)._read_lazily
+
+
+def test_workers(session):
+    path, spectra = session
+    C = load(path, cache=False)
+    P = load(path, cache=False, workers=2)
+    np.testing.assert_array_equal(P.np_spectra(), C.np_spectra())
+    np.testing.assert_array_equal(P.np_tr_spectra(), C.np_tr_spectra())
+    for S, T in zip(P.spectra, C.spectra):
+        for ch in range(16):
+            assert S[ch]._is_read and S[ch].meta is S["meta"]
+            assert S[ch].error_crc_mismatch == T[ch].error_crc_mismatch
+            assert S[ch].unique_packet_id == T[ch].unique_packet_id
+
+
+def test_workers_warnings(tmp_path):
+    writer, spectra = make_session(tmp_path / "cdi_output", nspectra=2)
+    writer.spectrum(200, bad_crc=(1, 2), spurious=(3,))
+    writer.spectrum(300, bad_crc=(5,))
+    printed = []
+    for workers in (1, 2):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            uc.Collection(str(tmp_path / "cdi_output"), cache=False, workers=workers)
+        printed.append(out.getvalue())
+    assert printed[0] == printed[1]
+    assert printed[0].count("CRC mismatch") == 3 and printed[0].count("Spurious data") == 1
+
+
+def test_filters(session):
+    path, spectra = session
+    full = load(path, cache=False)
+    C = load(path, include_appids=[uc.appid.AppID_uC_Heartbeat])
+    assert len(C) == C.num_heartbeats() == full.num_heartbeats()
+    assert not (path / ".uncrater_cache").exists()
+    # the metadata of selected products is kept
+    C = load(path, include_appids=[uc.appid.AppID_SpectraHigh + 2])
+    assert C.num_spectra_packets() == len(spectra)
+    assert all(sorted(S, key=str) == [2, "meta"] for S in C.spectra)
+    np.testing.assert_array_equal(C.np_spectra(channel=2), full.np_spectra(channel=2))
+    C = load(path, exclude_appids=[uc.appid.AppID_MetaData])
+    assert C.num_spectra_packets() == len(spectra)
+    assert C.num_housekeeping_packets() == full.num_housekeeping_packets()
+    C = load(path, index_range=(full.index["seq"][30], None), include_appids=[uc.appid.AppID_SpectraHigh + 1])
+    assert [S["meta"].unique_packet_id for S in C.spectra] == [101, 102, 103]
+    mtimes = full.index["mtime"]
+    C = load(path, time_range=(None, np.inf))
+    assert len(C) == len(full)
+    assert len(load(path, time_range=(mtimes.max() + 1, None))) == 0
+
+
+def test_spectra_cube(session, tmp_path):
+    path, spectra = session
+    C = load(path, cache=False)
+    cube = C.np_spectra()
+    assert cube.shape == (len(spectra), 16, 2048) and not np.ma.isMaskedArray(cube)
+    assert C.np_spectra() is cube
+    assert np.shares_memory(C.spectra[1][3].data, cube) and np.shares_memory(C.np_spectra(1, 3), cube)
+    assert np.shares_memory(C.np_tr_spectra(), C.np_tr_spectra(1, 5))
+    with pytest.raises(ValueError):
+        cube -= 1
+    with pytest.raises(ValueError):
+        C.np_tr_spectra()[0] = 0
+    value = cube[1, 3, 0]
+    C.spectra[1][3].data[0] = -1
+    assert C.np_spectra(1, 3)[0] == -1
+    C.spectra[1][3].data[0] = value
+    for kwargs in ({"lazy": True}, {"workers": 2}, {"cache": True}, {"cache": True}):
+        np.testing.assert_array_equal(load(path, **kwargs).np_spectra(), cube)
+        np.testing.assert_array_equal(load(path, **kwargs).np_tr_spectra(), C.np_tr_spectra())
+
+    writer, _ = make_session(tmp_path / "missing", nspectra=1)
+    writer.spectrum(200, skip=(7,))
+    C = load(tmp_path / "missing")
+    cube = C.np_spectra()
+    assert np.ma.isMaskedArray(cube)
+    assert cube.mask[1, 7].all() and not cube.mask[1, 6].any() and not cube.mask[0].any()
+
+
+def test_dtypes(session):
+    path, spectra = session
+    C = load(path, cache=False)
+    single = load(path, cache=False, dtype="float32")
+    assert single.np_spectra().dtype == np.float32 and single.spectra[0][5].data.dtype == np.float32
+    np.testing.assert_allclose(single.np_spectra(), C.np_spectra(), rtol=1e-6)
+    for kwargs in ({}, {"workers": 2}, {"lazy": True}, {"cache": True}, {"cache": True}):
+        raw = load(path, dtype="raw", **kwargs)
+        words = raw.np_spectra()
+        assert words.dtype == np.uint32 and 2 * words.nbytes == C.np_spectra().nbytes
+        np.testing.assert_array_equal(words, spectra.astype(np.uint32))
+        np.testing.assert_array_equal(raw.np_spectra(1), words[1])
+        for ch in (0, 5):
+            assert raw.np_spectra(channel=ch).dtype == raw.spectra[1][ch].data.dtype == (np.uint32 if ch < 4 else np.int32)
+            np.testing.assert_array_equal(raw.np_spectra(channel=ch), spectra[:, ch])
+            np.testing.assert_array_equal(raw.np_spectra(1, ch), spectra[1, ch])
+            np.testing.assert_allclose(raw.np_spectra(channel=ch) * raw.spectra_scale()[:, None], C.np_spectra(channel=ch))
+    assert raw.spectra[0][0].scale == raw.spectra_scale()[0]
+    raw = load(path, cache=False, dtype="raw")
+    assert np.shares_memory(raw.spectra[1][5].data, raw.np_spectra())
+    with pytest.raises(ValueError):
+        load(path, dtype="int8")
+
+
+def test_zero_weight(tmp_path):
+    # a spectrum whose every average was rejected loads with inf scale, as the data do
+    writer, spectra = make_session(tmp_path / "cdi_output", nspectra=1)
+    rejected = writer.spectrum(200, weight=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for dtype in ("float64", "float32", "raw"):
+            C = load(tmp_path / "cdi_output", cache=False, dtype=dtype)
+            assert len(C.spectra) == 2 and np.isinf(C.spectra[1][0].scale)
+            assert np.isinf(C.spectra_scale()[1])
+            if dtype == "raw":
+                np.testing.assert_array_equal(C.np_spectra(1, 5), rejected[5])
+            else:
+                assert not np.isfinite(C.np_spectra(1)[rejected != 0]).any()
+
+
+def test_cal_debug(tmp_path):
+    writer, _ = make_session(tmp_path / "cdi_output", nspectra=1)
+    cycles = [writer.cal_debug(10), writer.cal_debug(11, skip=(3,)), writer.cal_debug(12)]
+    C = load(tmp_path / "cdi_output", cache=False)
+    assert len(C.calib_debug) == 3 and len(C.cd_errors) == 2
+    complete = [cycles[0], cycles[2]]
+    np.testing.assert_array_equal(C.cd_powertop1, np.hstack([pages[1][:1024] for pages in complete]))
+    np.testing.assert_array_equal(C.cd_fd1, np.hstack([pages[3][2048:].view(np.int32) for pages in complete]))
+    np.testing.assert_array_equal(C.cd_snr3, np.hstack([pages[7][2048:] / 16.0 for pages in complete]))
+    np.testing.assert_array_equal(C.cd_have_lock, np.hstack([pages[0][:1024].view(np.uint16)[:1024] & 0xFF for pages in complete]))
+    np.testing.assert_array_equal(C.cd_error_phaser, [[1, 2, 3, 4, 2, 4, 6, 8]] * 2)
+    assert C.cd_error_averager.shape == (2, 16, 4) and C.cd_error_averager[0, 5, 0] == 5
+    assert C.cd_error_stage3.shape == (2, 16) and C.cd_error_process.shape == (2, 32)
+    assert C.cd_errors[1].averager_err[7] == 7
+    # int64 as the values used to be, differences of unsigned words do not wrap around
+    assert C.cd_powertop1.dtype == C.cd_fd1.dtype == C.cd_have_lock.dtype == C.calib_debug[0][1].powertop1.dtype == np.int64
+    np.testing.assert_array_equal(np.diff(C.cd_powertop1), np.diff(C.cd_powertop1.astype(float)))
+
+
+def test_reorder(tmp_path):
+    writer, spectra = make_session(tmp_path / "ordered", nspectra=6)
+    writer.cal_debug(10)
+    writer.spectrum(200, skip=(4,))
+    C = load(tmp_path / "ordered", cache=False)
+    # the packets are received in blocks of 20 in random order
+    files = sorted((tmp_path / "ordered").glob("*.bin"))
+    order = np.concatenate([np.random.default_rng(i).permutation(block) for i, block in enumerate(np.array_split(np.arange(len(files)), len(files) // 20))])
+    (tmp_path / "shuffled").mkdir()
+    for seq, i in enumerate(order):
+        (tmp_path / "shuffled" / f"{seq:05d}{files[i].name[5:]}").write_bytes(files[i].read_bytes())
+
+    R = load(tmp_path / "shuffled", cache=False, reorder_gap=100)
+    ids = R.column("unique_packet_id")
+    assert sorted(ids) == list(C.column("unique_packet_id"))
+    np.testing.assert_array_equal(R.np_spectra()[np.argsort(ids)], C.np_spectra())
+    np.testing.assert_array_equal(R.np_tr_spectra(), C.np_tr_spectra())
+    np.testing.assert_array_equal(R.cd_powertop0, C.cd_powertop0)
+    stats = R.assembly_stats()
+    assert stats["spectra"]["complete"] == 6 and stats["spectra"]["incomplete"] == 1
+    assert stats["tr_spectra"]["complete"] == 3 and stats["cal_debug"]["complete"] == 1
+    assert load(tmp_path / "ordered", cache=False).assembly_stats() is None
+
+
+def test_reorder_in_order_session(tmp_path):
+    writer = SessionWriter(tmp_path / "cdi_output")
+    # the session starts with the products of a spectrum whose metadata is missing
+    writer.spectrum(99)
+    next(iter(sorted((tmp_path / "cdi_output").glob("*.bin")))).unlink()
+    writer.hello()
+    for i in range(5):
+        writer.heartbeat(i)
+        writer.spectrum(100 + i, skip=(3,) if i == 2 else ())
+        writer.tr_spectrum(100 + i)
+    writer.cal_debug(10)
+    C = load(tmp_path / "cdi_output")
+    for kwargs in ({"reorder_gap": 30}, {"reorder_gap": 30, "cache": True}, {"reorder_gap": 30, "cache": True}):
+        R = load(tmp_path / "cdi_output", **kwargs)
+        assert len(R) == len(C) and R.num_spectra_packets() == C.num_spectra_packets() == 5
+        assert [sorted(S, key=str) for S in R.spectra] == [sorted(S, key=str) for S in C.spectra]
+        np.testing.assert_array_equal(R.column("unique_packet_id"), C.column("unique_packet_id"))
+        np.testing.assert_array_equal(R.np_spectra(), C.np_spectra())
+        np.testing.assert_array_equal(R.np_tr_spectra(), C.np_tr_spectra())
+        np.testing.assert_array_equal(R.cd_powertop0, C.cd_powertop0)
+    assert len(R.orphaned_packets) == 16 and R.assembly_stats()["spectra"]["orphaned"] == 1
+
+
+def test_integrity(tmp_path):
+    writer, spectra = make_session(tmp_path / "cdi_output", nspectra=2)
+    writer.heartbeat(5)
+    writer.spectrum(200, skip=(4, 9), bad_crc=(1, 2))
+    writer.tr_spectrum(200)
+    for kwargs in ({"cache": False}, {"cache": False, "lazy": True}):
+        C = load(tmp_path / "cdi_output", **kwargs)
+        report = C.integrity(workers=2)
+        assert C.integrity() is report
+        assert report.summary() == {"crc_failures": 2, "tr_crc_failures": 0, "id_mismatches": 0, "tr_id_mismatches": 0,
+                                    "missing_products": 2, "missing_tr_products": 0, "heartbeat_gaps": 1, "error_spectra": 0}
+        assert report.crc_failures()[["spectrum", "product"]].tolist() == [(2, 1), (2, 2)]
+        assert report.missing_products().tolist() == [[2, 4], [2, 9]]
+        assert len(report.packets) == 3 * 16 - 2 + 2 * 16
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            assert C.all_spectra_crc_ok() == 0 and C.has_all_products() == 0 and C.heartbeat_counter_ok() == 0
+            assert C.all_tr_spectra_crc_ok() == 1 and C.has_all_tr_products() == 1 and C.all_meta_error_free() == 1
+        assert out.getvalue().count("\n") == 5
+    assert not any(S[5]._is_read or S[5]._blob is not None for S in C.spectra)
+
+    writer.spectrum(201, spurious=(3,))
+    reports = []
+    for kwargs in ({"cache": False}, {"cache": False, "lazy": True}, {"cache": False, "workers": 2}):
+        with contextlib.redirect_stdout(io.StringIO()):
+            C = load(tmp_path / "cdi_output", **kwargs)
+            reports.append(C.integrity().packets)
+        # the scan reads no blob again for packets decoded in workers
+        assert kwargs.get("workers") is None or all(P._blob is None for S in C.spectra for P in S.values() if P is not S["meta"])
+    np.testing.assert_array_equal(reports[0], reports[1])
+    np.testing.assert_array_equal(reports[0], reports[2])
+    assert reports[0]["crc_ok"].sum() == len(reports[0]) - 2
@@ -3,7 +3,7 @@ import pytest
 import random
 
 from bit_utils import *
-from uncrater.c_utils import decode_10plus6, encode_10plus6
+from uncrater.c_utils import decode_10plus6, encode_10plus6, _decode_10plus6_scalar
 
 
 @pytest.fixture
@@ -32,6 +32,24 @@ def test_signed(utils_lib):
     assert first_k_bits_match(a, a_back, MATCHING_BITS - 3)
 
 
+def test_array_decode_matches_scalar():
+    # every possible 16 bit word, compared modulo 2**32 as the C code wraps on overflow
+    words = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16)
+    decoded = decode_10plus6(words)
+    assert decoded.dtype == np.int32
+    expected = np.array([_decode_10plus6_scalar(int(w)) & 0xFFFFFFFF for w in words], dtype=np.uint32)
+    np.testing.assert_array_equal(decoded.view(np.uint32), expected)
+
+
+def test_array_decode_stack(utils_lib):
+    a = np.random.randint(-(2**31), 2**31 - 1, size=(16, 2048), dtype=np.int64).astype(np.int32)
+    encoded = np.array([encode_10plus6(row) for row in a])
+    decoded = decode_10plus6(encoded)
+    assert decoded.shape == a.shape
+    for row_enc, row_dec in zip(encoded, decoded):
+        np.testing.assert_array_equal(decode_10plus6(row_enc), row_dec)
+
+
 # if __name__ == "__main__":
 #     np.random.seed(42)
 #     # need to comment out fixture decorator to call like that
@@ -130,6 +130,23 @@ def test_lz_lens_signed(utils_lib):
     helper_lz_lens(is_signed=True, lzs_signs_lens=lz_signs_lens, utils_lib=utils_lib)
 
 
+def test_long_segments(utils_lib):
+    # runs longer than 255 samples must be split over several segments
+    lz_lens = [(12, 600), (3, 1), (20, 300), (31, 2), (32, 255), (0, 256)]
+    helper_lz_lens(is_signed=False, lzs_signs_lens=lz_lens, utils_lib=utils_lib)
+    lz_signs_lens = [(12, False, 600), (12, True, 511), (20, False, 300), (32, False, 255), (1, True, 256)]
+    helper_lz_lens(is_signed=True, lzs_signs_lens=lz_signs_lens, utils_lib=utils_lib)
+
+
+def test_array_size_mismatch(utils_lib):
+    a = random_array(lzs_signs_lens=[(10, False, 100), (20, True, 100)])
+    a_compressed = encode_array_signed(a, utils_lib)
+    np.testing.assert_array_equal(decode_array_signed(a_compressed, 150, utils_lib), decode_array_signed(a_compressed, 200, utils_lib)[:150])
+    a_back = decode_array_signed(a_compressed, 250, utils_lib)
+    assert np.all(a_back[200:] == 0)
+    assert all_close(a, a_back[:200])
+
+
 # if __name__ == "__main__":
 #     np.random.seed(42)
 #     # need to comment out fixture decorator to call like that
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import os
+
+import numpy as np
+
+import uncrater as uc
+from uncrater.packed_session import PackedSessionWriter, pack_session, read_index
+from session_utils import make_session
+
+
+def load(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return uc.Collection(str(path), **kwargs)
+
+
+def test_pack_and_read(tmp_path):
+    make_session(tmp_path / "cdi_output")
+    packed = str(tmp_path / "session.pack")
+    nfiles = len(list((tmp_path / "cdi_output").glob("*.bin")))
+    assert pack_session(str(tmp_path / "cdi_output"), packed) == nfiles
+    index, mm = read_index(packed)
+    assert len(index) == nfiles
+    blob = bytes(mm[index["offset"][3]:index["offset"][3] + index["size"][3]])
+    assert blob == (tmp_path / "cdi_output" / f"00003_{index['appid'][3]:04x}.bin").read_bytes()
+
+    C, D = load(packed, cache=True), load(tmp_path / "cdi_output")
+    assert len(C) == len(D)
+    np.testing.assert_array_equal(C.index, D.index)
+    np.testing.assert_array_equal(C.np_spectra(), D.np_spectra())
+    np.testing.assert_array_equal(C.np_tr_spectra(), D.np_tr_spectra())
+    np.testing.assert_array_equal(C.column("packet_count", uc.Packet_Heartbeat), D.column("packet_count", uc.Packet_Heartbeat))
+    assert isinstance(C.spectra[0][0]._blob, memoryview)
+    assert load(packed, cache=True)._read_lazily
+
+
+def test_append_without_sidecar(tmp_path):
+    _, spectra = make_session(tmp_path / "cdi_output", nspectra=2)
+    packed = str(tmp_path / "session.pack")
+    pack_session(str(tmp_path / "cdi_output"), packed)
+    C = load(packed, cache=False)
+    hb = bytes(C.heartbeat_packets[0]._blob)
+    with PackedSessionWriter(packed) as writer:
+        writer.append(uc.appid.AppID_uC_Heartbeat, hb)
+    # records not in the sidecar are found by walking the record headers
+    os.remove(packed + ".idx")
+    with contextlib.redirect_stdout(io.StringIO()):
+        C.refresh(incremental=True)
+    assert C.num_heartbeats() == 3
+    assert C.index["seq"][-1] == len(C) - 1
+    # a truncated record at the end is skipped
+    with open(packed, "ab") as f:
+        f.write(b"\x10\x00")
+    assert len(read_index(packed)[0]) == len(C)
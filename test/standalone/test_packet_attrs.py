@@ -0,0 +1,80 @@
+import uncrater as uc
+from uncrater.coreloop import pycoreloop_307
+
+ps = pycoreloop_307.pystruct
+
+
+def make_hk0():
+    hk = ps.housekeeping_data_0()
+    hk.base.version = ps.VERSION_ID
+    hk.base.unique_packet_id = 42
+    hk.base.housekeeping_type = 0
+    hk.core_state.base.time_32 = 4096
+    hk.core_state.base.ADC_stat[1].max = 100
+    return uc.Packet(uc.id.AppID_uC_Housekeeping, blob=bytes(hk), version=0x307)
+
+
+def test_struct_fields_as_attributes():
+    P = make_hk0()
+    assert P.hk_type == 0
+    assert P.base.unique_packet_id == 42
+    assert P.core_state.base.time_32 == 4096
+    assert P.core_state is P.core_state
+    assert P.core_state.base.ADC_stat[1].max == 100
+    assert not hasattr(P, "no_such_field")
+
+
+def test_keys_and_getitem():
+    P = make_hk0()
+    keys = P.keys()
+    assert "base.unique_packet_id" in keys
+    assert "core_state.base.time_32" in keys
+    assert "hk_type" in keys
+    assert P["core_state.base.time_32"] == 4096
+    assert P["base.housekeeping_type"] == 0
+
+
+def test_lazy_keys():
+    blob = bytes(make_hk0()._blob)
+    eager = uc.Packet(uc.id.AppID_uC_Housekeeping, blob_fn=lambda: blob)
+    eager.read()
+    lazy = uc.Packet(uc.id.AppID_uC_Housekeeping, blob_fn=lambda: blob, lazy=True)
+    assert lazy.keys() == eager.keys()
+    lazy = uc.Packet(uc.id.AppID_uC_Housekeeping, blob_fn=lambda: blob, lazy=True)
+    assert dir(lazy) == dir(eager)
+
+
+def test_version_detection():
+    from uncrater.coreloop import bindings_for, struct_for, pycoreloop_203, pycoreloop_305
+    assert bindings_for(0x203) is pycoreloop_203
+    assert bindings_for(0x305) is pycoreloop_305
+    assert struct_for(0x305, "meta_data") is pycoreloop_305.pystruct.meta_data
+    hk = ps.housekeeping_data_0()
+    hk.base.version = ps.VERSION_ID
+    P = uc.Packet(uc.id.AppID_uC_Housekeeping, blob=bytes(hk))
+    P.read()
+    assert P._version == 0x307
+    assert P._pystruct() is ps
+    hello = ps.startup_hello()
+    hello.SW_version = 0x305
+    P = uc.Packet(uc.id.AppID_uC_Start, blob=bytes(hello))
+    P.read()
+    assert P._version == 0x305
+
+
+def test_calibrator_data_arrays():
+    import struct
+    import numpy as np
+    words = np.arange(1025, dtype="<i4") - 512
+    blob = struct.pack("<III", 7, 0, 0) + np.resize(words, 2048).tobytes()
+    P = uc.Packet(uc.id.AppID_Calibrator_Data, blob=blob)
+    assert P.data.shape == (4, 512) and P.data.dtype == np.int64
+    P.data += 1
+    P = uc.Packet(uc.id.AppID_Calibrator_Data + 2, blob_fn=lambda: struct.pack("<III", 7, 0, 0) + words.tobytes())
+    P.set_meta_id(7)
+    P.read()
+    assert P.gNacc == -512 and P.gphase.dtype == np.int64 and P.gphase.flags.writeable
+    P = uc.Packet(uc.id.AppID_Calibrator_RawPFB, blob=blob)
+    assert P.data.dtype == np.int64 and len(P.data) == 2048 and P.data.flags.writeable
+    P = uc.Packet(uc.id.AppID_SpectraGrimm, blob=struct.pack("<I", 7) + bytes(5 * 2 * 16))
+    assert P.unique_packet_id == 7
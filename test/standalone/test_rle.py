@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import random
+
+from uncrater.utils import rle_decode
+
+
+def rle_encode(data: bytes) -> bytes:
+    # python version of rle_encode in utils.c of coreloop
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        byte = data[i]
+        if byte in (0x00, 0xFF):
+            j = i
+            while j < len(data) and data[j] == byte and j - i < 255:
+                j += 1
+            out.append(0x8C if byte == 0x00 else 0x8D)
+            out.append(j - i)
+            i = j
+        else:
+            out.append(byte)
+            if byte in (0x8C, 0x8D):
+                out.append(0)
+            i += 1
+    return bytes(out)
+
+
+@pytest.fixture
+def rng():
+    np.random.seed(42)
+    random.seed(42)
+
+
+def test_roundtrip(rng):
+    size = 3 * 1024 * 4
+    for _ in range(20):
+        chunks = []
+        while sum(len(c) for c in chunks) < size:
+            byte = random.choice([0x00, 0x00, 0xFF, 0x8C, 0x8D, random.randint(0, 255)])
+            chunks.append(bytes([byte]) * random.randint(1, 400))
+        data = b"".join(chunks)[:size]
+        encoded = rle_encode(data)
+        assert len(encoded) < size
+        assert rle_decode(encoded, size) == data
+
+
+def test_long_runs():
+    data = bytes(1000) + b"\x8c\x8d" + b"\xff" * 600 + b"\x01"
+    assert rle_decode(rle_encode(data), 12288) == data
+
+
+def test_uncompressed_passthrough():
+    data = bytes(range(256))
+    assert rle_decode(data, len(data)) is data
+
+
+def test_truncated_marker():
+    with pytest.raises(ValueError, match="0x8C"):
+        rle_decode(b"\x01\x02\x8c", 100)
+    with pytest.raises(ValueError, match="0x8D"):
+        rle_decode(b"\x8c\x02\x8d", 100)
+    # a count byte equal to a marker value is not a truncated marker
+    assert rle_decode(b"\x01\x8d\x8c", 1000) == b"\x01" + b"\xff" * 0x8C
@@ -0,0 +1,59 @@
+import contextlib
+import io
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import uncrater as uc
+from uncrater.session_export import load_export
+from session_utils import make_session
+
+
+def load(path, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return uc.Collection(str(path), **kwargs)
+
+
+@pytest.fixture
+def session(tmp_path):
+    writer, spectra = make_session(tmp_path / "cdi_output")
+    writer.cal_debug(10)
+    writer.spectrum(200, skip=(3,))
+    return tmp_path / "cdi_output"
+
+
+@pytest.mark.parametrize("format", ["npz", "npy", "hdf5", "parquet"])
+def test_export(session, tmp_path, format):
+    if format == "hdf5":
+        pytest.importorskip("h5py")
+    if format == "parquet":
+        pytest.importorskip("pyarrow")
+    C = load(session, cache=False)
+    C.export(str(tmp_path / "export"), format=format, chunk_size=2)
+    exported = load_export(str(tmp_path / "export"))
+    np.testing.assert_array_equal(exported["spectra"][:], C.np_spectra().filled(0))
+    np.testing.assert_array_equal(exported["spectra_present"][:], ~C.np_spectra().mask.any(axis=2))
+    np.testing.assert_array_equal(exported["tr_spectra"][:], C._tr_spectra_cube())
+    np.testing.assert_array_equal(exported["meta"][:], C.meta_records())
+    np.testing.assert_array_equal(exported["housekeeping_1"][:], C.housekeeping_records(1))
+    np.testing.assert_array_equal(exported["cd_powertop0"][:], C.cd_powertop0)
+    np.testing.assert_array_equal(exported["index"][:], C.index)
+    if format == "npy":
+        assert isinstance(exported["spectra"], np.memmap)
+
+
+def test_lazy_export(session, tmp_path):
+    C = load(session, cache=False, lazy=True, dtype="raw")
+    C.export(str(tmp_path / "export.npz"))
+    assert not any(S[0]._is_read for S in C.spectra)
+    raw = load_export(str(tmp_path / "export.npz"))["spectra"]
+    assert raw.dtype == np.uint32
+    np.testing.assert_array_equal(raw, load(session, cache=False, dtype="raw").np_spectra().filled(0))
+
+
+def test_cli(session, tmp_path):
+    subprocess.run([sys.executable, "-m", "uncrater.session_export", str(session), str(tmp_path / "out"), "--format", "npy"],
+                   check=True, capture_output=True)
+    assert load_export(str(tmp_path / "out"))["spectra"].shape == (5, 16, 2048)
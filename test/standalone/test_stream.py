@@ -0,0 +1,59 @@
+import collections
+import contextlib
+import io
+
+import numpy as np
+
+import uncrater as uc
+from session_utils import make_session
+
+
+def test_iter_packets(tmp_path):
+    path = tmp_path / "cdi_output"
+    _, spectra = make_session(path)
+    kinds = collections.Counter(kind for kind, unit in uc.iter_packets(str(path)))
+    assert kinds == {"spectrum": 4, "tr_spectrum": 2, "packet": 1 + 3 * 4}
+    weights = np.arange(1, len(spectra) + 1)
+    for k, S in enumerate(uc.iter_spectra(str(path))):
+        assert S["meta"].unique_packet_id == 100 + k
+        np.testing.assert_allclose([S[ch].data for ch in range(16)], spectra[k] / weights[k])
+
+
+def test_cut_to_hello(tmp_path):
+    path = tmp_path / "cdi_output"
+    writer, _ = make_session(path, nspectra=2)
+    writer.hello()
+    writer.spectrum(200)
+    spectra = list(uc.iter_spectra(str(path), cut_to_hello=True))
+    assert [S["meta"].unique_packet_id for S in spectra] == [200]
+
+
+def test_assembly_as_collection(tmp_path):
+    writer, _ = make_session(tmp_path / "ordered", nspectra=6)
+    writer.cal_data(7)
+    writer.cal_debug(10)
+    writer.cal_debug(11, skip=(5,))
+    writer.spectrum(200, skip=(4,))
+    # the packets are received in blocks of 20 in random order
+    files = sorted((tmp_path / "ordered").glob("*.bin"))
+    order = np.concatenate([np.random.default_rng(i).permutation(block) for i, block in enumerate(np.array_split(np.arange(len(files)), len(files) // 20))])
+    (tmp_path / "shuffled").mkdir()
+    for seq, i in enumerate(order):
+        (tmp_path / "shuffled" / f"{seq:05d}{files[i].name[5:]}").write_bytes(files[i].read_bytes())
+
+    for name, kwargs in (("ordered", {}), ("shuffled", {"reorder_gap": 100}),
+                         ("ordered", {"include_appids": [uc.appid.AppID_SpectraHigh + 2, uc.appid.AppID_Calibrator_Debug]})):
+        path = str(tmp_path / name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            C = uc.Collection(path, cache=False, **kwargs)
+        units = collections.defaultdict(list)
+        for kind, unit in uc.iter_packets(path, **kwargs):
+            units[kind].append(unit)
+        for streamed, spectra in ((units["spectrum"], C.spectra), (units["tr_spectrum"], C.tr_spectra)):
+            assert [sorted(S, key=str) for S in streamed] == [sorted(S, key=str) for S in spectra]
+            for S, T in zip(streamed, spectra):
+                assert S["meta"].unique_packet_id == T["meta"].unique_packet_id
+                for slot in S.keys() - {"meta"}:
+                    np.testing.assert_array_equal(S[slot].data, T[slot].data)
+        assert [[P is None for P in unit] for unit in units["cal_debug"]] == [[P is None for P in c] for c in C.calib_debug]
+        assert len(units["cal_data"]) == len(C.calib_data)
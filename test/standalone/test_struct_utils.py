@@ -0,0 +1,62 @@
+import ctypes
+
+import numpy as np
+import pytest
+
+from uncrater.coreloop import pycoreloop_203, pycoreloop_305, pycoreloop_307
+from uncrater.struct_utils import ctypes_to_dtype, decode_structs
+
+
+def all_structs():
+    for module in [pycoreloop_203, pycoreloop_305, pycoreloop_307]:
+        ps = module.pystruct
+        for name in dir(ps):
+            obj = getattr(ps, name)
+            if isinstance(obj, type) and issubclass(obj, ctypes.Structure) and obj.__module__ == ps.__name__:
+                yield obj
+
+
+def test_layout_matches_ctypes():
+    structs = list(all_structs())
+    assert len(structs) > 0
+    for struct in structs:
+        assert ctypes_to_dtype(struct).itemsize == ctypes.sizeof(struct), struct.__name__
+
+
+def test_decode_meta_data():
+    ps = pycoreloop_307.pystruct
+    blobs = []
+    for i in range(5):
+        m = ps.meta_data()
+        m.unique_packet_id = 100 + i
+        m.base.weight = 7 * i
+        m.base.time_32 = 0xFFFFFFF0 + i
+        m.base.ADC_stat[2].sumv2 = 2**40 + i
+        m.base.ADC_stat[3].min = -i
+        m.base.actual_gain[1] = i
+        # blobs may be longer than the struct
+        blobs.append(bytes(m) + b"\0" * i)
+
+    records = decode_structs(blobs, ps.meta_data)
+    for i, blob in enumerate(blobs):
+        m = ps.meta_data.from_buffer_copy(blob)
+        assert records["unique_packet_id"][i] == m.unique_packet_id
+        assert records["base"]["weight"][i] == m.base.weight
+        assert records["base"]["time_32"][i] == m.base.time_32
+        assert records["base"]["ADC_stat"]["sumv2"][i, 2] == m.base.ADC_stat[2].sumv2
+        assert records["base"]["ADC_stat"]["min"][i, 3] == m.base.ADC_stat[3].min
+        np.testing.assert_array_equal(records["base"]["actual_gain"][i], list(m.base.actual_gain))
+
+
+def test_decode_heartbeat_magic():
+    ps = pycoreloop_307.pystruct
+    hb = ps.heartbeat()
+    hb.magic = b"BRNMRL"
+    records = decode_structs([bytes(hb)], ps.heartbeat)
+    assert records["magic"][0] == hb.magic
+
+
+def test_short_blob():
+    ps = pycoreloop_307.pystruct
+    with pytest.raises(ValueError):
+        decode_structs([b"\0" * 10], ps.meta_data)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from uncrater.utils import (Time2Time, Time2Time_array, cordic2rad, cordic2rad_array, rad2cordic,
+                            rad2cordic_array, cordic_add, cordic_add_array)
+
+
+def test_array_versions_match_scalars():
+    rng = np.random.default_rng(0)
+    time_32 = rng.integers(0, 2**32, 500, dtype=np.uint32)
+    time_16 = rng.integers(0, 2**32, 500, dtype=np.uint32)
+    np.testing.assert_array_equal(Time2Time_array(time_32, time_16),
+                                  [Time2Time(int(t1), int(t2)) for t1, t2 in zip(time_32, time_16)])
+    words = rng.integers(0, 2**32, 500, dtype=np.uint32)
+    np.testing.assert_array_equal(cordic2rad_array(words), [cordic2rad(int(w)) for w in words])
+    np.testing.assert_array_equal(cordic2rad(words), cordic2rad_array(words))
+    angles = np.concatenate((rng.uniform(-7, 7, 500), [np.pi, -np.pi, 0.0]))
+    np.testing.assert_array_equal(rad2cordic_array(angles), [rad2cordic(float(a)) for a in angles])
+    other = rng.integers(0, 2**32, 500, dtype=np.uint32)
+    np.testing.assert_array_equal(cordic_add_array(words, other), [cordic_add(int(a), int(b)) for a, b in zip(words, other)])
+    assert Time2Time_array(time_32, time_16).dtype == np.float64
+    assert rad2cordic_array(angles).dtype == cordic_add_array(words, other).dtype == np.int64
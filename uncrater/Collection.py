@@ -1,182 +1,759 @@
 import os, sys
+import io
 import glob
+import types
+import functools
+import contextlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 
 from datetime import datetime
 
 from .Packet import *
+from .coreloop import pycoreloop
 
 from .error_utils import *
+from .struct_utils import decode_structs, ctypes_to_dtype
+from .utils import Time2Time_array, process_ADC_stats_batch, process_telemetry_batch, adc_stat_keys, telemetry_keys
+from .session_cache import fingerprint, load_cache, save_cache
+from .packed_session import is_packed_session, read_index, blob_view, read_blob
+from .assembly import PacketAssembler
+from .integrity import integrity_scan
+from .session_export import export_collection
+
+
+def scan_session(path, after=-1):
+    """ Lists the packets of a cdi_output directory or a packed session with a sequence
+        number above after, in sequence order, as tuples (seq, appid, size, mtime, source).
+        The source is the file name or, for packed sessions, a callable returning the blob;
+        either can be passed to Packet as blob_fn.
+    """
+    entries = []
+    if is_packed_session(path):
+        index, mm = read_index(path)
+        for seq, appid, size, mtime, offset in index[index["seq"] > after].tolist():
+            entries.append((seq, appid, size, mtime, functools.partial(blob_view, mm, offset, size)))
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name.startswith(".") or not entry.name.endswith(".bin"):
+                continue
+            parts = entry.name[:-len(".bin")].split("_")
+            seq, appid = parts[0], parts[-1]
+            if int(seq) > after:
+                st = entry.stat()
+                entries.append((int(seq), int(appid, 16), st.st_size, st.st_mtime, entry.path))
+    entries.sort()
+    return entries
+
+
+class EntryFilter:
+    """ Selects entries of scan_session by appid, receive time and sequence number, see
+        Collection. The metadata of selected spectra is kept at its place, and the last
+        metadata is remembered for spectra in the entries of a later scan.
+    """
+
+    def __init__(self, include_appids=None, exclude_appids=None, time_range=None, index_range=None):
+        self.include_appids = None if include_appids is None else set(include_appids)
+        self.exclude_appids = set() if exclude_appids is None else set(exclude_appids)
+        self.time_range = (None, None) if time_range is None else time_range
+        self.index_range = (None, None) if index_range is None else index_range
+        self.active = (include_appids is not None or exclude_appids is not None
+                       or time_range is not None or index_range is not None)
+        self.reset()
+
+    def reset(self):
+        self._meta_entry = None
+        self._meta_pos = 0
+
+    def selected(self, seq, appid, mtime):
+        if self.include_appids is not None and appid not in self.include_appids:
+            return False
+        if appid in self.exclude_appids:
+            return False
+        t0, t1 = self.time_range
+        if (t0 is not None and mtime < t0) or (t1 is not None and mtime >= t1):
+            return False
+        i0, i1 = self.index_range
+        return not ((i0 is not None and seq < i0) or (i1 is not None and seq >= i1))
+
+    def select(self, entries):
+        # entries passing the filters, plus the metadata of selected spectra at its place
+        selected = []
+        for entry in entries:
+            seq, appid, size, mtime, source = entry
+            if appid_is_metadata(appid):
+                self._meta_entry, self._meta_pos = entry, len(selected)
+            if self.selected(seq, appid, mtime):
+                if appid_is_metadata(appid):
+                    self._meta_entry = None
+                elif (appid_is_spectrum(appid) or appid_is_tr_spectrum(appid)) and self._meta_entry is not None:
+                    selected.insert(self._meta_pos, self._meta_entry)
+                    self._meta_entry = None
+                selected.append(entry)
+        self._meta_pos = 0
+        return selected
+
+
+# attributes a spectral packet gets from the parent process rather than from decoding
+_parent_attrs = ("appid", "meta", "_blob", "_blob_fn", "_version", "_lazy")
+# the fields of the metadata that spectral packets decode with, sent to the workers instead of the metadata
+_meta_base_fields = ("Navg2_shift", "tr_start", "tr_stop", "tr_avg_shift")
+
+
+def _meta_fields(meta):
+    base = types.SimpleNamespace(**{name: getattr(meta.base, name) for name in _meta_base_fields})
+    return types.SimpleNamespace(unique_packet_id=meta.unique_packet_id, format=meta.format, weight=meta.weight,
+                                 base=base)
+
+
+def _decode_spectra(groups, dtype="float64"):
+    # runs in a worker process: decodes groups of (metadata fields, version, [(appid, source), ...])
+    # and returns the decoded attributes of every spectral packet in order, not the packets, with
+    # what decoding it printed so that the parent prints the warnings in order
+    results = []
+    for meta, version, products in groups:
+        for appid, source in products:
+            packet = Packet(appid, blob_fn=_blob_source(source), version=version)
+            packet.set_meta(meta)
+            if appid_is_spectrum(appid):
+                packet.dtype = dtype
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                packet.read()
+            results.append(({k: v for k, v in packet.__dict__.items() if k not in _parent_attrs}, out.getvalue()))
+    return results
+
+
+def _blob_source(source):
+    # file names pass as they are, blobs of packed sessions as (file name, offset, size)
+    return source if isinstance(source, str) else functools.partial(read_blob, *source)
+
+
+class _ProductCube:
+    # the data of the 16 products of consecutive spectra in one preallocated array of shape
+    # (spectra, 16) + product shape; products placed in it keep a view of their slot as data.
+    # With words, 32 bit integer products are kept as their uint32 words and each one views
+    # its slot with its own type, e.g. the unsigned auto and signed cross products of raw spectra
+    def __init__(self, words=False):
+        self.words = words
+        self.capacity = 0
+        self.data = None
+        self.present = None
+        self.packets = {}
+        self.pending = []  # (row, product, packet) of products not decoded yet
+        self.valid = True
+
+    def reserve(self, capacity):
+        self.capacity = max(self.capacity, capacity)
+
+    def load(self, array):
+        # complete rows restored from the session cache; their packets stay unread
+        self.data = array
+        self.present = np.ones(array.shape[:2], dtype=bool)
+        self.pending = [item for item in self.pending if item[0] >= len(array)]
+
+    def place(self, row, product, packet):
+        data = packet.data
+        if not self.valid:
+            return
+        if self.data is None:
+            self.data = np.zeros((max(self.capacity, row + 1), 16) + data.shape,
+                                 dtype=np.uint32 if self.words else data.dtype)
+            self.present = np.zeros(self.data.shape[:2], dtype=bool)
+        elif data.shape != self.data.shape[2:]:
+            # products of different shapes do not fit in one cube
+            self.valid = False
+            self.data = self.present = None
+            self.packets = {}
+            return
+        elif row >= len(self.data) or (data.dtype != self.data.dtype and not self.words):
+            self._resize(max(row + 1, 2 * len(self.data), self.capacity) if row >= len(self.data) else len(self.data),
+                         np.result_type(self.data.dtype, data.dtype))
+        self.data[row, product] = data.view(np.uint32) if self.words else data
+        self.present[row, product] = True
+        self.packets[(row, product)] = packet
+        packet.data = self._slot(row, product, data.dtype)
+
+    def _slot(self, row, product, dtype):
+        slot = self.data[row, product]
+        return slot.view(dtype) if self.words else slot
+
+    def stack(self, products):
+        # the data of the products of one spectrum, as the cube holds them
+        return np.array([P.data.view(np.uint32) if self.words else P.data for P in products])
+
+    def _resize(self, rows, dtype):
+        data_before, present_before = self.data, self.present
+        self.data = np.zeros((rows, 16) + data_before.shape[2:], dtype=dtype)
+        self.present = np.zeros((rows, 16), dtype=bool)
+        self.data[:len(data_before)] = data_before
+        self.present[:len(present_before)] = present_before
+        for (r, p), P in self.packets.items():
+            P.data = self._slot(r, p, P.data.dtype)
+
+    def array(self, rows):
+        # the first rows spectra, masked where products are missing; read-only, so that
+        # callers cannot change the data of the packets through it
+        if self.data is None:
+            return None
+        data = self.data[:rows]
+        data.flags.writeable = False
+        missing = ~self.present[:rows]
+        if missing.any():
+            mask = np.broadcast_to(missing.reshape(missing.shape + (1,) * (data.ndim - 2)), data.shape)
+            return np.ma.MaskedArray(data, mask=mask.copy())
+        return data
+
+
+class _GrowingRows:
+    # rows appended to one preallocated array that doubles when it is full, so that each
+    # refresh only writes the rows that came in with it
+    def __init__(self):
+        self.data = None
+        self.count = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows)
+        if self.data is None:
+            self.data = np.zeros((max(16, len(rows)),) + rows.shape[1:], dtype=rows.dtype)
+        elif self.count + len(rows) > len(self.data) or rows.dtype != self.data.dtype:
+            data = np.zeros((max(self.count + len(rows), 2 * len(self.data)),) + self.data.shape[1:],
+                            dtype=np.result_type(self.data.dtype, rows.dtype))
+            data[:self.count] = self.data[:self.count]
+            self.data = data
+        self.data[self.count:self.count + len(rows)] = rows
+        self.count += len(rows)
+
+    def row(self, i):
+        return self.data[i]
+
+    def view(self):
+        # read-only, so that changes by the caller do not leak into later refreshes
+        view = self.data[:self.count] if self.data is not None else np.zeros(0)
+        view.flags.writeable = False
+        return view
+
+
+class _CalDebugCycles:
+    # the 1024 word rows of complete 8 page calibrator debug cycles, written into one
+    # preallocated (cycles, 1024) array per cd_ attribute as the cycles complete
+    fields = {page: [name for name, _ in filter(None, layout) if name != "drift"]
+              for page, layout in Packet_Cal_Debug.page_layout.items()}
+    fields[0] = ["have_lock", "lock_ant"] + fields[0]
+
+    def __init__(self):
+        self.capacity = 0
+        self.rows = 0
+        self.count = 0
+        self.arrays = {}
+        self.errors = None      # error registers of the cycles as a structured array
+        self.error_regs = []    # and as the ctypes structs of the metadata
+
+    def reserve(self, capacity):
+        self.capacity = max(self.capacity, capacity)
+
+    def add(self, cycle, write=True):
+        """ Writes a complete cycle into the next row and returns the row. With write=False
+            the row is only counted, for cycles restored from the session cache.
+        """
+        row = self.count
+        self.count += 1
+        self.error_regs.append(None)
+        if write:
+            if row >= self.rows:
+                self._resize(max(row + 1, 2 * row, self.capacity))
+            for packet in cycle:
+                self.write(row, packet)
+        return row
+
+    def load(self, arrays, errors):
+        # cycles restored from the session cache
+        self.arrays = arrays
+        self.errors = errors
+        self.rows = self.count = len(errors)
+        reg_type = dict(pycoreloop.pystruct.calibrator_metadata._fields_)["error_reg"]
+        self.error_regs = [reg_type.from_buffer_copy(record.tobytes()) for record in errors]
+
+    def write(self, row, packet):
+        packet.read()
+        for name in self.fields[packet.debug_page]:
+            value = packet.__dict__.get(name)
+            if value is None:
+                continue
+            if name not in self.arrays:
+                self.arrays[name] = np.zeros((self.rows, len(value)), dtype=value.dtype)
+            self.arrays[name][row] = value
+        if packet.debug_page == 0:
+            reg = packet.metadata.error_reg
+            if self.errors is None:
+                self.errors = np.zeros(self.rows, dtype=ctypes_to_dtype(type(reg)))
+            self.errors[row] = np.frombuffer(bytes(reg), dtype=self.errors.dtype)[0]
+            self.error_regs[row] = reg
+
+    def _resize(self, rows):
+        self.rows = rows
+        for name, array in self.arrays.items():
+            self.arrays[name] = np.zeros((rows,) + array.shape[1:], dtype=array.dtype)
+            self.arrays[name][:len(array)] = array
+        if self.errors is not None:
+            errors = self.errors
+            self.errors = np.zeros(rows, dtype=errors.dtype)
+            self.errors[:len(errors)] = errors
+
+    def counters(self, field, nregs):
+        # every 32 bit error register holds four 8 bit counters, lowest byte first
+        regs = self.errors[field][:self.count, :nregs].astype("<u4")
+        return regs.view(np.uint8).reshape(self.count, -1).astype(np.int64)
 
 
 class Collection:
 
-    def __init__(self, dir, verbose = False, cut_to_hello = False):
+    index_dtype = np.dtype([("seq", "i8"), ("appid", "u2"), ("size", "i8"), ("mtime", "f8")])
+    # path to the time_32 and time_16 counters in the records of the packets that have them
+    time_counters = {(Packet_Metadata, None): ("base",), (Packet_Heartbeat, None): (),
+                     (Packet_Housekeep, 0): ("core_state", "base"), (Packet_Housekeep, 2): ("heartbeat",)}
+    # records holding the ADC stats and the TVS sensors, and the prefixes of the attributes
+    # the packets derive from them
+    adc_stat_paths = {(Packet_Metadata, None): ("base.ADC_stat", "adc_"),
+                      (Packet_Housekeep, 0): ("core_state.base.ADC_stat", ""), (Packet_Housekeep, 1): ("ADC_stat", "")}
+    telemetry_paths = {(Packet_Metadata, None): "base.TVS_sensors", (Packet_Housekeep, 0): "core_state.base.TVS_sensors"}
+
+    def __init__(self, dir, verbose = False, cut_to_hello = False, lazy = False, cache = False, workers = 1,
+                 include_appids = None, exclude_appids = None, time_range = None, index_range = None,
+                 dtype = "float64", reorder_gap = None):
+        """ Reads the packets in dir, a cdi_output directory or a packed session file.
+            With lazy=True only the file names are indexed; packets are created unread
+            and decode themselves on first access, e.g. C.spectra[k][ch].data. Spectra
+            are matched to their metadata by file order alone. Calibrator packets are
+            still read up front since their pages are assembled from the payloads.
+            With cache=True the spectra and TR spectra arrays, the metadata and
+            housekeeping records and the calibrator arrays are stored in dir/.uncrater_cache
+            after a full read. When the files have not changed since, they are loaded from
+            there and the packets are read lazily. By default the cache is neither read nor
+            written, so nothing is written into the session directory.
+            With workers > 1 spectra and TR spectra are decoded in that many processes,
+            in chunks that start at a metadata packet; the results are the same.
+            include_appids, exclude_appids, time_range=(t0, t1) on the receive time and
+            index_range=(i0, i1) on the packet sequence number select packets from the file
+            listing; either bound can be None. Other packets are never read, except the
+            metadata of selected spectra. Filtered collections are not cached.
+            dtype sets how spectra are stored: "float64" in physical units, "float32" the same
+            at half the memory, e.g. for live display, or "raw" as the integer counts in their
+            32 bit words, also at half the memory, which spectra_scale() turns into physical
+            units, see np_spectra(). TR spectra are always raw integers.
+            By default packets are assembled in the order they were received. With
+            reorder_gap=N spectra, TR spectra and the pages of calibrator data, raw PFB and
+            debug cycles are matched by unique_packet_id instead, so they may arrive in any
+            order; a group still incomplete N packets after its first one, or at the end of
+            the data, is assembled as it is. See assembly_stats().
+        """
+        if dtype not in Packet_Spectrum.dtypes:
+            raise ValueError(f"dtype must be one of {Packet_Spectrum.dtypes}, not {dtype!r}")
         self.verbose = verbose
         self.dir = dir
         self.cut_to_hello = cut_to_hello
+        self.lazy = lazy
+        self.cache = cache
+        self.workers = workers
+        self.dtype = dtype
+        self.reorder_gap = reorder_gap
+        self._entry_filter = EntryFilter(include_appids, exclude_appids, time_range, index_range)
+        self.include_appids = self._entry_filter.include_appids
+        self.exclude_appids = self._entry_filter.exclude_appids
+        self.time_range = self._entry_filter.time_range
+        self.index_range = self._entry_filter.index_range
+        self._filtered = self._entry_filter.active
+        self._last_seq = None
         self.refresh()
 
-    def refresh(self, quiet=False):
+    def refresh(self, quiet=False, incremental=False):
+        """ Reads the packet files in self.dir.
+            With incremental=True only files that appeared since the previous refresh are
+            read and appended, continuing the spectra, calibrator and waveform assembly
+            where it stopped, so the cost depends only on the new data.
+        """
+        full = not incremental or self._last_seq is None
+        if full:
+            self._reset()
+        self._arrays = {}
+        self._stale_records = set(self._records)
+        self._integrity = None
+        entries = scan_session(self.dir, self._last_seq)
+        if not quiet:
+            print(f"Analyzing {len(entries)} files from {self.dir}.")
+        if self.cut_to_hello:
+            hellos = [i for i, entry in enumerate(entries) if appid_is_hello(entry[1])]
+            if len(hellos) > 0 and (hellos[-1] > 0 or self._nfiles > 0):
+                self._reset()
+                entries = entries[hellos[-1]:]
+        last_seq = entries[-1][0] if len(entries) > 0 else self._last_seq
+        if self._filtered:
+            entries = self._entry_filter.select(entries)
+        self.index = np.concatenate((self.index, np.array([entry[:4] for entry in entries], dtype=self.index_dtype)))
+        # every metadata packet can start a spectrum and a TR spectrum
+        nmeta = sum(1 for entry in entries if appid_is_metadata(entry[1]))
+        self._spectra_store.reserve(len(self.spectra) + nmeta)
+        self._tr_store.reserve(len(self.tr_spectra) + nmeta)
+        self._cd_cycles.reserve(len(self.calib_debug) + sum(1 for entry in entries if entry[1] == id.AppID_Calibrator_Debug))
+        cached = None
+        if full:
+            use_cache = self.cache and not self._filtered
+            key = fingerprint(self.index, self.cut_to_hello, self.dtype, self.reorder_gap) if use_cache else None
+            cached = load_cache(self.dir, key) if use_cache else None
+            self._read_lazily = self.lazy or cached is not None
+        # calibrator arrays restored from the cache are not assembled from the packets again
+        self._calib_cached = cached is not None
+        self._deferred = []
+        for seq, appid, size, mtime, fn in entries:
+            self.files.append(fn)
+            self._ingest(fn, appid, mtime)
+            self._last_seq = seq
+        # filtered out files are not looked at again either
+        self._last_seq = last_seq
+        # groups left open by unique_packet_id are assembled now, later packets of spectra
+        # still join them; units in order stay open for the next refresh
+        self._apply(self._assembly.flush(final=False))
+        self._decode_deferred()
+        if cached is not None:
+            self._restore_cached(cached)
+        self._calib_cached = False
+        self._finalize()
+        if full and use_cache and cached is None and not self.lazy:
+            save_cache(self.dir, key, self._cached_arrays())
+
+    def _cached_arrays(self):
+        # arrays stored in the session cache, under the names _restore_cached expects
+        arrays = {}
+        for name, cube in (("spectra", self._spectra_cube), ("tr_spectra", self._tr_spectra_cube)):
+            try:
+                array = cube()
+            except (KeyError, ValueError):
+                # missing products or products of different lengths without a cube
+                continue
+            if not isinstance(array, np.ma.MaskedArray):
+                arrays[name] = array
+        if len(self._grimm_packets) > 0:
+            arrays["grimm_spectra"] = self.grimm_spectra
+        for name in ("calib_data", "calib_gNacc", "calib_gphase", "cd_drift"):
+            rows = getattr(self, "_" + name)
+            if rows.count > 0:
+                arrays[name] = rows.view()
+        cycles = self._cd_cycles
+        if cycles.count > 0:
+            for name, array in cycles.arrays.items():
+                arrays["cycles_" + name] = array[:cycles.count]
+            arrays["cycles_errors"] = cycles.errors[:cycles.count]
+        records = self.meta_records()
+        if records is not None:
+            arrays["records_meta"] = records
+        for hk_type in sorted(set(P.hk_type for P in self.housekeeping_packets)):
+            records = self.housekeeping_records(hk_type)
+            if records is not None:
+                arrays[f"records_hk_{hk_type}"] = records
+        return arrays
+
+    def _restore_cached(self, cached):
+        # the restored arrays are continued by later incremental refreshes
+        for name, array in cached.items():
+            if name == "records_meta":
+                self._records[(Packet_Metadata, None)] = array
+            elif name.startswith("records_hk_"):
+                self._records[(Packet_Housekeep, int(name[len("records_hk_"):]))] = array
+            elif name == "spectra":
+                self._spectra_store.load(array)
+            elif name == "tr_spectra":
+                self._tr_store.load(array)
+            elif name in ("grimm_spectra", "calib_data", "calib_gNacc", "calib_gphase", "cd_drift"):
+                getattr(self, "_grimm_rows" if name == "grimm_spectra" else "_" + name).append(array)
+        # the packets of the restored arrays stay unread
+        self._finalized = {"drift": len(self._drift_packets), "grimm": len(self._grimm_packets)}
+        if "cycles_errors" in cached:
+            self._cd_cycles.load({name[len("cycles_"):]: array for name, array in cached.items()
+                                  if name.startswith("cycles_") and name != "cycles_errors"}, cached["cycles_errors"])
+
+    def _reset(self):
+        # packet lists and the assembly state carried between files
+        self.index = np.zeros(0, dtype=self.index_dtype)
+        self.files = []
         self.cont = []
         self.time = []
         self.desc = []
         self.spectra = []
-        tr_spectra = []
+        self.tr_spectra = []
         self.calib = []
         self.heartbeat_packets = []
         self.watchdog_packets = []
         self.housekeeping_packets = []
         self.waveform_packets = []
         self.zoom_spectra_packets = []
-        flist = glob.glob(os.path.join(self.dir, "*.bin"))
-        if not quiet:
-            print(f"Analyzing {len(flist)} files from {self.dir}.")
-        flist = sorted(flist, key=lambda x: int(x[x.rfind("/") + 1 :].split("_")[0]))
-        meta_packet = None
-
         self.calib_meta = []
-        self.calib_data = []
-        self.calib_gNacc = []
-        self.calib_gphase = []
         self.calib_pfb = []
         self.calib_debug = []
-        waveforms = [None,None,None,None]
-        def fn2appid(fn):
-            return int(fn.replace(".bin", "").split("_")[-1], 16)
-        if self.cut_to_hello:
-            appids = [fn2appid(fn) for fn in flist]
-            for i in range(len(appids)-1,0,-1):
-                if appid_is_hello(appids[i]):
-                    flist = flist[i:]
-                    break
-        version=None
-        for i, fn in enumerate(flist):
+        self._calib_data = _GrowingRows()
+        self._calib_gNacc = _GrowingRows()
+        self._calib_gphase = _GrowingRows()
+        self._drift_packets = []
+        self._cd_drift = _GrowingRows()
+        self._grimm_packets = []
+        self._grimm_rows = _GrowingRows()
+        self._finalized = {"drift": 0, "grimm": 0}  # packets already added to the arrays above
+        self.grimm_spectra = []
+        self._records = {}
+        self._stale_records = set()
+        self._spectra_store = _ProductCube(words=self.dtype == "raw")
+        self._tr_store = _ProductCube()
+        self._cd_cycles = _CalDebugCycles()
+        # rows of the calibrator units by the key of their unit; late pages join them
+        self._cal_rows = {"cal_data": {}, "rawpfb": {}, "cal_debug": {}}
+        self._calib_rows = 0  # calibrator data rows, counted also when they come from the cache
+        self._cd_rows = {}  # cycle rows of the complete calib_debug units
+        self._assembly = PacketAssembler(self.reorder_gap)
+        self._spectra_rows = {}  # rows of the spectra and TR spectra by the key of their unit
+        self._tr_rows = {}
+        self.orphaned_packets = []
+        self._version = None
+        self._last_seq = -1
+        self._nfiles = 0
+        self._entry_filter.reset()
+
+    def _ingest(self, fn, appid, mtime):
+        i = self._nfiles
+        self._nfiles += 1
+        if self.verbose:
+            print ("Reading ",fn)
+
+        if appid_is_hello(appid):
+            hello = Packet(appid, blob_fn=fn)
+            hello._read()
+            self._version = hello.SW_version
             if self.verbose:
-                print ("Reading ",fn)
-            appid = fn2appid(fn)
-            
-            if appid_is_hello(appid):
-                hello = Packet(appid, blob_fn=fn)
-                hello._read()
-                version = hello.SW_version
-                if self.verbose:
-                    print (f"Detected FW version: {version:X}")
-
-
-            ## sometimes there is initial garbage to throw out
-            if appid_is_spectrum(appid) and meta_packet is None:
-                continue
-            if appid_is_tr_spectrum(appid) and meta_packet is None:
-                continue
-            
-            packet = Packet(appid, blob_fn=fn, version=version)
+                print (f"Detected FW version: {self._version:X}")
 
-            # spectral/TR spectral packets must be read only after we set their metadata packet
-            # all other packets: read immediately
-            if not (appid_is_spectrum(appid) or appid_is_tr_spectrum(appid) or appid_is_cal_any(appid)):
-                packet.read()
-            if appid_is_watchdog(appid):
-                packet.read()
+        ## sometimes there is initial garbage to throw out
+        if self._assembly.skips(appid):
+            return
 
+        packet = Packet(appid, blob_fn=fn, version=self._version, lazy=self._read_lazily)
 
-            if isinstance(packet, Packet_Metadata):
-                meta_packet = packet
-                self.spectra.append({"meta": packet})
-                tr_spectra.append({"meta": packet})
+        # spectral/TR spectral packets must be read only after we set their metadata packet
+        # all other packets: read immediately, unless lazy
+        if not (self._read_lazily or appid_is_spectrum(appid) or appid_is_tr_spectrum(appid) or appid_is_cal_any(appid)):
+            packet.read()
+        # without a hello packet, take the version housekeeping/metadata packets declare
+        if self._version is None and packet._version is not None:
+            self._version = packet._version
+            if self.verbose:
+                print (f"Detected FW version: {self._version:X}")
 
-            if appid_is_spectrum(appid):
-                if meta_packet is not None:
-                    packet.set_meta(meta_packet)
-                    packet.read()
-                    self.spectra[-1][appid & 0x0F] = packet
-
-            if appid_is_tr_spectrum(appid):
-                # print(f"TR appid = {appid}, from file {fn},  {fn.replace(".bin", "").split("_")[-1]}")
-                if meta_packet is not None:
-                    packet.set_meta(meta_packet)
-                    packet.read()
-                    tr_spectra[-1][appid & 0x0F] = packet
-
-            if isinstance(packet, Packet_Cal_Metadata):
-                self.calib_meta.append(packet)
-
-            if appid_is_cal_data(appid):
-                def to_cplx(a,b):
-                    return np.array(a,complex) + 1j*np.array(b)
-                if appid_is_cal_data_start(appid):
-                    packet.read()
-                    cal_packet_id = packet.unique_packet_id
-                    self.calib_data.append([np.array(data,complex) for data in packet.data])
-                else:
-                    packet.set_meta_id(cal_packet_id)
-                    packet.read()
-                    if packet.data_page == 1:
-                        for a, img_part  in zip(self.calib_data[-1], packet.data):
-                            a+= 1j*np.array(img_part)
-                    else:
-                        self.calib_gNacc.append(packet.gNacc)
-                        self.calib_gphase.append(packet.gphase)
-
-                
-            if appid_is_rawPFB(appid):
-                if appid_is_rawPFB_start(appid):
-                    packet.read()
-                    cal_packet_id = packet.unique_packet_id
-                    self.calib_pfb.append([np.array(packet.data,complex),None,None,None])
-                else:
-                    packet.set_meta_id(cal_packet_id)
-                    packet.read()
-                    ch = packet.channel
-                    part = packet.part
-                    if (part==0): # real part, comes first
-                        self.calib_pfb[-1][packet.channel] = np.array(packet.data, complex)
-                    else:
-                        self.calib_pfb[-1][packet.channel] += 1j*np.array(packet.data, complex)
-
-            if appid_is_cal_zoom(appid):
+        events = self._assembly.add(appid, packet, self._nfiles)
+        # calibrator pages are read once they know their start page; with the arrays from the
+        # cache, the data and debug pages are left unread
+        if appid_is_cal_data(appid) or appid_is_rawPFB(appid) or appid_is_cal_debug(appid):
+            if not (self._calib_cached and (appid_is_cal_data(appid) or
+                                            (appid_is_cal_debug(appid) and not appid_is_cal_debug_start(appid)))):
                 packet.read()
-                self.zoom_spectra_packets.append(packet)
-
-            if appid_is_cal_debug(appid):
-                if appid_is_cal_debug_start(appid):
-                    packet.read()
-                    cal_packet_id = packet.unique_packet_id
-                    self.calib_meta.append(packet.metadata)
-                    self.calib_debug.append([packet]+7*[None])
-                else:
-                    packet.set_meta_id(cal_packet_id)
-                    packet.read()
-                    self.calib_debug[-1][packet.debug_page]= packet
-
-            if isinstance(packet, Packet_Heartbeat):
-                self.heartbeat_packets.append(packet)
-
-            if isinstance(packet, Packet_Watchdog):
-                self.watchdog_packets.append(packet)
-
-            if isinstance(packet, Packet_Housekeep):
-                self.housekeeping_packets.append(packet)
-
-            if isinstance(packet, Packet_Waveform):
-                self.waveform_packets.append(packet)
-                waveforms[packet.ch] = packet
-                
-            if isinstance(packet, Packet_Waveform_Meta):
-                packet.set_packets(waveforms)
-                packet.read()
-                waveforms=[None,None,None,None]
 
-            self.cont.append(packet)
-            self.time.append(os.path.getmtime(fn))
-            try:
-                dt = self.time[-1] - self.time[0]
-                self.desc.append(
-                    f"{i:4d} : +{dt:4.1f}s : 0x{appid:0x} : {self.cont[-1].desc}"
-                )
-            except:
-                pass
+        if isinstance(packet, Packet_Cal_Metadata):
+            self.calib_meta.append(packet)
+
+        if appid_is_cal_zoom(appid):
+            packet.read()
+            self.zoom_spectra_packets.append(packet)
+
+        ## we take drift packets for both debug and metadata but make sure we don't duplicate
+        if appid == id.AppID_Calibrator_Debug or (appid == id.AppID_Calibrator_MetaData and packet.from_debug == False):
+            self._drift_packets.append(packet)
+
+        if appid == id.AppID_SpectraGrimm:
+            self._grimm_packets.append(packet)
+
+        if isinstance(packet, Packet_Heartbeat):
+            self.heartbeat_packets.append(packet)
+
+        if isinstance(packet, Packet_Watchdog):
+            self.watchdog_packets.append(packet)
+
+        if isinstance(packet, Packet_Housekeep):
+            self.housekeeping_packets.append(packet)
+
+        if isinstance(packet, Packet_Waveform):
+            self.waveform_packets.append(packet)
+
+        self.cont.append(packet)
+        self.time.append(mtime)
+        try:
+            dt = self.time[-1] - self.time[0]
+            self.desc.append(
+                f"{i:4d} : +{dt:4.1f}s : 0x{appid:0x} : {self.cont[-1].desc}"
+            )
+        except:
+            pass
+        self._apply(events)
+
+    def _apply(self, events):
+        # the units of the PacketAssembler go into the spectra and calibrator lists and arrays
+        for event in events:
+            kind, family, key = event[:3]
+            if kind == "open":
+                self._opened(family, key, event[3])
+            elif kind == "join":
+                self._joined(family, key, event[3], event[4])
+            elif kind == "orphan" and family in ("spectra", "tr_spectra"):
+                # products cannot be decoded without their metadata; like the initial garbage
+                # they are not kept
+                for packet in event[3].values():
+                    self._drop(packet)
+
+    def _opened(self, family, key, members):
+        if family in ("spectra", "tr_spectra"):
+            spectra, rows = (self.spectra, self._spectra_rows) if family == "spectra" else (self.tr_spectra, self._tr_rows)
+            spectra.append({"meta": members["meta"]})
+            rows[key] = len(spectra) - 1
+            self._add_products(family, rows[key], members)
+        elif family == "cal_data":
+            for page in range(3):
+                if page in members:
+                    self._joined(family, key, page, members[page])
+        elif family == "rawpfb":
+            self._cal_rows[family][key] = len(self.calib_pfb)
+            self.calib_pfb.append([None, None, None, None])
+            for part in range(8):
+                if part in members:
+                    self._joined(family, key, part, members[part])
+        elif family == "cal_debug":
+            self._cal_rows[family][key] = len(self.calib_debug)
+            self.calib_meta.append(members[0].metadata)
+            self.calib_debug.append([members.get(page) for page in range(8)])
+            self._cd_complete(len(self.calib_debug) - 1, members[0])
+
+    def _joined(self, family, key, slot, packet):
+        if family in ("spectra", "tr_spectra"):
+            rows = self._spectra_rows if family == "spectra" else self._tr_rows
+            self._add_products(family, rows[key], {slot: packet})
+        elif family == "cal_data":
+            # with the arrays from the cache, only the rows are counted
+            rows = self._cal_rows[family]
+            if slot == 0:
+                rows[key] = self._calib_rows
+                self._calib_rows += 1
+                if not self._calib_cached:
+                    self._calib_data.append([np.array(packet.data, complex)])
+            elif self._calib_cached:
+                return
+            elif slot == 1:
+                # the imaginary part of a row without its real part is not kept
+                if key in rows:
+                    self._calib_data.row(rows[key])[:] += 1j*np.array(packet.data)
+            else:
+                self._calib_gNacc.append([packet.gNacc])
+                self._calib_gphase.append([packet.gphase])
+        elif family == "rawpfb":
+            pfb = self.calib_pfb[self._cal_rows[family][key]]
+            if packet.part == 0: # real part, comes first
+                pfb[packet.channel] = np.array(packet.data, complex)
+            elif pfb[packet.channel] is not None:
+                pfb[packet.channel] += 1j*np.array(packet.data, complex)
+        elif family == "cal_debug":
+            index = self._cal_rows[family][key]
+            self.calib_debug[index][slot] = packet
+            self._cd_complete(index, packet)
+
+    def _cd_complete(self, index, packet):
+        # complete cycles go straight into the cd_ arrays, pages repeated later overwrite theirs
+        if index in self._cd_rows:
+            if not self._calib_cached:
+                self._cd_cycles.write(self._cd_rows[index], packet)
+        elif None not in self.calib_debug[index]:
+            self._cd_rows[index] = self._cd_cycles.add(self.calib_debug[index], write=not self._calib_cached)
+
+    def _drop(self, packet):
+        # orphans are given up on within reorder_gap packets, so they are near the end
+        for i in range(len(self.cont) - 1, -1, -1):
+            if self.cont[i] is packet:
+                if len(self.desc) == len(self.cont):
+                    del self.desc[i]
+                del self.cont[i], self.time[i]
+                break
+        self.orphaned_packets.append(packet)
+
+    def _add_products(self, family, row, members):
+        if family == "spectra":
+            S, store = self.spectra[row], self._spectra_store
+        else:
+            S, store = self.tr_spectra[row], self._tr_store
+        for slot, packet in members.items():
+            if slot == "meta":
+                continue
+            if family == "spectra":
+                packet.dtype = self.dtype
+            self._read_spectrum(packet, store, row)
+            S[slot] = packet
+
+    def assembly_stats(self):
+        """ Returns the completeness of the groups assembled by unique_packet_id with
+            reorder_gap set, None otherwise. For every family (spectra, tr_spectra, cal_data,
+            rawpfb, cal_debug) the numbers of complete and incomplete groups, groups still
+            open, repeated packets, groups dropped for lack of their metadata or start page
+            (orphaned) and packets added to units assembled before (late). The spectral
+            packets of orphaned groups are left out of the collection, as the default
+            assembly leaves out products before the first metadata, and are listed in
+            self.orphaned_packets.
+        """
+        return self._assembly.stats()
+
+    def _read_spectrum(self, packet, store, row):
+        # spectral packets are the bulk of the decoding; with workers they are decoded later.
+        # Decoded data are moved into the row of the store for their spectrum.
+        if self._read_lazily:
+            store.pending.append((row, packet.appid & 0x0F, packet))
+            return
+        if self.workers > 1:
+            self._deferred.append((packet, store, row))
+        else:
+            packet.read()
+            store.place(row, packet.appid & 0x0F, packet)
+
+    def _decode_deferred(self):
+        # decodes the spectral packets deferred by _read_spectrum in a process pool
+        if len(self._deferred) == 0:
+            return
+        groups = []
+        for packet, store, row in self._deferred:
+            if len(groups) == 0 or groups[-1][0] is not packet.meta:
+                groups.append((packet.meta, []))
+            groups[-1][1].append(packet)
+
+        def picklable(source):
+            if isinstance(source, functools.partial):
+                mm, offset, size = source.args
+                return (self.dir, offset, size)
+            return source
+
+        tasks = [(_meta_fields(meta), meta._version, [(P.appid, picklable(P._blob_fn)) for P in products])
+                 for meta, products in groups]
+        # about 4 chunks per worker, cut at metadata boundaries
+        chunk_size = max(1, len(self._deferred) // (4 * self.workers))
+        chunks, size = [[]], 0
+        for task in tasks:
+            if size >= chunk_size:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(task)
+            size += len(task[2])
+        deferred = iter(self._deferred)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for results in pool.map(functools.partial(_decode_spectra, dtype=self.dtype), chunks):
+                for attrs, printed in results:
+                    packet, store, row = next(deferred)
+                    print(printed, end="")
+                    packet.__dict__.update(attrs)
+                    store.place(row, packet.appid & 0x0F, packet)
+        self._deferred = []
+
+    def _finalize(self):
+        # arrays derived from the packet lists; only the packets of this refresh are added
         pfb = [[],[],[],[]]
         for c in self.calib:
             if (c['pfb'][0] is not None) and (c['pfb'][1] is not None) and (c['pfb'][2] is not None) and (c['pfb'][3] is not None):
@@ -184,70 +761,37 @@ class Collection:
                     pfb[i].append(c['pfb'][i])
         if len(pfb[0])>0:
             self.pfb = np.array([np.hstack(p) for p in self.pfb])
-        
-    
-        self.calib_gphase = np.array(self.calib_gphase)
-        self.calib_data = np.array(self.calib_data)
-        
-        if len(self.calib_gNacc)>0:
-            self.calib_gNacc = np.hstack(self.calib_gNacc)
-        dcalib = [c for c in self.calib_debug if None not in c]
-        ## we take drift packets for both debug and metadata but make sure we don't duplicate
-        drift_packets = [p for p in self.cont if (p.appid==id.AppID_Calibrator_Debug or (p.appid==id.AppID_Calibrator_MetaData and p.from_debug==False))]
-        
-        if len(drift_packets)>0:
-            self.cd_drift = np.hstack([p.drift for p in drift_packets])        
+
+
+        self.calib_gphase = self._calib_gphase.view()
+        self.calib_data = self._calib_data.view()
+        self.calib_gNacc = self._calib_gNacc.view() if self._calib_gNacc.count>0 else []
+        for p in self._drift_packets[self._finalized["drift"]:]:
+            self._cd_drift.append(p.drift)
+        self._finalized["drift"] = len(self._drift_packets)
+        if self._cd_drift.count>0:
+            self.cd_drift = self._cd_drift.view()
+        cycles = self._cd_cycles
         if self.verbose:
-            print ('# of calib debug entries', len(dcalib))
-        if len(dcalib)>0:
-            self.cd_have_lock = np.hstack([c[0].have_lock for c in dcalib])
-            self.cd_lock_ant = np.hstack([c[0].lock_ant for c in dcalib])
-            self.cd_errors = [c[0].metadata.error_reg for c in dcalib]
-            # phase errors are 8 bits over two counter
-            def get_counters(num):
-                return [num&0xFF, (num>>8)&0xFF , (num>>16)&0xFF, (num>>24)&0xFF] 
-
-            self.cd_error_phaser = np.array([(get_counters(x.cal_phaser_err[0])+get_counters(x.cal_phaser_err[1])) for x in self.cd_errors])
-            self.cd_error_averager = np.array([[get_counters(x.averager_err[r]) for r in range(16)] for x in self.cd_errors])
-            self.cd_error_process = np.array([np.hstack([get_counters(x.averager_err[r]) for r in range(8)]) for x in self.cd_errors])
-            self.cd_error_stage3 = np.array([np.hstack([get_counters(x.stage3_err[r]) for r in range(4)]) for x in self.cd_errors])
-            
-
-            
-            self.cd_powertop0 = np.hstack([c[0].powertop0 for c in dcalib])
-            self.cd_powertop1 = np.hstack([c[1].powertop1 for c in dcalib])
-            self.cd_powertop2 = np.hstack([c[1].powertop2 for c in dcalib])
-            self.cd_powertop3 = np.hstack([c[1].powertop3 for c in dcalib])
-            self.cd_powerbot0 = np.hstack([c[2].powerbot0 for c in dcalib])
-            self.cd_powerbot1 = np.hstack([c[2].powerbot1 for c in dcalib])
-            self.cd_powerbot2 = np.hstack([c[2].powerbot2 for c in dcalib])
-            self.cd_powerbot3 = np.hstack([c[3].powerbot3 for c in dcalib])
-            self.cd_fd0 = np.hstack([c[3].fd0 for c in dcalib])
-            self.cd_fd1 = np.hstack([c[3].fd1 for c in dcalib])
-            self.cd_fd2 = np.hstack([c[4].fd2 for c in dcalib])
-            self.cd_fd3 = np.hstack([c[4].fd3 for c in dcalib])
-            self.cd_sd0 = np.hstack([c[4].sd0 for c in dcalib])
-            self.cd_sd1 = np.hstack([c[5].sd1 for c in dcalib])
-            self.cd_sd2 = np.hstack([c[5].sd2 for c in dcalib])
-            self.cd_sd3 = np.hstack([c[5].sd3 for c in dcalib])
-            self.cd_fdx = np.hstack([c[6].fdx for c in dcalib])
-            self.cd_sdx = np.hstack([c[6].sdx for c in dcalib])
-            self.cd_snr0 = np.hstack([c[6].snr0 for c in dcalib])
-            self.cd_snr1 = np.hstack([c[7].snr1 for c in dcalib])
-            self.cd_snr2 = np.hstack([c[7].snr2 for c in dcalib])
-            self.cd_snr3 = np.hstack([c[7].snr3 for c in dcalib])
-
-
-
-
-
-        # we don't always send TR spectra; if dict contains only metadata
-        # packet but no actual data, we assume it's fine and don't include it into self.tr_spectra
-        self.tr_spectra = [trs for trs in tr_spectra if len(trs) > 1]
-        self.grimm_spectra = [P.data for P in self.cont if P.appid == id.AppID_SpectraGrimm]
-        if len(self.grimm_spectra)>0:
-            self.grimm_spectra = np.vstack(self.grimm_spectra)
-        assert all(["meta" in trs for trs in tr_spectra])
+            print ('# of calib debug entries', cycles.count)
+        if cycles.count>0:
+            # flat views of the rows of the complete cycles
+            for name, array in cycles.arrays.items():
+                view = array[:cycles.count].reshape(-1)
+                view.flags.writeable = False
+                setattr(self, "cd_" + name, view)
+            self.cd_errors = cycles.error_regs[:cycles.count]
+            self.cd_error_phaser = cycles.counters("cal_phaser_err", 2)
+            self.cd_error_averager = cycles.counters("averager_err", 16).reshape(cycles.count, 16, 4)
+            # the process counters have always been taken from the first 8 averager registers
+            self.cd_error_process = cycles.counters("averager_err", 8)
+            self.cd_error_stage3 = cycles.counters("stage3_err", 4)
+
+        for P in self._grimm_packets[self._finalized["grimm"]:]:
+            self._grimm_rows.append(P.data)
+        self._finalized["grimm"] = len(self._grimm_packets)
+        if self._grimm_rows.count > 0:
+            self.grimm_spectra = self._grimm_rows.view()
 
     def __len__(self):
         return len(self.cont)
@@ -272,42 +816,36 @@ class Collection:
     def num_waveform_packets(self) -> int:
         return len(self.waveform_packets)
 
+    def integrity(self, workers=None):
+        """ Returns the IntegrityReport of the spectra, heartbeats and metadata, with the
+            CRCs of all spectral packets computed in workers threads (default: up to 8).
+            The check runs once per refresh; the methods below report from it.
+        """
+        if self._integrity is None:
+            self._integrity = integrity_scan(self, workers)
+        return self._integrity
+
     # return 1, if all heartbeat packets are present (no gaps in packet_count sequence)
     def heartbeat_counter_ok(self) -> int:
-        hb_counts = [p.packet_count for p in self.heartbeat_packets]
-        if len(hb_counts) <= 1:
-            return 1
-        for i,j in zip(hb_counts[:-1], hb_counts[1:]):
-            if j == i+1:
-                ## great
-                continue
-            elif (j<i) or (i==0):
-                # then we must have seen a re boot  
-                if j==0:
-                    continue
-            else:
-                print(f"Missing heartbeat packet between count {i}-> {j}")
-                return 0
-
-        return 1
+        report = self.integrity()
+        # a counter that goes back or restarts from 0 is a reboot, anything else a gap
+        for i in report.heartbeat_gaps():
+            print(f"Missing heartbeat packet between count {report.heartbeat_counts[i]}-> {report.heartbeat_counts[i+1]}")
+        return int(len(report.heartbeat_gaps()) == 0)
 
     # return maximal time difference between heartbeat packets
     # return -1, if there is at 0 or 1 heartbeat
     def heartbeat_max_dt(self) -> int:
         if len(self.heartbeat_packets) <= 1:
             return -1
-        hb_times = [p.time for p in self.heartbeat_packets]
-        deltas = [t2 - t1 for t2, t1 in zip(hb_times[1:], hb_times[:-1])]
-        return max(deltas)
+        return np.diff(self.column("time", Packet_Heartbeat)).max()
 
     # return minimal time difference between heartbeat packets
     # return 1e12, if there is 0 or 1 heartbeat
     def heartbeat_min_dt(self) -> int:
         if len(self.heartbeat_packets) <= 1:
             return int(1e12)
-        hb_times = [p.time for p in self.heartbeat_packets]
-        deltas = [t2 - t1 for t2, t1 in zip(hb_times[1:], hb_times[:-1])]
-        return min(deltas)
+        return np.diff(self.column("time", Packet_Heartbeat)).min()
 
     def list(self):
         return "\n".join(self.desc)
@@ -327,84 +865,228 @@ class Collection:
     # bcheckmark in TeX want an int 0/1 flag, not bool
     # return 1, if all 16 products are present
     def has_all_products(self) -> int:
-        for s, prods in enumerate(self.spectra):
-            for i in range(16):
-                if i not in prods:
-                    print(f"Product {i} missing in spectra {s}.")
-                    return 0
-        return 1
+        missing = self.integrity().missing_products()
+        for s, i in missing:
+            print(f"Product {i} missing in spectra {s}.")
+        return int(len(missing) == 0)
 
     # return 1, if all 16 time-resolved packets are present
     def has_all_tr_products(self) -> int:
-        for s, trs in enumerate(self.tr_spectra):
-            for i in range(16):
-                if i not in trs:
-                    print(f"Product {i} missing in TR spectra {s}.")
-                    return 0
-        return 1
+        missing = self.integrity().missing_products(tr=True)
+        for s, i in missing:
+            print(f"Product {i} missing in TR spectra {s}.")
+        return int(len(missing) == 0)
 
     # return 1, if all spectra packets have correct CRC
     def all_spectra_crc_ok(self) -> int:
-        for i, prods in enumerate(self.spectra):
-            for k in range(16):
-                if k in prods and prods[k].error_crc_mismatch:
-                    print(f"Bad CRC in product {k} in spectra {i}.")
-                    return 0
-        return 1
+        failures = self.integrity().crc_failures()
+        for row in failures:
+            print(f"Bad CRC in product {row['product']} in spectra {row['spectrum']}.")
+        return int(len(failures) == 0)
 
     # return 1, if all time-resolved spectra packets have correct CRC
     def all_tr_spectra_crc_ok(self) -> int:
-        for i, trs in enumerate(self.tr_spectra):
-            for k in range(16):
-                if k in trs and trs[k].error_crc_mismatch:
-                    print(
-                        f"Bad CRC in product {k} in TR spectra {i}, incorrect CRC: {trs[k].crc}."
-                    )
-                    return 0
-        return 1
+        failures = self.integrity().crc_failures(tr=True)
+        for row in failures:
+            print(
+                f"Bad CRC in product {row['product']} in TR spectra {row['spectrum']}, incorrect CRC: {row['crc']}."
+            )
+        return int(len(failures) == 0)
 
 
     def all_meta_error_free(self) -> int:
-        result = 1
-        for i, sp in enumerate(self.spectra):
-            if sp["meta"].errormask:
-                print(f"Errors in {i}: {error_mask_pretty_print(sp['meta'].errormask)}")
-                result = 0
-        return result
+        report = self.integrity()
+        for i in report.error_spectra():
+            print(f"Errors in {i}: {error_mask_pretty_print(int(report.meta_errors[i]))}")
+        return int(len(report.error_spectra()) == 0)
 
     def get_meta(self,name):
         return np.array([S['meta'][name] for S in self.spectra])
 
+    def meta_records(self):
+        """ Returns the metadata of all spectra as one numpy structured array
+            with the fields of pystruct.meta_data, e.g. meta_records()['base']['weight'].
+            Returns None if the metadata come from different SW versions.
+        """
+        return self._get_records(Packet_Metadata)
+
+    def housekeeping_records(self, hk_type):
+        """ Returns all housekeeping packets of a given type as one numpy structured array
+            with the fields of pystruct.housekeeping_data_<hk_type>, or None as above.
+        """
+        return self._get_records(Packet_Housekeep, hk_type)
+
+    def column(self, path, packet_type=Packet_Metadata, hk_type=None):
+        """ Returns the value at a dotted path, e.g. 'base.ADC_stat.sumv', for all packets
+            of packet_type as a numpy array. For Packet_Metadata these are the metadata of
+            self.spectra, for Packet_Housekeep hk_type selects the housekeeping type.
+            Struct fields are read from the structured array of all blobs and keep their
+            wire types, and 'time', the ADC stats and the telemetry, e.g. 'adc_rms', are
+            computed from them at once; other attributes are extracted packet by packet.
+        """
+        records = self._get_records(packet_type, hk_type)
+        if path == "time" and records is not None and len(records) > 0 and (packet_type, hk_type) in self.time_counters:
+            counters = records
+            for name in self.time_counters[(packet_type, hk_type)]:
+                counters = counters[name]
+            return Time2Time_array(counters["time_32"], counters["time_16"])
+        if records is not None and len(records) > 0:
+            prefix = self.adc_stat_paths.get((packet_type, hk_type), (None, None))[1]
+            if prefix is not None and path.startswith(prefix) and path[len(prefix):] in adc_stat_keys:
+                return self.adc_stats(packet_type, hk_type)[path[len(prefix):]]
+            if (packet_type, hk_type) in self.telemetry_paths and path.startswith("telemetry_") and path[len("telemetry_"):] in telemetry_keys:
+                return self.telemetry(packet_type, hk_type)[path[len("telemetry_"):]]
+        if records is not None:
+            col = records
+            try:
+                for name in path.split('.'):
+                    col = col[name]
+                return col
+            except (KeyError, ValueError, IndexError):
+                pass
+        return np.array([P[path] for P in self._select_packets(packet_type, hk_type)])
+
+    def _records_at(self, path, packet_type, hk_type):
+        col = self._get_records(packet_type, hk_type)
+        if col is None:
+            raise ValueError(f"packets of {packet_type.__name__} do not decode into a single struct")
+        for name in path.split('.'):
+            col = col[name]
+        return col
+
+    def adc_stats(self, packet_type=Packet_Metadata, hk_type=None):
+        """ The ADC stats of all packets of packet_type, i.e. metadata or housekeeping of
+            type 0 or 1, computed at once from their records: the keys of process_ADC_stats
+            with (packets, 4) arrays.
+        """
+        path = self.adc_stat_paths[(packet_type, hk_type)][0]
+        return process_ADC_stats_batch(self._records_at(path, packet_type, hk_type))
+
+    def telemetry(self, packet_type=Packet_Metadata, hk_type=None):
+        """ The telemetry of all metadata or housekeeping packets of type 0, computed at
+            once from their records: the keys of process_telemetry with (packets,) arrays.
+        """
+        path = self.telemetry_paths[(packet_type, hk_type)]
+        return process_telemetry_batch(self._records_at(path, packet_type, hk_type))
+
+    def _select_packets(self, packet_type, hk_type=None):
+        if packet_type is Packet_Metadata:
+            return [S['meta'] for S in self.spectra]
+        packets = [P for P in self.cont if type(P) is packet_type]
+        if hk_type is not None:
+            packets = [P for P in packets if P.hk_type == hk_type]
+        return packets
+
+    def _get_records(self, packet_type, hk_type=None):
+        # structured array of all blobs of the selected packets, None if they
+        # do not decode into a single ctypes struct
+        key = (packet_type, hk_type)
+        if key in self._records and key not in self._stale_records:
+            return self._records[key]
+        self._stale_records.discard(key)
+        packets = self._select_packets(packet_type, hk_type)
+        # records from an earlier refresh or from the session cache are only extended
+        records = self._records.get(key)
+        done = len(records) if key in self._records and records is not None and records.dtype.names is not None else 0
+        if key in self._records and records is None:
+            return None
+        for P in packets[done:]:
+            P.read()
+        structs = set(P._record_struct() for P in packets[done:])
+        if len(packets) == 0:
+            records = np.array([])
+        elif len(packets) == done:
+            pass
+        elif len(structs) > 1 or None in structs:
+            records = None
+        else:
+            try:
+                new = decode_structs([P._blob for P in packets[done:]], structs.pop())
+                records = new if done == 0 else np.concatenate((records, new))
+            except (ValueError, TypeError):
+                # short blobs, e.g. of corrupted packets, or packets of another SW version
+                records = None
+        self._records[key] = records
+        return records
+
+    def export(self, path, format="npz", chunk_size=256):
+        """ Writes the spectra, TR spectra, metadata, housekeeping, heartbeat and watchdog
+            record tables, calibrator arrays and waveforms to path as columnar datasets,
+            see uncrater.session_export. format is "npz" (zlib compressed, default), "npy"
+            (a directory that loads memory mapped), "hdf5" (needs h5py) or "parquet" (needs
+            pyarrow). Spectra are written chunk_size at a time; in a lazy collection their
+            packets are decoded for the export and not kept. load_export reads it back.
+        """
+        export_collection(self, path, format, chunk_size)
 
     def xxd(self, i, intro=False):
         if intro:
             return self._intro(i) + self.cont[i].xxd()
         return self.cont[i].xxd()
 
+    def _spectra_cube(self):
+        """ All spectra as one array of shape (spectra, 16, bins), masked where products
+            are missing. Built once per refresh; the data of the products are views into it.
+        """
+        if "spectra" not in self._arrays:
+            self._arrays["spectra"] = self._build_cube(self.spectra, self._spectra_store)
+        return self._arrays["spectra"]
+
+    def _tr_spectra_cube(self):
+        """ All TR spectra as one array of shape (TR spectra, 16, rows, bins), see _spectra_cube. """
+        if "tr_spectra" not in self._arrays:
+            self._arrays["tr_spectra"] = self._build_cube(self.tr_spectra, self._tr_store)
+        return self._arrays["tr_spectra"]
+
+    def _build_cube(self, spectra, store):
+        # products not decoded yet (lazy collections) are read and placed first
+        for row, product, P in store.pending:
+            P.read()
+            store.place(row, product, P)
+        store.pending = []
+        cube = store.array(len(spectra))
+        if cube is None:
+            # no products at all or products of different shapes: stacked as they come
+            cube = np.array([[S[ch].data for ch in range(16)] for S in spectra])
+            cube.flags.writeable = False
+        return cube
+
+    def spectra_scale(self):
+        """ Returns the factor (1<<Navg2_shift)/weight of every spectrum, which turns the
+            counts of a dtype="raw" collection into physical units, e.g. for channel ch:
+            C.np_spectra(channel=ch) * C.spectra_scale()[:, None]
+        """
+        base = self.column("base")
+        if len(base) == 0:
+            return np.zeros(0)
+        weight = base["weight_previous"] if "weight_previous" in base.dtype.names else base["weight"]
+        return (1 << base["Navg2_shift"].astype(np.int64)) / weight
+
     def np_spectra(self, ndx=None, channel=None):
-        """ Returns a numpy array of the spectra data.
+        """ Returns a numpy array of the spectra data, a read-only view of the spectra cube
+            which is masked where products are missing; copy it to change it.
             If ndx is not None, returns only the spectra at that time.
             If channel is not None, returns only the spectra for that channel.
+            With dtype="raw" the cube holds the 32 bit words of the products as uint32, at half
+            the memory of float64; a single channel comes in its own type, int32 for the cross
+            products 4 to 15, as the data of the packets do.
         """
-
-        if (ndx is None) and (channel is None):        
-            return np.array([[S[ch].data for ch in range(16)] for S in self.spectra])
-        
-        if (ndx is not None) and (channel is None):
+        if ndx is not None and "spectra" not in self._arrays and len(self._spectra_store.pending) > 0:
+            # a single spectrum of a lazy collection: only its products are read
             S = self.spectra[ndx]
-            return np.array([S[ch].data for ch in range(16)])   
-        
-        if (ndx is None) and (channel is not None):
-            return np.array([S[channel].data for S in self.spectra])
+            return self._spectra_store.stack([S[ch] for ch in range(16)]) if channel is None else S[channel].data
 
-        if (ndx is not None) and (channel is not None):
-            S = self.spectra[ndx]
-            return S[channel].data
-        
-        assert(False), "Should not reach here"
+        cube = self._spectra_cube()
+        if channel is None:
+            return cube if ndx is None else cube[ndx]
+        spectra = cube[:, channel] if ndx is None else cube[ndx, channel]
+        if self._spectra_store.words and spectra.dtype == np.uint32:
+            spectra = spectra.view(Packet_Spectrum.product_types(channel)[1])
+        return spectra
 
     def np_tr_spectra(self, ndx=None, channel=None):
-        """ Returns a numpy array of the spectra data.
+        """ Returns a numpy array of the TR spectra data, with the 16 products of every
+            TR spectrum stacked along the first axis; a read-only view of the TR spectra cube.
             If ndx is not None, returns only the spectra at that time.
             If channel is not None, returns only the spectra for that channel.
         """
@@ -412,18 +1094,13 @@ class Collection:
         if len(self.tr_spectra)==0:
             return np.array([])
 
-        if (ndx is None) and (channel is None):        
-            return np.vstack([[S[ch].data for ch in range(16)] for S in self.tr_spectra])
-        
-        if (ndx is not None) and (channel is None):
+        if ndx is not None and "tr_spectra" not in self._arrays and len(self._tr_store.pending) > 0:
             S = self.tr_spectra[ndx]
-            return np.array([S[ch].data for ch in range(16)])   
-        
-        if (ndx is None) and (channel is not None):
-            return np.vstack([S[channel].data for S in self.tr_spectra])
+            return np.array([S[ch].data for ch in range(16)]) if channel is None else S[channel].data
 
-        if (ndx is not None) and (channel is not None):
-            S = self.tr_spectra[ndx]
-            return S[channel].data
-        
-        assert(False), "Should not reach here"
+        cube = self._tr_spectra_cube()
+        if ndx is None:
+            if channel is None:
+                return cube.reshape((-1,) + cube.shape[2:])
+            return cube[:, channel].reshape((-1,) + cube.shape[3:])
+        return cube[ndx] if channel is None else cube[ndx, channel]
@@ -1,14 +1,52 @@
 import os, sys
 import hexdump
+import operator
+from functools import lru_cache
 from .coreloop import pycoreloop,pycoreloop_203,pycoreloop_305,pycoreloop_307
+from .coreloop import bindings_for, struct_for, detect_version
 pystruct = pycoreloop.pystruct
 pystruct_203 = pycoreloop_203.pystruct
 pystruct_305 = pycoreloop_305.pystruct
 pystruct_307 = pycoreloop_307.pystruct
 
 
+@lru_cache(maxsize=None)
+def _struct_fields(struct_type):
+    return frozenset(field[0] for field in struct_type._fields_)
+
+
+@lru_cache(maxsize=None)
+def _field_accessor(struct_type, name):
+    # ctypes field descriptor getter, resolved once per (struct type, field) pair
+    if name not in _struct_fields(struct_type):
+        return None
+    return getattr(struct_type, name).__get__
+
+
+@lru_cache(maxsize=None)
+def _compile_path(packet_type, version, path):
+    # extractor for a dotted attribute path, compiled once per (packet class, version, path);
+    # a missing intermediate attribute gives None, a missing last one raises AttributeError
+    head, _, last = path.rpartition('.')
+    get_last = operator.attrgetter(last)
+    if not head:
+        return get_last
+    get_head = operator.attrgetter(head)
+    def extract(obj):
+        try:
+            parent = get_head(obj)
+        except AttributeError:
+            return None
+        return get_last(parent)
+    return extract
+
+
 class PacketBase:
-    def __init__ (self, appid, blob = None, blob_fn = None, version=None, **kwargs):
+    # attributes computed from the struct fields on first access, by the name of the
+    # method returning them and their siblings as a dict
+    _derived = {}
+
+    def __init__ (self, appid, blob = None, blob_fn = None, version=None, lazy=False, **kwargs):
         if (blob is None) and (blob_fn is None):
             raise ValueError
         self.appid = appid
@@ -16,6 +54,8 @@ class PacketBase:
         self._blob_fn = blob_fn
         self._version = version
         self._is_read = False
+        # lazy packets read themselves on the first access to an attribute they do not have yet
+        self._lazy = lazy
         for key, value in kwargs.items():
             setattr(self, key, value)
         if blob is not None:
@@ -26,8 +66,20 @@ class PacketBase:
     def _read(self):
         if self._is_read:
             return
+        self._lazy = False
+        self._load_blob()
+        if self._version is None:
+            self._version = detect_version(self.appid, self._blob)
+
+    def _load_blob(self):
+        # the raw bytes, without decoding them
         if self._blob is None:
-            self._blob = open(self._blob_fn,"rb").read()    
+            self._blob = self._fetch_blob()
+        return self._blob
+
+    def _fetch_blob(self):
+        # blob_fn is a file name or a callable returning the blob, e.g. from a packed session
+        return self._blob_fn() if callable(self._blob_fn) else open(self._blob_fn,"rb").read()
 
     def read(self):
         self._read()
@@ -57,6 +109,8 @@ class PacketBase:
 
 
     def keys(self):
+        if self.__dict__.get('_lazy'):
+            self._read()
         def it_keys(d):
             l = []
             klist = getattr(d,"__slots__") if hasattr(d,"__slots__") else dir(d)
@@ -74,17 +128,7 @@ class PacketBase:
         return it_keys(self)
     
     def __getitem__(self,name):
-        def get_dotted(obj,name):
-            if '.' in name:
-                i = name.find('.')
-                first,second = name[:i], name[i+1:]
-                if hasattr(obj,first):
-                    return get_dotted(getattr(obj,first),second)
-                else:
-                    return None
-            else:
-                return getattr(obj,name)
-        return get_dotted(self,name)
+        return _compile_path(type(self), self._version, name)(self)
 
     def xxd(self):
         """ xxd style dump of the contents"""
@@ -102,8 +146,51 @@ class PacketBase:
         """
         return self.xxd()
 
+    def _pystruct(self):
+        """ pystruct bindings matching the SW version of this packet """
+        return bindings_for(self._version).pystruct
+
+    def _struct(self, name):
+        """ pystruct class called name matching the SW version of this packet """
+        return struct_for(self._version, name)
+
     def copy_attrs (self,src):
-        for attr in dir(src): 
-            if attr[0] == '_':
-                continue
-            setattr(self, attr, getattr(src, attr))
\ No newline at end of file
+        """ Exposes the fields of a decoded ctypes struct as attributes of the packet.
+            Nothing is copied here; fields are resolved on first access in __getattr__.
+        """
+        self._structs = self.__dict__.get('_structs', ()) + (src,)
+
+    def _record_struct(self):
+        """ ctypes struct type the blob decodes into, None if there is no single one """
+        structs = self.__dict__.get('_structs', ())
+        return type(structs[0]) if len(structs) == 1 else None
+
+    def __getattr__(self, name):
+        # only called when regular lookup fails, i.e. for struct fields not accessed yet
+        if name[0] != '_':
+            if self.__dict__.get('_lazy'):
+                self._read()
+                return getattr(self, name)
+            if name in self._derived:
+                self.__dict__.update(getattr(self, self._derived[name])())
+                if name in self.__dict__:
+                    return self.__dict__[name]
+            for src in self.__dict__.get('_structs', ()):
+                accessor = _field_accessor(type(src), name)
+                if accessor is not None:
+                    value = accessor(src)
+                    self.__dict__[name] = value
+                    return value
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __dir__(self):
+        # a lazy packet has its fields only once it is read
+        if self.__dict__.get('_lazy'):
+            self._read()
+        names = set(super().__dir__())
+        for src in self.__dict__.get('_structs', ()):
+            names.update(_struct_fields(type(src)))
+        if self._is_read:
+            for method in set(self._derived.values()):
+                names.update(getattr(self, method)())
+        return sorted(names)
\ No newline at end of file
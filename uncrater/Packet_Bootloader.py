@@ -13,7 +13,7 @@ class Packet_Bootloader(PacketBase):
         if self._is_read:
             return
         super()._read()
-        self.header = struct.unpack("8I", self._blob[:32])
+        self.header = struct.unpack_from("<8I", self._blob)
         msg_type = ["BL_STARTUP", "BL_JumpTo_FLT_SW", "BL_PRGM_CHKSUM", "BL_PRGM_VERIFY", "BL_ERROR"]
         self.msg_type = self.header[0]
         if (self.msg_type<5):
@@ -27,7 +27,7 @@ class Packet_Bootloader(PacketBase):
         self.payload_len = self.header[6]
         self.magic = (self.header[7]==0xfeedface)
         try:
-            self.payload = np.array(struct.unpack(f"{self.payload_len}I", self._blob[32:32+self.payload_len*4]))
+            self.payload = np.frombuffer(self._blob, dtype="<u4", count=self.payload_len, offset=32)
         except:
             self.payload = None
 
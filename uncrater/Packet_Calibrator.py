@@ -1,6 +1,6 @@
 from tracemalloc import stop
 from .PacketBase import PacketBase, pystruct
-from .utils import Time2Time, cordic2rad, rle_decode
+from .utils import Time2Time, cordic2rad, cordic2rad_array, rle_decode
 from pycoreloop import appId as id
 import struct, ctypes
 import numpy as np
@@ -21,7 +21,7 @@ class Packet_Cal_Metadata(PacketBase):
         self._is_read = True
         self.drift_raw = np.array(self.drift).astype(np.int64)
         self.drift_raw = (self.drift_raw << self.drift_shift)
-        self.drift = cordic2rad(np.repeat(self.drift_raw,8))
+        self.drift = cordic2rad_array(np.repeat(self.drift_raw,8))
         self.from_debug=False
 
     def info(self):
@@ -118,22 +118,23 @@ class Packet_Cal_Data(PacketBase):
         if self._is_read:
             return
         super()._read()
-        self.unique_packet_id = struct.unpack("<I", self._blob[0:4])[0]
-        self.time = Time2Time(struct.unpack("<I", self._blob[4:8])[0], struct.unpack("<I", self._blob[8:12])[0])  
+        self.unique_packet_id, time_32, time_16 = struct.unpack_from("<III", self._blob)
+        self.time = Time2Time(time_32, time_16)
         self.data_page = self.appid - id.AppID_Calibrator_Data
         if (self.data_page>0) and (self.expected_id != self.unique_packet_id):
             print("Packet ID mismatch!!")
             self.packed_id_mismatch = True
 
 
-        data = struct.unpack(f"<{len(self._blob[12:])//4}i", self._blob[12:])
+        # owning int64 arrays, as the values used to be, rather than read-only int32 views
+        data = np.frombuffer(memoryview(self._blob)[12:], dtype="<i4").astype(np.int64)
         if self.data_page < 2:
             assert(len(data) == 2048)
             
-            self.data = np.array(data).reshape(4,512)
+            self.data = data.reshape(4,512)
         else:
-            self.gNacc = data[0]
-            self.gphase = np.array(data[1:1025])
+            self.gNacc = int(data[0])
+            self.gphase = data[1:1025]
             self.data = (self.gNacc, self.gphase)
 
         self._is_read = True
@@ -160,15 +161,14 @@ class Packet_Cal_RawPFB(PacketBase):
         super()._read()
         self.channel = (self.appid-id.AppID_Calibrator_RawPFB)//2
         self.part = (self.appid-id.AppID_Calibrator_RawPFB)%2
-        self.unique_packet_id = struct.unpack("<I", self._blob[0:4])[0]
-        self.time = Time2Time(struct.unpack("<I", self._blob[4:8])[0], struct.unpack("<I", self._blob[8:12])[0])  
+        self.unique_packet_id, time_32, time_16 = struct.unpack_from("<III", self._blob)
+        self.time = Time2Time(time_32, time_16)
 
         if (self.appid-id.AppID_Calibrator_RawPFB>0) and (self.expected_id != self.unique_packet_id):
             print("Packet ID mismatch!!")
             self.packed_id_mismatch = True
 
-        self.data = struct.unpack(f"<{len(self._blob[12:])//4}i", self._blob[12:])
-        self.data = self.data[:2048]
+        self.data = np.frombuffer(memoryview(self._blob)[12:], dtype="<i4")[:2048].astype(np.int64)
         self._is_read = True
 
     def info(self):
@@ -182,6 +182,20 @@ class Packet_Cal_RawPFB(PacketBase):
 
 
 class Packet_Cal_Debug(PacketBase):
+    # each debug page is 3 rows of 1024 words; for every row the attribute it holds and
+    # the little endian type its words are read as (some numbers are signed, some unsigned)
+    page_layout = {
+        0: (None, ("drift", "<u4"), ("powertop0", "<u4")),
+        1: (("powertop1", "<u4"), ("powertop2", "<u4"), ("powertop3", "<u4")),
+        2: (("powerbot0", "<u4"), ("powerbot1", "<u4"), ("powerbot2", "<u4")),
+        3: (("powerbot3", "<u4"), ("fd0", "<i4"), ("fd1", "<i4")),
+        4: (("fd2", "<i4"), ("fd3", "<i4"), ("sd0", "<i4")),
+        5: (("sd1", "<i4"), ("sd2", "<i4"), ("sd3", "<i4")),
+        6: (("fdx", "<i4"), ("sdx", "<i4"), ("snr0", "<u4")),
+        7: (("snr1", "<u4"), ("snr2", "<u4"), ("snr3", "<u4")),
+    }
+    page_size = 3*1024*4
+
     @property
     def desc(self):
         return "Calibrator Debug"
@@ -193,20 +207,21 @@ class Packet_Cal_Debug(PacketBase):
         if self._is_read:
             return
         super()._read()
-        self.unique_packet_id = struct.unpack("<I", self._blob[0:4])[0]
-        self.time = Time2Time(struct.unpack("<I", self._blob[4:8])[0], struct.unpack("<I", self._blob[8:12])[0])  
+        self.unique_packet_id, time_32, time_16 = struct.unpack_from("<III", self._blob)
+        self.time = Time2Time(time_32, time_16)
+        self._metadata = None
 
-        payload = self._blob[12:]
-        if len(payload)<3*1024*4:
+        payload = memoryview(self._blob)[12:]
+        if len(payload)<self.page_size:
             # let's to to RLE decode it
 
 
-            payload = rle_decode(payload, original_size = 3*1024*4)
-            if len(payload)<3*1024*4 or len(payload)>3*1024*4+3:
+            payload = rle_decode(payload, original_size = self.page_size)
+            if len(payload)<self.page_size or len(payload)>self.page_size+3:
                 print (f"RLE decode failed, size = {len(payload)}")
                 raise Exception("RLE decode failed")
                 #return
-            payload = payload[:3*1024*4] # trim any extra bytes due to CDI padding
+            payload = memoryview(payload)[:self.page_size] # trim any extra bytes due to CDI padding
 
 
         self.debug_page = self.appid - id.AppID_Calibrator_Debug
@@ -214,55 +229,46 @@ class Packet_Cal_Debug(PacketBase):
             print("Packet ID mismatch!!")
             self.packed_id_mismatch = True
         
-        if len(payload)!=3*1024*4:
-            print (f"Bad packet size. size = {len(self.blob)} appid = {self.appid:x} page = {self.debug_page}")
+        if len(payload)!=self.page_size:
+            print (f"Bad packet size. size = {len(self._blob)} appid = {self.appid:x} page = {self.debug_page}")
             return
 
-        datai = np.array(struct.unpack(f"<{len(payload)//4}i", payload)).reshape(3,1024)
-        datau = np.array(struct.unpack(f"<{len(payload)//4}I", payload)).reshape(3,1024)
-        dataw = np.array(struct.unpack(f"<{len(payload)//2}H", payload)).reshape(6,1024)
+        # the payload is read row by row with the type that row needs and handed out as int64,
+        # as the values used to be, so that differences of unsigned rows do not wrap around
+        for row, field in enumerate(self.page_layout[self.debug_page]):
+            if field is None:
+                continue
+            name, dtype = field
+            words = np.frombuffer(payload, dtype=dtype, count=1024, offset=row*4096)
+            setattr(self, name, words if name == "drift" else words.astype(np.int64))
 
-        # the reason we do it this way is because some numbers are unsigned and some are signed
-        # now based on page we interpret it right
         if self.debug_page == 0:
-            self.have_lock = dataw[0] & 0xFF
-            self.lock_ant = (dataw[0] >> 8) & 0xFF
-            ## the actual metadata packet that would come is hidden in here
-            self.metadata = pystruct.calibrator_metadata.from_buffer_copy(payload[2*1024:2*1024+ctypes.sizeof(pystruct.calibrator_metadata)])
-            self.metadata.unique_packet_id = self.unique_packet_id
-            self.metadata.time = Time2Time(self.metadata.time_32, self.metadata.time_16)
-            self.metadata._from_debug = True
-            self.drift = cordic2rad(datau[1])
-            self.powertop0 = datau[2]
-        elif self.debug_page == 1:
-            self.powertop1 = datau[0]
-            self.powertop2 = datau[1]
-            self.powertop3 = datau[2]
-        elif self.debug_page == 2:
-            self.powerbot0 = datau[0]
-            self.powerbot1 = datau[1]
-            self.powerbot2 = datau[2]
-        elif self.debug_page == 3:
-            self.powerbot3 = datau[0]
-            self.fd0 = datai[1]
-            self.fd1 = datai[2]
-        elif self.debug_page == 4:
-            self.fd2 = datai[0]
-            self.fd3 = datai[1]
-            self.sd0 = datai[2]
-        elif self.debug_page == 5:
-            self.sd1 = datai[0]
-            self.sd2 = datai[1]
-            self.sd3 = datai[2]
-        elif self.debug_page == 6:
-            self.fdx = datai[0]
-            self.sdx = datai[1]
-            # snr fields are in Q16.4 format
-            self.snr0 = (datau[2] / 16.0)
-        elif self.debug_page == 7:
-            self.snr1 = (datau[0] / 16.0)
-            self.snr2 = (datau[1] / 16.0)
-            self.snr3 = (datau[2] / 16.0)
+            lock = np.frombuffer(payload, dtype="<u2", count=1024).astype(np.int64)
+            self.have_lock = lock & 0xFF
+            self.lock_ant = (lock >> 8) & 0xFF
+            ## the actual metadata packet that would come is hidden in here, see metadata
+            self._payload = payload
+            self.drift = cordic2rad_array(self.drift)
+        # snr fields are in Q16.4 format
+        for name in ("snr0", "snr1", "snr2", "snr3"):
+            if hasattr(self, name):
+                setattr(self, name, getattr(self, name) / 16.0)
+        self._is_read = True
+
+    @property
+    def metadata(self):
+        """Calibrator metadata embedded in debug page 0, decoded on first access (None for other pages)."""
+        self._read()
+        if self.debug_page != 0:
+            return None
+        if self._metadata is None:
+            metadata = pystruct.calibrator_metadata.from_buffer_copy(self._payload[2*1024:2*1024+ctypes.sizeof(pystruct.calibrator_metadata)])
+            metadata.unique_packet_id = self.unique_packet_id
+            metadata.time = Time2Time(metadata.time_32, metadata.time_16)
+            metadata._from_debug = True
+            self._metadata = metadata
+        return self._metadata
+
     def info(self):
         self._read()
         desc = " Calibrator Debug\n"
@@ -284,22 +290,17 @@ class Packet_Cal_ZoomSpectra(PacketBase):
         # ch1 autocorr + ch2 autocorr + ch12 corr real/imaginary parts = 4 arrays in total
         total_entries = fft_size * 4  ## 6 bytes for header
         use_float = True
-        self.unique_packet_id = struct.unpack("<I", self._blob[0:4])[0]
-        self.pfb_bin = struct.unpack("<H", self._blob[4:6])[0]
-        blob = self._blob[6:-2]  # last 2 bytes are padding to make it multiple of 4 bytes
+        self.unique_packet_id, self.pfb_bin = struct.unpack_from("<IH", self._blob)
+        blob = memoryview(self._blob)[6:-2]  # last 2 bytes are padding to make it multiple of 4 bytes
         if len(blob) == total_entries * 4:
-            if use_float:
-                data = struct.unpack(f"<{total_entries}f", blob)
-                dtype = np.float32
-            else:
-                data = struct.unpack(f"<{total_entries}i", blob)
-                dtype = np.int32
-
-            # we always use float32 in NumPy, dtype is just for conversion from raw byte array
-            self.AA = np.array(data[0:fft_size], dtype=dtype).astype(np.float32)
-            self.BB = np.array(data[fft_size:2*fft_size], dtype=dtype).astype(np.float32).astype(np.float32)
-            self.ABR = np.array(data[2*fft_size:3*fft_size], dtype=dtype).astype(np.float32).astype(np.float32)
-            self.ABI = np.array(data[3*fft_size:], dtype=dtype).astype(np.float32).astype(np.float32)
+            dtype = "<f4" if use_float else "<i4"
+            # we always use float32 in NumPy, dtype is just for conversion from raw byte array;
+            # for float data the arrays are views into the blob
+            data = np.frombuffer(blob, dtype=dtype).astype(np.float32, copy=False)
+            self.AA = data[0:fft_size]
+            self.BB = data[fft_size:2*fft_size]
+            self.ABR = data[2*fft_size:3*fft_size]
+            self.ABI = data[3*fft_size:]
         else:
             print(f"ERROR in ZoomSpectrum packet size: expected {total_entries * 4} bytes, got {len(blob)} bytes.")
             self.AA = np.zeros(fft_size, dtype=np.float32)
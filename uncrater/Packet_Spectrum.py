@@ -1,5 +1,5 @@
 from .PacketBase import PacketBase, pystruct, pystruct_203, pystruct_305, pystruct_307
-from .utils import Time2Time, process_ADC_stats, process_telemetry
+from .utils import Time2Time, process_ADC_stats, process_telemetry, adc_stat_keys, telemetry_keys
 from .c_utils import decode_10plus6, decode_5_into_4
 from .coreloop import pycoreloop
 import struct
@@ -12,6 +12,8 @@ cl = pycoreloop.pystruct
 
 
 class Packet_Metadata(PacketBase):
+    _derived = dict.fromkeys(["adc_" + k for k in adc_stat_keys] + ["telemetry_" + k for k in telemetry_keys], "_stats")
+
     @property
     def desc(self):
         return "Data Product Metadata"
@@ -21,30 +23,22 @@ class Packet_Metadata(PacketBase):
             return
         super()._read()
         
-        if self._version==0x203:
-            attrs = pystruct_203.meta_data.from_buffer_copy(self._blob)
-        elif self._version==0x305:
-            attrs = pystruct_305.meta_data.from_buffer_copy(self._blob)
-        elif self._version==0x307:
-            attrs = pystruct_307.meta_data.from_buffer_copy(self._blob)
-        else:
-            attrs = pystruct.meta_data.from_buffer_copy(self._blob)
-            
+        attrs = self._struct("meta_data").from_buffer_copy(self._blob)
         self.copy_attrs(attrs)
         self.weight = self.base.weight_previous if hasattr(self.base, 'weight_previous') else self.base.weight
         #print (self.base.weight_current, self.base.weight_previous,'X')
         self.format = self.base.format
         self.time = Time2Time(self.base.time_32, self.base.time_16)
         self.errormask = self.base.errors
-        adc = process_ADC_stats(self.base.ADC_stat)
-        for k, v in adc.items():
-            setattr(self, "adc_" + k, v)
-        telemetry = process_telemetry(self.base.TVS_sensors)
-        for k, v in telemetry.items():
-            setattr(self, "telemetry_" + k, v)
 
         self._is_read = True
 
+    def _stats(self):
+        # adc_* and telemetry_* attributes, see PacketBase._derived
+        stats = {"adc_" + k: v for k, v in process_ADC_stats(self.base.ADC_stat).items()}
+        stats.update(("telemetry_" + k, v) for k, v in process_telemetry(self.base.TVS_sensors).items())
+        return stats
+
     def info(self):
         self._read()
         desc = ""
@@ -82,24 +76,27 @@ class Packet_SpectrumBase(PacketBase):
     def parse_spectra(self):
         raise RuntimeError("Packet_SpectrumBase is abstract, do not instantiate")
 
-    def get_fmt_and_ptype(self) -> Tuple[str, np.number]:
-        if self.product < 4:
+    @staticmethod
+    def product_types(product) -> Tuple[str, np.number]:
+        # auto products are unsigned, cross products signed
+        if product < 4:
             return "I", np.uint32
         else:
             return "i", np.int32
 
+    def get_fmt_and_ptype(self) -> Tuple[str, np.number]:
+        return self.product_types(self.product)
+
+    def get_dtype(self) -> np.dtype:
+        # explicit little endian wire type of 32 bit data for np.frombuffer
+        return np.dtype(self.get_fmt_and_ptype()[1]).newbyteorder("<")
+
     def check_crc(self):
-        calculated_crc = binascii.crc32(self._blob[8:]) & 0xFFFFFFFF
-        self.error_crc_mismatch = not (self.crc == calculated_crc)
+        self.crc_calculated = binascii.crc32(memoryview(self._blob)[8:]) & 0xFFFFFFFF
+        self.error_crc_mismatch = not (self.crc == self.crc_calculated)
         if self.error_crc_mismatch:
-            print(f"CRC: {self.crc:x} {calculated_crc:x}")
+            print(f"CRC: {self.crc:x} {self.crc_calculated:x}")
             print("WARNING CRC mismatch!!!!!")
-            try:
-                Ndata = len(self._blob[8:]) // 4
-                data = struct.unpack(f"<{Ndata}{self.get_fmt_and_ptype()[0]}", self._blob[8:])
-                print(data, Ndata)
-            except:
-                pass
 
     def _read(self):
         if self._is_read:
@@ -111,7 +108,7 @@ class Packet_SpectrumBase(PacketBase):
 
         self.set_priority()
         super()._read()
-        self.unique_packet_id, self.crc = struct.unpack("<II", self._blob[:8])
+        self.unique_packet_id, self.crc = struct.unpack_from("<II", self._blob)
 
         if not hasattr(self, "meta"):
             print("Loading packet without metadata!")
@@ -121,7 +118,7 @@ class Packet_SpectrumBase(PacketBase):
             print("Packet ID mismatch!!")
             self.packed_id_mismatch = True
 
-        if self.meta.format == 0 and len(self._blob[8:]) // 4 > 2048:
+        if self.meta.format == 0 and (len(self._blob) - 8) // 4 > 2048:
             print("Spurious data, trimming!!!")
             self._blob = self._blob[: 8 + 2048 * 4]
 
@@ -145,6 +142,10 @@ class Packet_SpectrumBase(PacketBase):
 
 
 class Packet_Spectrum(Packet_SpectrumBase):
+    # storage of the decoded data: "float64" scaled by (1<<Navg2_shift)/weight, "float32"
+    # the same at half the memory, "raw" the unscaled wire integers with the factor in scale
+    dtypes = ("float64", "float32", "raw")
+    dtype = "float64"
 
     def set_priority(self):
         if (
@@ -167,24 +168,25 @@ class Packet_Spectrum(Packet_SpectrumBase):
             self.product = self.appid - id.AppID_SpectraLow
 
     def parse_spectra(self):
-        if self.meta.format == cl.OUTPUT_32BIT and len(self._blob[8:]) // 4 > 2048:
+        payload = memoryview(self._blob)[8:]
+        if self.meta.format == cl.OUTPUT_32BIT and len(payload) // 4 > 2048:
             print("Spurious data, trimming!!!")
             self._blob = self._blob[: 8 + 2048 * 4]
+            payload = memoryview(self._blob)[8:]
 
         fmt, ptype = self.get_fmt_and_ptype()
 
         if self.meta.format == cl.OUTPUT_32BIT:
-            Ndata = len(self._blob[8:]) // 4
+            Ndata = len(payload) // 4
             try:
-                data = struct.unpack(f"<{Ndata}{fmt}", self._blob[8:])
+                data = np.frombuffer(payload, dtype=self.get_dtype())
             except:
                 self.error_data_read = True
                 data = np.zeros(Ndata)
         elif self.meta.format in [cl.OUTPUT_16BIT_10_PLUS_6, cl.OUTPUT_16BIT_4_TO_5]:
-            Ndata = len(self._blob[8:]) // 2
+            Ndata = len(payload) // 2
             try:
-                compressed_data = struct.unpack(f"<{Ndata}H", self._blob[8:])
-                compressed_data = np.array(compressed_data, dtype=np.uint16)
+                compressed_data = np.frombuffer(payload, dtype="<u2")
             except:
                 print("ERROR unpacking byte sequence")
                 self.error_data_read = True
@@ -202,7 +204,18 @@ class Packet_Spectrum(Packet_SpectrumBase):
         else:
             raise NotImplementedError(f"Format {self.meta.format} is not supported")
 
-        self.data = np.array(data, dtype=ptype).astype(np.float64)/self.meta.weight*(1<<self.meta.base.Navg2_shift)
+        data = np.asarray(data).astype(ptype, copy=False)
+        # numpy division: a weight of 0 (all spectra rejected) gives inf with a warning, as the data do
+        self.scale = np.float64(1<<self.meta.base.Navg2_shift) / self.meta.weight
+        if self.dtype == "raw":
+            self.data = data
+        elif self.dtype in ("float64", "float32"):
+            # one float copy of the wire data, scaled in place
+            self.data = data.astype(self.dtype)
+            self.data /= self.meta.weight
+            self.data *= (1<<self.meta.base.Navg2_shift)
+        else:
+            raise ValueError(f"dtype must be one of {self.dtypes}, not {self.dtype!r}")
         
 
 
@@ -238,17 +251,17 @@ class Packet_TR_Spectrum(Packet_SpectrumBase):
             # data consists of uint16_t, _blob has type int32_t
 
         
-        Ndata = len(self._blob[8:]) // 2
+        payload = memoryview(self._blob)[8:]
+        Ndata = len(payload) // 2
         try:
-            enc_data = struct.unpack(f"<{Ndata}H", self._blob[8:])
-            enc_data = np.array(enc_data, dtype=np.uint16)
+            enc_data = np.frombuffer(payload, dtype="<u2")
             data = decode_10plus6(enc_data)
         except:
             self.error_data_read = True
             data = np.zeros(Ndata, dtype=np.int32)
         #else:
         #    raise NotImplementedError("Only format 0 is supported")
-        self.data = np.array(data, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.int32)
         if self.meta is not None:
             Nbins = (self.meta.base.tr_stop-self.meta.base.tr_start)//(1<<self.meta.base.tr_avg_shift)
             self.data = self.data.reshape((-1,Nbins))
@@ -262,9 +275,9 @@ class Packet_Grimm(PacketBase):
         if self._is_read:
             return
         super()._read()
-        self.unique_packet_id = struct.unpack("<I", self._blob[:4])
-        Ndata = len(self._blob[4:]) // 2
-        data = np.array(struct.unpack(f"<{Ndata}H", self._blob[4: 4 + Ndata * 2]),dtype=np.uint16)
+        self.unique_packet_id = struct.unpack_from("<I", self._blob)[0]
+        Ndata = (len(self._blob) - 4) // 2
+        data = np.frombuffer(self._blob, dtype="<u2", count=Ndata, offset=4)
         self.data = decode_5_into_4(data).reshape((-1,16,4))        
         self._is_read = True
 
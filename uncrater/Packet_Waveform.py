@@ -13,19 +13,21 @@ class Packet_Waveform(PacketBase):
         if self._is_read:
             return
         super()._read()
-        fmt = "16384H"
-        try:
-            self.waveform = np.array(struct.unpack(fmt, self._blob))
-        except struct.error as e:
-            print (f"Wrong packet size in waveform!! Ignoring: {e}")
-            self.waveform = np.zeros(16384, dtype=np.uint16)
+        Nsamples = 16384
+        if len(self._blob) == 2*Nsamples:
+            self.waveform = np.frombuffer(self._blob, dtype="<u2").astype(np.int64)
+        else:
+            print (f"Wrong packet size in waveform!! Ignoring: expected {2*Nsamples} bytes, got {len(self._blob)}")
+            self.waveform = np.zeros(Nsamples, dtype=np.int64)
         self.waveform[self.waveform>8192] -= 16384 
         self.ch = self.appid - 0x2f0
         if self.ch>=512:
             self.ch -= 512
         self._is_read = True
-        self.timestamp = 0xFFFFFFFFFFFFFFFF
-        self.meta = None                
+        # the metadata packet may have been attached before a lazy read
+        if 'meta' not in self.__dict__:
+            self.timestamp = 0xFFFFFFFFFFFFFFFF
+            self.meta = None                
 
     def info (self):
         self._read()
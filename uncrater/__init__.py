@@ -1,4 +1,5 @@
 from .Collection import Collection
+from .stream import iter_packets, iter_spectra
 from .Packet import Packet
 from .Packet import id as appid
 from .Packet import appId_from_value, value_from_appId
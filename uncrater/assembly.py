@@ -0,0 +1,301 @@
+# Assembly of the packets of a session into spectra, calibrator cycles and waveforms, in
+# the order they arrive or by the unique_packet_id they share
+import struct
+
+from .Packet import id, Packet_Waveform, Packet_Waveform_Meta
+from .Packet import (appid_is_metadata, appid_is_spectrum, appid_is_tr_spectrum, appid_is_cal_data,
+                     appid_is_rawPFB, appid_is_cal_debug)
+
+# the families of packets assembled into units, with the number of members of a complete unit
+unit_slots = {"spectra": 17, "tr_spectra": 16, "cal_data": 3, "rawpfb": 8, "cal_debug": 8}
+
+
+def peek_unique_packet_id(packet) -> int:
+    """Returns the unique_packet_id in the first 4 bytes of a spectral or calibrator packet
+    without decoding it."""
+    return struct.unpack_from("<I", packet._load_blob())[0]
+
+
+class GroupAssembler:
+    """Collects the members of groups keyed by unique_packet_id, e.g. a metadata packet
+    and its 16 products, from packets in any order.
+
+    A group is done when all of its slots are filled, or, incomplete, once max_gap packets
+    went by since its first member or more than capacity groups are open. Lookups are
+    dicts, so adding a packet costs O(1) whatever the number of open groups.
+    """
+
+    def __init__(self, slots, max_gap=1000, capacity=None):
+        self.slots = slots
+        self.max_gap = max_gap
+        self.capacity = max_gap if capacity is None else capacity
+        # open groups by key as (members by slot, position of the first member); dicts keep
+        # insertion order so the oldest group is always the first
+        self.groups = {}
+        self.complete = 0
+        self.incomplete = 0
+        self.duplicates = 0
+
+    def add(self, key, slot, packet, position):
+        """Adds packet as member slot of group key, position counting the packets seen.
+
+        Returns the groups that are done as (key, members, complete) tuples, oldest first.
+        """
+        if key not in self.groups:
+            self.groups[key] = ({}, position)
+        members = self.groups[key][0]
+        if slot in members:
+            # a repeated packet replaces the earlier one
+            self.duplicates += 1
+        members[slot] = packet
+        done = []
+        if len(members) == self.slots:
+            del self.groups[key]
+            self.complete += 1
+            done.append((key, members, True))
+        return self.evict(position) + done
+
+    def evict(self, position):
+        """Returns the open groups that went stale at position as incomplete groups."""
+        done = []
+        while len(self.groups) > 0:
+            key, (members, first) = next(iter(self.groups.items()))
+            if position - first <= self.max_gap and len(self.groups) <= self.capacity:
+                break
+            del self.groups[key]
+            self.incomplete += 1
+            done.append((key, members, False))
+        return done
+
+    def flush(self, ready=None):
+        """Returns all open groups, oldest first, and closes them; with ready, only those
+        whose members ready accepts, the others stay open."""
+        done = [(key, members, False) for key, (members, first) in self.groups.items()
+                if ready is None or ready(members)]
+        self.incomplete += len(done)
+        for key, members, complete in done:
+            del self.groups[key]
+        return done
+
+    def stats(self):
+        return {"complete": self.complete, "incomplete": self.incomplete,
+                "pending": len(self.groups), "duplicates": self.duplicates}
+
+
+def unit_member(appid):
+    """Returns the family and the slot of the packets with appid in the units they belong to,
+    None for packets that are not assembled with others."""
+    if appid_is_metadata(appid):
+        return "spectra", "meta"
+    if appid_is_spectrum(appid):
+        return "spectra", appid & 0x0F
+    if appid_is_tr_spectrum(appid):
+        return "tr_spectra", appid & 0x0F
+    if appid_is_cal_data(appid):
+        return "cal_data", appid - id.AppID_Calibrator_Data
+    if appid_is_rawPFB(appid):
+        return "rawpfb", appid - id.AppID_Calibrator_RawPFB
+    if appid_is_cal_debug(appid):
+        return "cal_debug", appid - id.AppID_Calibrator_Debug
+    return None
+
+
+class PacketAssembler:
+    """Assigns the packets of a session, as they are received, to the units they belong to:
+    spectra and TR spectra to their metadata packet, calibrator data, raw PFB and debug pages
+    to their start page and waveforms to the waveform metadata that follows them. Collection
+    and iter_packets both assemble with it.
+
+    By default a packet joins the last unit of its family and spectral packets before the
+    first metadata are skipped. With reorder_gap set, spectra, TR spectra and calibrator
+    pages are matched by unique_packet_id with a GroupAssembler per family instead, so they
+    may arrive in any order; the metadata of the last retain spectra (all by default) and
+    the missing pages of the last retain incomplete calibrator units are kept for their
+    late packets.
+
+    add() and flush() return what happened as a list of events:
+        ("open", family, key, members)    a unit starts, with its members by slot
+        ("join", family, key, slot, P)    P joins the unit key opened before
+        ("close", family, key)            the unit key is done, only late packets may join
+        ("orphan", family, key, members)  packets without the metadata or start page of their unit
+    Spectral members come with their metadata set, calibrator pages with the id of their
+    start page; decoding them is up to the caller. TR units always have their "meta".
+    """
+
+    def __init__(self, reorder_gap=None, retain=None):
+        self.groups = None
+        if reorder_gap is not None:
+            self.groups = {family: GroupAssembler(slots, reorder_gap) for family, slots in unit_slots.items()}
+        self.retain = retain
+        # in order: (key, members) of the last unit of every family; by id: the metadata of
+        # the spectra and TR spectra assembled and the missing pages of the incomplete
+        # calibrator units, by unique_packet_id
+        self.current = dict.fromkeys(unit_slots)
+        self.assembled = {family: {} for family in unit_slots}
+        self.waveforms = [None, None, None, None]
+        self.units = 0
+        self.orphaned = dict.fromkeys(unit_slots, 0)
+        self.late = dict.fromkeys(unit_slots, 0)
+
+    def skips(self, appid):
+        """Whether a packet with appid is thrown out before it is even created: sometimes there
+        is initial garbage of spectra before the first metadata."""
+        return (self.groups is None and self.current["spectra"] is None
+                and (appid_is_spectrum(appid) or appid_is_tr_spectrum(appid)))
+
+    def add(self, appid, packet, position):
+        """Adds packet, position counting the packets seen, and returns the events it causes."""
+        if isinstance(packet, Packet_Waveform):
+            # channel from the appid, as Packet_Waveform does, so lazy waveforms stay unread
+            channel = (appid - id.AppID_RawADC) % 512
+            replaced = self.waveforms[channel]
+            self.waveforms[channel] = packet
+            return [] if replaced is None else [("orphan", "waveform", None, {channel: replaced})]
+        if isinstance(packet, Packet_Waveform_Meta):
+            packet.set_packets(self.waveforms)
+            self.waveforms = [None, None, None, None]
+            self.units += 1
+            return [("open", "waveform", self.units, {"meta": packet}), ("close", "waveform", self.units)]
+        member = unit_member(appid)
+        if member is None:
+            return []
+        if self.groups is None:
+            return self._add_in_order(*member, packet)
+        return self._add_by_id(*member, packet, position)
+
+    def flush(self, final=True):
+        """Returns the events of the units left open. Groups still incomplete by id are
+        assembled as they are, their later packets still join them; unless final, calibrator
+        groups without their start page stay open for it. The units in order stay open for
+        the next packets unless final, which also gives up on the waveforms without their
+        metadata."""
+        events = []
+        if self.groups is not None:
+            for family, groups in self.groups.items():
+                ready = None
+                if not final and family not in ("spectra", "tr_spectra"):
+                    ready = lambda members, family=family: self._started(family, members)
+                events += self._assembled(family, groups.flush(ready))
+        elif final:
+            for family in unit_slots:
+                events += self._close(family)
+        if final:
+            events += [("orphan", "waveform", None, {channel: P})
+                       for channel, P in enumerate(self.waveforms) if P is not None]
+            self.waveforms = [None, None, None, None]
+        return events
+
+    def stats(self):
+        """Returns the completeness of the groups assembled by unique_packet_id, None in order."""
+        if self.groups is None:
+            return None
+        stats = {}
+        for family, groups in self.groups.items():
+            stats[family] = groups.stats()
+            stats[family].update(orphaned=self.orphaned[family], late=self.late[family])
+        return stats
+
+    def _open(self, family, members):
+        # in order: a unit replaces the last one of its family
+        events = self._close(family)
+        self.units += 1
+        self.current[family] = (self.units, members)
+        return events + [("open", family, self.units, members)]
+
+    def _close(self, family):
+        if self.current[family] is None:
+            return []
+        key = self.current[family][0]
+        self.current[family] = None
+        return [("close", family, key)]
+
+    def _orphan(self, family, key, members):
+        self.orphaned[family] += 1
+        return [("orphan", family, key, members)]
+
+    def _add_in_order(self, family, slot, packet):
+        # spectra belong to the last metadata packet, calibrator pages to the last start page
+        if slot == "meta":
+            # metadata without TR data have no TR spectrum
+            return self._close("spectra") + self._close("tr_spectra") + self._open("spectra", {"meta": packet})
+        if family in ("spectra", "tr_spectra"):
+            meta = self.current["spectra"][1]["meta"]
+            packet.set_meta(meta)
+            if self.current[family] is None:
+                return self._open(family, {"meta": meta, slot: packet})
+        elif slot == 0:
+            return self._open(family, {0: packet})
+        elif self.current[family] is None:
+            # a page without its start page
+            packet.set_meta_id(None)
+            return self._orphan(family, None, {slot: packet})
+        else:
+            packet.set_meta_id(peek_unique_packet_id(self.current[family][1][0]))
+        key, members = self.current[family]
+        members[slot] = packet
+        return [("join", family, key, slot, packet)]
+
+    def _add_by_id(self, family, slot, packet, position):
+        if slot == "meta":
+            packet.read()
+            key = packet.unique_packet_id
+        else:
+            key = peek_unique_packet_id(packet)
+            if family not in ("spectra", "tr_spectra"):
+                packet.set_meta_id(key)
+        assembled = self.assembled[family]
+        if family in ("spectra", "tr_spectra") and key in assembled:
+            # a late packet of a spectrum assembled before
+            self.late[family] += 1
+            if slot == "meta":
+                return []
+            packet.set_meta(assembled[key])
+            return [("join", family, key, slot, packet)]
+        if slot in assembled.get(key, ()):
+            # a late page of an incomplete calibrator unit
+            self.late[family] += 1
+            assembled[key].discard(slot)
+            if len(assembled[key]) == 0:
+                del assembled[key]
+            return [("join", family, key, slot, packet)]
+        return self._assembled(family, self.groups[family].add(key, slot, packet, position))
+
+    def _assembled(self, family, groups):
+        # complete groups, or incomplete ones given up on, open and close at once
+        events = []
+        for key, members, complete in groups:
+            if family in ("spectra", "tr_spectra"):
+                meta = members.get("meta") if family == "spectra" else self._meta(key)
+                if meta is None:
+                    # products cannot be decoded without their metadata
+                    events += self._orphan(family, key, members)
+                    continue
+                members["meta"] = meta
+                for slot, packet in members.items():
+                    if slot != "meta":
+                        packet.set_meta(meta)
+                self._keep(family, key, meta)
+            elif not self._started(family, members):
+                events += self._orphan(family, key, members)
+                continue
+            elif not complete:
+                self._keep(family, key, set(range(unit_slots[family])) - set(members))
+            events += [("open", family, key, members), ("close", family, key)]
+        return events
+
+    def _started(self, family, members):
+        # calibrator units are assembled from their start page, calibrator data also from
+        # the page with gNacc and gphase
+        return 0 in members or (family == "cal_data" and 2 in members)
+
+    def _keep(self, family, key, value):
+        assembled = self.assembled[family]
+        assembled[key] = value
+        if self.retain is not None and len(assembled) > self.retain:
+            del assembled[next(iter(assembled))]
+
+    def _meta(self, key):
+        if key in self.assembled["spectra"]:
+            return self.assembled["spectra"][key]
+        group = self.groups["spectra"].groups.get(key)
+        return None if group is None else group[0].get("meta")
@@ -1,5 +1,5 @@
 import numpy as np
-from typing import Union
+from typing import Tuple, Union
 
 INT32_MIN = -(2**31)
 INT32_MAX = 2**31 - 1
@@ -34,7 +34,8 @@ def encode_10plus6(x: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
 def decode_10plus6(x: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
     if isinstance(x, np.ndarray):
         assert x.dtype == np.uint16
-        return np.array([_decode_10plus6_scalar(int(y)) for y in x], dtype=np.int32)
+        # works for a single packet as well as for a stack of packets of any shape
+        return _DECODE_10PLUS6_TABLE[x]
     return _decode_10plus6_scalar(int(x))
 
 
@@ -76,143 +77,156 @@ def _decode_10plus6_scalar(val: int) -> int:
     return int(out)
 
 
+def _build_10plus6_table() -> np.ndarray:
+    # vectorized twin of _decode_10plus6_scalar evaluated for every possible 16 bit word;
+    # int64 intermediates wrap to int32 the same way the coreloop C code does
+    val = np.arange(1 << 16, dtype=np.int64)
+    is_neg = (val & 32) != 0
+    lz = val & 31
+    out = val & ~63
+    out = np.where(lz > 16, out >> np.maximum(lz - 16, 0), out << np.maximum(16 - lz, 0))
+    out = np.where(is_neg, -out, out)
+    return out.astype(np.int32)
+
+
+# lookup table: _DECODE_10PLUS6_TABLE[word] == decode_10plus6(word)
+_DECODE_10PLUS6_TABLE = _build_10plus6_table()
+_DECODE_10PLUS6_TABLE.flags.writeable = False
+
+
+def _clz32_array(val: np.ndarray) -> np.ndarray:
+    # leading zeros of non-negative values below 2**32; frexp exponent is the bit length
+    val = np.asarray(val, dtype=np.int64)
+    return 32 - np.frexp(val.astype(np.float64))[1].astype(np.int64)
+
+
+def _safe_abs_int32_array(val: np.ndarray) -> np.ndarray:
+    val = np.asarray(val, dtype=np.int64)
+    return np.minimum(np.abs(val), INT32_MAX)
+
+
 def encode_4_into_5(vals_in: np.ndarray) -> np.ndarray:
-    assert vals_in.size == 4
-    vals_in = np.ascontiguousarray(vals_in, dtype=np.int32)
-    shifts = 0
-    compressed = np.zeros(4, dtype=np.uint16)
-    for i in range(4):
-        val = int(vals_in[i])
-        negative_bit = 1 << 15 if val < 0 else 0
-        abs_value = _safe_abs_int32(val)
-        lz = _clz32(abs_value)
-        shift = 0 if lz >= 18 else 18 - lz
-        in_place_shift_bit = 1 << 14 if shift >= 16 else 0
-        stored_shift = shift - 16 if shift >= 16 else shift
-        shifts |= (stored_shift << (4 * i))
-        compressed_val = (abs_value >> shift) & 0x3FFF
-        compressed[i] = compressed_val | negative_bit | in_place_shift_bit
-
-    out = np.zeros(5, dtype=np.uint16)
-    out[0] = shifts
-    out[1:] = compressed
-    return out
+    # encodes any number of groups of 4 values at once, each group into 5 words
+    assert vals_in.size % 4 == 0, "Input array length must be a multiple of 4"
+    vals = np.ascontiguousarray(vals_in, dtype=np.int32).reshape(-1, 4).astype(np.int64)
+    negative_bit = (vals < 0).astype(np.int64) << 15
+    abs_value = _safe_abs_int32_array(vals)
+    lz = _clz32_array(abs_value)
+    shift = np.where(lz >= 18, 0, 18 - lz)
+    in_place_shift = shift >= 16
+    stored_shift = np.where(in_place_shift, shift - 16, shift)
+    shifts = (stored_shift << (4 * np.arange(4))).sum(axis=1)
+    compressed = ((abs_value >> shift) & 0x3FFF) | negative_bit | (in_place_shift.astype(np.int64) << 14)
+
+    out = np.empty((vals.shape[0], 5), dtype=np.uint16)
+    out[:, 0] = shifts
+    out[:, 1:] = compressed
+    return out.reshape(-1)
 
 
 def decode_5_into_4(compressed_data: np.ndarray) -> np.ndarray:
     assert compressed_data.size % 5 == 0, "Input array length must be a multiple of 5"
-    compressed_data = np.ascontiguousarray(compressed_data, dtype=np.uint16)
-    num_chunks = compressed_data.size // 5
-    decompressed_data = np.zeros(num_chunks * 4, dtype=np.int32)
-    for i in range(num_chunks):
-        chunk = compressed_data[i * 5:(i + 1) * 5]
-        shifts = int(chunk[0])
-        for j in range(4):
-            comp = int(chunk[1 + j])
-            is_neg = bool(comp & (1 << 15))
-            shift_adjustment = 16 if (comp & (1 << 14)) else 0
-            shift = ((shifts >> (4 * j)) & 0xF) + shift_adjustment
-            abs_val = (comp & 0x3FFF) << shift
-            decompressed_data[i * 4 + j] = -abs_val if is_neg else abs_val
-    return decompressed_data
+    chunks = np.ascontiguousarray(compressed_data, dtype=np.uint16).reshape(-1, 5).astype(np.int64)
+    comp = chunks[:, 1:]
+    shift_adjustment = np.where(comp & (1 << 14), 16, 0)
+    shift = ((chunks[:, :1] >> (4 * np.arange(4))) & 0xF) + shift_adjustment
+    abs_val = (comp & 0x3FFF) << shift
+    decompressed_data = np.where(comp & (1 << 15), -abs_val, abs_val)
+    # wrap to int32 like the C code does
+    return decompressed_data.astype(np.int32).reshape(-1)
 
 
-def encode_shared_lz_positive(spectra: np.ndarray) -> np.ndarray:
-    spectra = np.ascontiguousarray(spectra, dtype=np.uint32)
-    size = int(spectra.size)
-    out = bytearray()
+def _get_shift_by_array(val: np.ndarray) -> np.ndarray:
+    return np.maximum(16 - _clz32_array(val) + 1, 0)
+
+
+def _shared_lz_segments(shift_by: np.ndarray, is_neg: np.ndarray) -> np.ndarray:
+    # greedy segmentation of the C encoder: a segment grows while the shift stays within
+    # one of its first element, the sign is unchanged and it has fewer than 255 elements
+    size = int(shift_by.size)
+    starts = []
     i = 0
     while i < size:
-        shift_by = _get_shift_by(int(spectra[i]))
-        j = i + 1
-        while j < size and (j - i) < 255:
-            next_shift_by = _get_shift_by(int(spectra[j]))
-            if abs(shift_by - next_shift_by) > 1:
-                break
-            j += 1
-        if shift_by == 17:
-            shift_by = 16
-        n = j - i
-        out.append(np.int8(shift_by).item() & 0xFF)
-        out.append(n & 0xFF)
-        for k in range(i, j):
-            compressed_val = int(spectra[k]) >> shift_by
-            out.extend(int(compressed_val).to_bytes(2, "little", signed=False))
-        i = j
-    return np.frombuffer(bytes(out), dtype=np.uint8)
+        window = slice(i + 1, min(i + 255, size))
+        breaks = np.flatnonzero(
+            (np.abs(shift_by[window] - shift_by[i]) > 1) | (is_neg[window] != is_neg[i])
+        )
+        starts.append(i)
+        i = i + 1 + int(breaks[0]) if breaks.size else window.stop
+    starts.append(size)
+    return np.array(starts, dtype=np.int64)
+
+
+def _pack_shared_lz(header: np.ndarray, starts: np.ndarray, payload: np.ndarray) -> np.ndarray:
+    # segment k is one (header byte, count byte) word followed by its payload words
+    lens = np.diff(starts)
+    nseg = lens.size
+    out = np.empty(nseg + payload.size, dtype="<u2")
+    header_pos = starts[:-1] + np.arange(nseg)
+    is_header = np.zeros(out.size, dtype=bool)
+    is_header[header_pos] = True
+    out[header_pos] = (header & 0xFF) | (lens << 8)
+    out[~is_header] = payload
+    return out.view(np.uint8)
+
+
+def _unpack_shared_lz(compressed_data: np.ndarray, array_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    # splits the stream into per-sample header bytes and payload words: phase one hops
+    # over the segment headers only, phase two gathers all payload words in one go;
+    # samples beyond array_size or past the end of a truncated stream are dropped
+    buf = np.ascontiguousarray(compressed_data, dtype=np.uint8).tobytes()
+    data_len = len(buf)
+    starts = []
+    idx = 0
+    i = 0
+    while i + 1 < data_len and idx < array_size:
+        starts.append(i)
+        n = buf[i + 1]
+        idx += n
+        i += 2 + 2 * n
+    starts = np.array(starts, dtype=np.int64)
+    header = np.frombuffer(buf, dtype=np.uint8)[starts]
+    counts = np.frombuffer(buf, dtype=np.uint8)[starts + 1].astype(np.int64)
+
+    words = np.frombuffer(buf, dtype="<u2", count=data_len // 2)
+    seg_first = np.cumsum(counts) - counts
+    word_idx = np.repeat(starts // 2 + 1 - seg_first, counts) + np.arange(int(counts.sum()))
+    n = min(word_idx.size, array_size, int(np.searchsorted(word_idx, words.size)))
+    return np.repeat(header, counts)[:n], words[word_idx[:n]].astype(np.int64)
+
+
+def encode_shared_lz_positive(spectra: np.ndarray) -> np.ndarray:
+    spectra = np.ascontiguousarray(spectra, dtype=np.uint32).reshape(-1).astype(np.int64)
+    shift_by = _get_shift_by_array(spectra)
+    starts = _shared_lz_segments(shift_by, np.zeros(spectra.size, dtype=bool))
+    seg_shift = np.minimum(shift_by[starts[:-1]], 16)
+    payload = spectra >> np.repeat(seg_shift, np.diff(starts))
+    return _pack_shared_lz(seg_shift, starts, payload)
 
 
 def decode_shared_lz_positive(compressed_data: np.ndarray, array_size: int) -> np.ndarray:
-    data = np.ascontiguousarray(compressed_data, dtype=np.uint8)
+    header, compressed_val = _unpack_shared_lz(compressed_data, array_size)
+    shift_by = header.view(np.int8).astype(np.int64)
     x = np.zeros(array_size, dtype=np.uint32)
-    idx = 0
-    i = 0
-    data_len = int(data.size)
-    while i < data_len and idx < array_size:
-        shift_by = np.int8(data[i]).item()
-        i += 1
-        n = int(data[i])
-        i += 1
-        for _ in range(n):
-            compressed_val = int.from_bytes(bytes(data[i:i + 2]), "little", signed=False)
-            i += 2
-            x[idx] = (compressed_val << shift_by) & 0xFFFFFFFF
-            idx += 1
+    x[:compressed_val.size] = (compressed_val << shift_by) & 0xFFFFFFFF
     return x
 
 
 def encode_shared_lz_signed(spectra: np.ndarray) -> np.ndarray:
-    spectra = np.ascontiguousarray(spectra, dtype=np.int32)
-    size = int(spectra.size)
-    out = bytearray()
-    i = 0
-    while i < size:
-        val = int(spectra[i])
-        is_neg = 1 if val < 0 else 0
-        shift_by = _get_shift_by(_safe_abs_int32(val))
-        j = i + 1
-        while j < size and (j - i) < 255:
-            next_val = int(spectra[j])
-            next_is_neg = 1 if next_val < 0 else 0
-            if next_is_neg != is_neg:
-                break
-            next_shift_by = _get_shift_by(_safe_abs_int32(next_val))
-            if abs(next_shift_by - shift_by) > 1:
-                break
-            j += 1
-
-        if shift_by == 17:
-            shift_by = 16
-
-        segment_len = j - i
-        sign_and_shift = (is_neg << 7) | (shift_by & 31)
-        out.append(sign_and_shift & 0xFF)
-        out.append(segment_len & 0xFF)
-        for k in range(i, j):
-            abs_val = _safe_abs_int32(int(spectra[k]))
-            compressed_val = abs_val >> shift_by
-            out.extend(int(compressed_val).to_bytes(2, "little", signed=False))
-        i = j
-    return np.frombuffer(bytes(out), dtype=np.uint8)
+    spectra = np.ascontiguousarray(spectra, dtype=np.int32).reshape(-1).astype(np.int64)
+    is_neg = spectra < 0
+    abs_val = _safe_abs_int32_array(spectra)
+    shift_by = _get_shift_by_array(abs_val)
+    starts = _shared_lz_segments(shift_by, is_neg)
+    seg_shift = np.minimum(shift_by[starts[:-1]], 16)
+    sign_and_shift = (is_neg[starts[:-1]].astype(np.int64) << 7) | (seg_shift & 31)
+    payload = abs_val >> np.repeat(seg_shift, np.diff(starts))
+    return _pack_shared_lz(sign_and_shift, starts, payload)
 
 
 def decode_shared_lz_signed(compressed_data: np.ndarray, array_size: int) -> np.ndarray:
-    data = np.ascontiguousarray(compressed_data, dtype=np.uint8)
+    sign_and_shift, compressed_val = _unpack_shared_lz(compressed_data, array_size)
+    abs_val = compressed_val << (sign_and_shift & 31)
     x = np.zeros(array_size, dtype=np.int32)
-    idx = 0
-    i = 0
-    data_len = int(data.size)
-    while i < data_len and idx < array_size:
-        sign_and_shift = int(data[i])
-        i += 1
-        is_neg = (sign_and_shift >> 7) & 1
-        shift_by = sign_and_shift & 31
-        segment_len = int(data[i])
-        i += 1
-        for _ in range(segment_len):
-            compressed_val = int.from_bytes(bytes(data[i:i + 2]), "little", signed=False)
-            i += 2
-            abs_val = compressed_val << shift_by
-            x[idx] = -abs_val if is_neg else abs_val
-            idx += 1
+    x[:compressed_val.size] = np.where(sign_and_shift & 0x80, -abs_val, abs_val).astype(np.int32)
     return x
@@ -6,7 +6,8 @@ bundled bindings (307) as the default export for legacy callers of
 ``import pycoreloop``.
 """
 
-import importlib, os, sys
+import importlib, os, sys, struct
+from functools import lru_cache
 
 # Import versioned bindings as submodules so their symbols (e.g. appId_from_value)
 # are reachable via pycoreloop.pycoreloop_XXX
@@ -24,9 +25,48 @@ except ImportError:
     print ("Can't import pycoreloop from CORELOOP_DIR. Will revert too 307.\n")
     pycoreloop = pycoreloop_307
 
+# SW version -> bundled bindings; any other version is served by the default pycoreloop
+bindings_by_version = {
+    module.pystruct.VERSION_ID: module
+    for module in (pycoreloop_203, pycoreloop_305, pycoreloop_307)
+}
+
+
+@lru_cache(maxsize=None)
+def bindings_for(version):
+    """Returns the pycoreloop bindings for a SW version (default pycoreloop for None or unknown)."""
+    return bindings_by_version.get(version, pycoreloop)
+
+
+@lru_cache(maxsize=None)
+def struct_for(version, name):
+    """Returns the pystruct class called name from the bindings for a SW version."""
+    return getattr(bindings_for(version).pystruct, name)
+
+
+_hello_version_offset = pycoreloop.pystruct.startup_hello.SW_version.offset
+
+
+def detect_version(appid, blob):
+    """Returns the SW version a packet declares: SW_version of the hello packet or the
+    version field housekeeping and metadata packets start with. None for other packets.
+    """
+    try:
+        if appid == pycoreloop.appId.AppID_uC_Start:
+            return struct.unpack_from("<I", blob, _hello_version_offset)[0]
+        if appid in (pycoreloop.appId.AppID_uC_Housekeeping, pycoreloop.appId.AppID_MetaData):
+            return struct.unpack_from("<H", blob)[0]
+    except struct.error:
+        pass
+    return None
+
+
 __all__ = [
 	'pycoreloop_203',
 	'pycoreloop_305',
 	'pycoreloop_307',
-    'pycoreloop'
+    'pycoreloop',
+    'bindings_for',
+    'struct_for',
+    'detect_version',
 ]
@@ -0,0 +1,123 @@
+# One pass integrity check of the spectra, heartbeats and metadata of a Collection
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .Packet_Heartbeat import Packet_Heartbeat
+
+packet_dtype = np.dtype([("tr", "?"), ("spectrum", "i8"), ("product", "u1"), ("unique_packet_id", "u4"),
+                         ("crc", "u4"), ("crc_calculated", "u4"), ("crc_ok", "?"), ("id_mismatch", "?")])
+
+
+def _check_blobs(packets):
+    # runs in a worker thread; zlib releases the GIL while it computes the CRC
+    results = []
+    for packet in packets:
+        if packet._is_read:
+            # the CRC was checked when the packet was read
+            results.append((packet.unique_packet_id, packet.crc, packet.crc_calculated))
+            continue
+        # the blobs of unread packets are not kept, so the scan does not hold the session in memory
+        blob = packet._blob if packet._blob is not None else packet._fetch_blob()
+        if packet.meta.format == 0 and (len(blob) - 8) // 4 > 2048:
+            # trimmed as Packet_Spectrum._read does, so the CRC is the same whether the packet was read or not
+            blob = memoryview(blob)[: 8 + 2048 * 4]
+        unique_packet_id, crc = struct.unpack_from("<II", blob)
+        results.append((unique_packet_id, crc, zlib.crc32(memoryview(blob)[8:])))
+    return results
+
+
+class IntegrityReport:
+    """ The integrity of the spectra of a Collection, see Collection.integrity().
+
+        packets is a table with one row per spectral and TR spectral packet: whether it
+        is a TR product, its spectrum and product, the unique_packet_id and CRC it carries,
+        the CRC of its payload and whether they match its metadata. present and tr_present
+        are (spectra, 16) flags of the products that came in, heartbeat_counts and
+        meta_errors the heartbeat counters and metadata error masks in order.
+    """
+
+    def __init__(self, packets, present, tr_present, heartbeat_counts, meta_errors):
+        self.packets = packets
+        self.present = present
+        self.tr_present = tr_present
+        self.heartbeat_counts = heartbeat_counts
+        self.meta_errors = meta_errors
+
+    def _select(self, flag, tr):
+        return self.packets[flag & (self.packets["tr"] == tr)]
+
+    def crc_failures(self, tr=False):
+        """ Rows of the packets whose CRC does not match their payload. """
+        return self._select(~self.packets["crc_ok"], tr)
+
+    def id_mismatches(self, tr=False):
+        """ Rows of the packets whose unique_packet_id is not that of their metadata. """
+        return self._select(self.packets["id_mismatch"], tr)
+
+    def missing_products(self, tr=False):
+        """ (spectrum, product) pairs of the products that never came in. """
+        return np.argwhere(~(self.tr_present if tr else self.present))
+
+    def heartbeat_gaps(self):
+        """ Indices i of the heartbeats after which counters are missing; a counter that
+            goes back, or restarts from 0, is a reboot and not a gap.
+        """
+        counts = self.heartbeat_counts.astype(np.int64)
+        before, after = counts[:-1], counts[1:]
+        return np.flatnonzero((after != before + 1) & (after >= before) & (before != 0))
+
+    def error_spectra(self):
+        """ Indices of the spectra whose metadata report errors. """
+        return np.flatnonzero(self.meta_errors)
+
+    def summary(self):
+        """ Returns the number of failures of every kind, all 0 for a clean session. """
+        return {"crc_failures": len(self.crc_failures()), "tr_crc_failures": len(self.crc_failures(tr=True)),
+                "id_mismatches": len(self.id_mismatches()), "tr_id_mismatches": len(self.id_mismatches(tr=True)),
+                "missing_products": len(self.missing_products()),
+                "missing_tr_products": len(self.missing_products(tr=True)),
+                "heartbeat_gaps": len(self.heartbeat_gaps()), "error_spectra": len(self.error_spectra())}
+
+
+def integrity_scan(collection, workers=None):
+    """ Checks all spectral packets of collection in one pass and returns an IntegrityReport.
+        The CRCs of the packets read are those checked when they were read, those of the
+        others are computed from their blobs in worker threads, without decoding or keeping
+        them.
+    """
+    rows, packets = [], []
+    for tr, spectra in ((False, collection.spectra), (True, collection.tr_spectra)):
+        for s, S in enumerate(spectra):
+            for product, P in S.items():
+                if product != "meta":
+                    rows.append((tr, s, product, S["meta"].unique_packet_id))
+                    packets.append(P)
+
+    workers = min(8, os.cpu_count() or 1) if workers is None else workers
+    chunk_size = max(1, min(256, len(packets) // max(1, workers)))
+    chunks = [packets[i:i + chunk_size] for i in range(0, len(packets), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        checked = [result for results in pool.map(_check_blobs, chunks) for result in results]
+
+    table = np.zeros(len(rows), dtype=packet_dtype)
+    if len(rows) > 0:
+        tr, spectrum, product, meta_id = (np.array(column) for column in zip(*rows))
+        unique_packet_id, crc, crc_calculated = (np.array(column, dtype=np.uint32) for column in zip(*checked))
+        table["tr"], table["spectrum"], table["product"] = tr, spectrum, product
+        table["unique_packet_id"], table["crc"], table["crc_calculated"] = unique_packet_id, crc, crc_calculated
+        table["crc_ok"] = crc == crc_calculated
+        table["id_mismatch"] = unique_packet_id != meta_id
+
+    present = np.zeros((len(collection.spectra), 16), dtype=bool)
+    tr_present = np.zeros((len(collection.tr_spectra), 16), dtype=bool)
+    for flags, tr in ((present, False), (tr_present, True)):
+        selected = table[table["tr"] == tr]
+        flags[selected["spectrum"], selected["product"]] = True
+
+    heartbeat_counts = collection.column("packet_count", Packet_Heartbeat)
+    meta_errors = collection.column("base.errors") if len(collection.spectra) > 0 else np.zeros(0, dtype=np.uint32)
+    return IntegrityReport(table, present, tr_present, heartbeat_counts, meta_errors)
@@ -0,0 +1,155 @@
+# Single file container for the packets of a session, an alternative to a cdi_output
+# directory with one file per packet.
+#
+# The file starts with an 8 byte magic and a uint32 format version. Records follow, each
+# a record header (blob length, sequence number, appid, receive time) and the blob.
+# Records are only ever appended. A sidecar <file>.idx holds the index of the records,
+# and records appended after it was written are found by walking their headers.
+import argparse
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+magic = b"UNCRATER"
+format_version = 1
+file_header = struct.Struct("<8sI")
+record_header = struct.Struct("<IqHd")  # blob length, seq, appid, receive time
+
+index_dtype = np.dtype([("seq", "i8"), ("appid", "u2"), ("size", "i8"), ("mtime", "f8"), ("offset", "i8")])
+
+
+def is_packed_session(path) -> bool:
+    """Returns True if path is a packed session file."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(magic)) == magic
+
+
+class PackedSessionWriter:
+    """Appends packets to a packed session file, creating it if needed.
+
+    The sidecar index is written on close; use as a context manager.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+        if os.path.exists(fn):
+            self.index, mm = read_index(fn)
+            mm.close()
+            # continue after the last complete record, dropping a truncated one
+            end = int(self.index["offset"][-1] + self.index["size"][-1]) if len(self.index) > 0 else file_header.size
+            self.f = open(fn, "r+b")
+            self.f.truncate(end)
+            self.f.seek(end)
+        else:
+            self.index = np.zeros(0, dtype=index_dtype)
+            self.f = open(fn, "wb")
+            self.f.write(file_header.pack(magic, format_version))
+        self._rows = []
+        self.packet_count = int(self.index["seq"][-1]) + 1 if len(self.index) > 0 else 0
+
+    def append(self, appid, blob, seq=None, mtime=None):
+        seq = self.packet_count if seq is None else seq
+        mtime = time.time() if mtime is None else mtime
+        self.f.write(record_header.pack(len(blob), seq, appid, mtime))
+        offset = self.f.tell()
+        self.f.write(blob)
+        self._rows.append((seq, appid, len(blob), mtime, offset))
+        self.packet_count = seq + 1
+
+    def close(self):
+        self.f.close()
+        self.index = np.concatenate((self.index, np.array(self._rows, dtype=index_dtype)))
+        self._rows = []
+        with open(self.fn + ".idx.tmp", "wb") as f:
+            np.save(f, self.index, allow_pickle=False)
+        os.replace(self.fn + ".idx.tmp", self.fn + ".idx")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_index(fn):
+    """Returns the index of a packed session and a read only memory map of it.
+
+    Blobs are zero copy slices of the map: mm[offset:offset+size] with a memoryview.
+    """
+    with open(fn, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < file_header.size:
+            raise ValueError(f"{fn} is not a packed session")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    head, version = file_header.unpack_from(mm)
+    if head != magic or version != format_version:
+        raise ValueError(f"{fn} is not a packed session of format version {format_version}")
+
+    pos = file_header.size
+    try:
+        index = np.load(fn + ".idx", allow_pickle=False)
+        if len(index) > 0:
+            pos = int(index["offset"][-1] + index["size"][-1])
+        if index.dtype != index_dtype or pos > size:
+            raise ValueError
+    except (OSError, ValueError):
+        index, pos = np.zeros(0, dtype=index_dtype), file_header.size
+
+    # records appended after the sidecar was written; a truncated last one is left out
+    rows = []
+    while pos + record_header.size <= size:
+        length, seq, appid, mtime = record_header.unpack_from(mm, pos)
+        offset = pos + record_header.size
+        if offset + length > size:
+            break
+        rows.append((seq, appid, length, mtime, offset))
+        pos = offset + length
+    if len(rows) > 0:
+        index = np.concatenate((index, np.array(rows, dtype=index_dtype)))
+    return index, mm
+
+
+def blob_view(mm, offset, size):
+    """Returns the blob at offset in a memory mapped packed session, without copying."""
+    return memoryview(mm)[offset:offset + size]
+
+
+def read_blob(fn, offset, size):
+    """Reads the blob at offset in a packed session, for when no memory map is at hand."""
+    with open(fn, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def pack_session(dir, fn):
+    """Packs the cdi_output directory dir into the packed session file fn.
+
+    Sequence numbers and appids come from the file names, receive times from their mtimes.
+    """
+    entries = []
+    with os.scandir(dir) as it:
+        for entry in it:
+            if entry.name.startswith(".") or not entry.name.endswith(".bin"):
+                continue
+            parts = entry.name[:-len(".bin")].split("_")
+            seq, appid = parts[0], parts[-1]
+            entries.append((int(seq), int(appid, 16), entry.stat().st_mtime, entry.path))
+    entries.sort()
+    with PackedSessionWriter(fn) as writer:
+        for seq, appid, mtime, path in entries:
+            with open(path, "rb") as f:
+                writer.append(appid, f.read(), seq=seq, mtime=mtime)
+    return len(entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Packs a cdi_output directory into a single file.")
+    parser.add_argument("dir", help="cdi_output directory")
+    parser.add_argument("output", help="packed session file")
+    args = parser.parse_args()
+    print(f"Packed {pack_session(args.dir, args.output)} packets into {args.output}.")
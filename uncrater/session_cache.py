@@ -0,0 +1,61 @@
+# On-disk cache of the arrays decoded from a cdi_output directory
+import glob
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+from .coreloop import pycoreloop
+
+# bump whenever the decoding of any cached array changes
+cache_version = 5
+cache_dirname = ".uncrater_cache"
+
+
+def fingerprint(index, cut_to_hello=False, dtype="float64", reorder_gap=None) -> str:
+    """Returns a key for the session listed in index (seq, appid, size and mtime of every
+    file) as decoded by this version of uncrater and the default pycoreloop bindings.
+    """
+    h = hashlib.sha1()
+    h.update(f"{cache_version}:{pycoreloop.pystruct.VERSION_ID}:{int(cut_to_hello)}:{dtype}:{reorder_gap}:".encode())
+    h.update(np.ascontiguousarray(index).tobytes())
+    return h.hexdigest()
+
+
+def cache_dir(session):
+    """Returns the cache directory of a cdi_output directory or a packed session file."""
+    if os.path.isdir(session):
+        return os.path.join(session, cache_dirname)
+    return os.path.join(os.path.dirname(session), cache_dirname, os.path.basename(session))
+
+
+def load_cache(session, key):
+    """Returns the dict of arrays cached for key, None if there are none."""
+    fn = os.path.join(cache_dir(session), key + ".npz")
+    try:
+        with np.load(fn, allow_pickle=False) as cached:
+            return {name: cached[name] for name in cached.files}
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def save_cache(session, key, arrays):
+    """Stores the dict of arrays for key, replacing caches of earlier states of the
+    session. Returns False if the cache directory is not writable.
+    """
+    directory = cache_dir(session)
+    fn = os.path.join(directory, key + ".npz")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # written under a temporary name so that readers never see a partial file
+        tmp_fn = fn + f".{os.getpid()}.tmp"
+        with open(tmp_fn, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_fn, fn)
+        for stale in glob.glob(os.path.join(directory, "*.npz")):
+            if stale != fn:
+                os.remove(stale)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,285 @@
+# Export of the decoded contents of a Collection into columnar datasets, and their loader
+#
+# Every dataset is an array whose first axis runs over packets, spectra or cycles:
+#   index                        seq, appid, size and receive time of every packet
+#   spectra, spectra_present     (spectra, 16, bins) and which products came in
+#   tr_spectra, tr_spectra_present
+#   meta, housekeeping_<type>, heartbeat, watchdog    record tables of the packet structs
+#   calib_data, calib_gNacc, calib_gphase, cd_*, grimm_spectra
+#   waveforms, waveform_channels, waveform_timestamps
+# Spectra and waveforms are written in chunks of chunk_size rows, decoding the packets of
+# lazy collections one chunk at a time, so exports need not fit in memory.
+import argparse
+import ast
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from .Packet import Packet
+from .Packet_Heartbeat import Packet_Heartbeat
+from .Packet_Watchdog import Packet_Watchdog
+
+formats = ("npz", "npy", "hdf5", "parquet")
+
+
+def _data(packet, meta=None, dtype=None):
+    # the data of a packet; packets not decoded yet are decoded into a copy that is
+    # dropped again, so lazy collections stay lazy
+    if packet._is_read:
+        return packet.data if hasattr(packet, "data") else packet.waveform
+    copy = Packet(packet.appid, blob_fn=packet._blob_fn, version=packet._version)
+    if meta is not None:
+        copy.set_meta(meta)
+    if dtype is not None:
+        copy.dtype = dtype
+    copy.read()
+    return copy.data if hasattr(copy, "data") else copy.waveform
+
+
+def _spectra_datasets(name, spectra, dtype, chunk_size):
+    present = np.zeros((len(spectra), 16), dtype=bool)
+    for i, S in enumerate(spectra):
+        present[i, [product for product in S if product != "meta"]] = True
+    if not present.any():
+        return []
+    row, product = np.argwhere(present)[0]
+    shape = np.shape(_data(spectra[row][product], spectra[row]["meta"], dtype))
+    # raw spectra are written as the uint32 words of their products, see Collection.np_spectra
+    array_dtype = np.int32 if dtype is None else (np.uint32 if dtype == "raw" else np.dtype(dtype))
+
+    def chunks():
+        for start in range(0, len(spectra), chunk_size):
+            block = np.zeros((min(chunk_size, len(spectra) - start), 16) + shape, dtype=array_dtype)
+            for i, S in enumerate(spectra[start:start + len(block)]):
+                for product, P in S.items():
+                    if product == "meta":
+                        continue
+                    data = _data(P, S["meta"], dtype)
+                    if np.shape(data) != shape:
+                        raise ValueError(f"{name} have products of shapes {shape} and {np.shape(data)}")
+                    block[i, product] = data.view(np.uint32) if dtype == "raw" else data
+            yield block
+
+    return [(name, (len(spectra), 16) + shape, array_dtype, chunks()),
+            (name + "_present", present.shape, present.dtype, [present])]
+
+
+def _whole(name, array):
+    array = np.asarray(array)
+    return [(name, array.shape, array.dtype, [array])]
+
+
+def collection_datasets(C, chunk_size=256):
+    """ Returns the datasets of Collection C as (name, shape, dtype, chunks) tuples, where
+        chunks yields consecutive blocks of rows.
+    """
+    datasets = _whole("index", C.index)
+    datasets += _spectra_datasets("spectra", C.spectra, C.dtype, chunk_size)
+    datasets += _spectra_datasets("tr_spectra", C.tr_spectra, None, chunk_size)
+
+    tables = {"meta": C.meta_records() if len(C.spectra) > 0 else None}
+    for hk_type in sorted(set(P.hk_type for P in C.housekeeping_packets)):
+        tables[f"housekeeping_{hk_type}"] = C.housekeeping_records(hk_type)
+    tables["heartbeat"] = C._get_records(Packet_Heartbeat)
+    tables["watchdog"] = C._get_records(Packet_Watchdog)
+    for name, records in tables.items():
+        if records is not None and len(records) > 0:
+            datasets += _whole(name, records)
+
+    arrays = ["calib_data", "calib_gNacc", "calib_gphase", "grimm_spectra"]
+    arrays += sorted(name for name in vars(C) if name.startswith("cd_") and name != "cd_errors")
+    for name in arrays:
+        array = getattr(C, name, None)
+        if isinstance(array, np.ndarray) and len(array) > 0:
+            datasets += _whole(name, array)
+
+    waveforms = C.waveform_packets
+    if len(waveforms) > 0:
+        def chunks():
+            for start in range(0, len(waveforms), chunk_size):
+                yield np.array([_data(P) for P in waveforms[start:start + chunk_size]])
+        datasets.append(("waveforms", (len(waveforms), len(_data(waveforms[0]))), np.int64, chunks()))
+        datasets += _whole("waveform_channels", [(P.appid - 0x2f0) % 512 for P in waveforms])
+        datasets += _whole("waveform_timestamps", np.array([P.__dict__.get("timestamp", 0xFFFFFFFFFFFFFFFF)
+                                                            for P in waveforms], dtype=np.uint64))
+    return datasets
+
+
+class _NpyWriter:
+    # npy files, in a zip archive compressed with zlib ("npz") or in a directory ("npy"),
+    # written header first and then chunk by chunk
+    def __init__(self, path, compress):
+        self.path = path
+        if compress:
+            self.zf = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        else:
+            self.zf = None
+            os.makedirs(path, exist_ok=True)
+
+    def write(self, name, shape, dtype, chunks, chunk_size):
+        if self.zf is not None:
+            f = self.zf.open(name + ".npy", "w", force_zip64=True)
+        else:
+            f = open(os.path.join(self.path, name + ".npy"), "wb")
+        with f:
+            header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape}
+            np.lib.format.write_array_header_2_0(f, header)
+            for chunk in chunks:
+                f.write(np.ascontiguousarray(chunk, dtype=dtype).tobytes())
+
+    def close(self):
+        if self.zf is not None:
+            self.zf.close()
+
+
+class _Hdf5Writer:
+    # chunked, gzip compressed HDF5 datasets; needs h5py
+    def __init__(self, path):
+        import h5py
+        self.f = h5py.File(path, "w")
+
+    def write(self, name, shape, dtype, chunks, chunk_size):
+        options = {}
+        if shape[0] > 0:
+            options = {"chunks": (min(chunk_size, shape[0]),) + shape[1:], "compression": "gzip"}
+        dataset = self.f.create_dataset(name, shape=shape, dtype=dtype, **options)
+        start = 0
+        for chunk in chunks:
+            dataset[start:start + len(chunk)] = chunk
+            start += len(chunk)
+
+    def close(self):
+        self.f.close()
+
+
+def _columns(array, prefix=""):
+    # leaf columns of a structured array by dotted name, with one row per element
+    if array.dtype.names is None:
+        return {prefix or "data": array.reshape(len(array), -1) if array.ndim > 1 else array}
+    columns = {}
+    for name in array.dtype.names:
+        columns.update(_columns(array[name], prefix + name + "."))
+    return {name.rstrip("."): column for name, column in columns.items()}
+
+
+class _ParquetWriter:
+    # a directory with one parquet file per dataset, one row group per chunk; needs pyarrow
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _table(self, chunk, metadata):
+        if np.iscomplexobj(chunk):
+            chunk = chunk.view(chunk.real.dtype)
+        columns = {}
+        for name, column in _columns(chunk).items():
+            if column.ndim > 1:
+                flat = self.pa.array(np.ascontiguousarray(column).reshape(-1))
+                columns[name] = self.pa.FixedSizeListArray.from_arrays(flat, column.shape[1])
+            else:
+                columns[name] = self.pa.array(column)
+        return self.pa.table(columns).replace_schema_metadata(metadata)
+
+    def write(self, name, shape, dtype, chunks, chunk_size):
+        metadata = {"shape": json.dumps(list(shape)), "dtype": repr(np.lib.format.dtype_to_descr(np.dtype(dtype)))}
+        writer = None
+        for chunk in chunks:
+            table = self._table(np.asarray(chunk, dtype=dtype), metadata)
+            if writer is None:
+                writer = self.pq.ParquetWriter(os.path.join(self.path, name + ".parquet"), table.schema, compression="gzip")
+            writer.write_table(table)
+        if writer is None:
+            self.pq.write_table(self._table(np.zeros(shape, dtype=dtype), metadata), os.path.join(self.path, name + ".parquet"))
+        else:
+            writer.close()
+
+    def close(self):
+        pass
+
+
+def export_collection(C, path, format="npz", chunk_size=256):
+    """ Writes the datasets of Collection C to path, see Collection.export. """
+    if format == "npz":
+        writer = _NpyWriter(path, compress=True)
+    elif format == "npy":
+        writer = _NpyWriter(path, compress=False)
+    elif format == "hdf5":
+        writer = _Hdf5Writer(path)
+    elif format == "parquet":
+        writer = _ParquetWriter(path)
+    else:
+        raise ValueError(f"format must be one of {formats}, not {format!r}")
+    try:
+        for name, shape, dtype, chunks in collection_datasets(C, chunk_size):
+            writer.write(name, shape, dtype, chunks, chunk_size)
+    finally:
+        writer.close()
+
+
+def _load_parquet(fn):
+    import pyarrow.parquet
+    table = pyarrow.parquet.read_table(fn, memory_map=True)
+    metadata = table.schema.metadata
+    shape = tuple(json.loads(metadata[b"shape"]))
+    dtype = np.lib.format.descr_to_dtype(ast.literal_eval(metadata[b"dtype"].decode()))
+
+    def leaf(name):
+        column = table.column(name).combine_chunks()
+        if isinstance(column.type, pyarrow.FixedSizeListType):
+            return column.flatten().to_numpy(zero_copy_only=False).reshape((len(table), -1))
+        return column.to_numpy(zero_copy_only=False)
+
+    if dtype.names is None:
+        if dtype.kind == "c":
+            # complex arrays are stored as their real and imaginary parts
+            return leaf("data").astype(np.zeros(0, dtype).real.dtype).view(dtype).reshape(shape)
+        return leaf("data").astype(dtype).reshape(shape)
+
+    array = np.zeros(shape[0], dtype=dtype)
+
+    def fill(target, prefix):
+        for name in target.dtype.names:
+            if target[name].dtype.names is not None:
+                fill(target[name], prefix + name + ".")
+            else:
+                target[name] = leaf(prefix + name).reshape(target[name].shape)
+    fill(array, "")
+    return array
+
+
+def load_export(path):
+    """ Opens an export written by Collection.export and returns a mapping from dataset
+        names to arrays. Directories of npy files are memory mapped and npz archives
+        decompress each dataset on access; HDF5 files give h5py datasets, which read
+        chunks on slicing, and parquet directories arrays read from memory mapped files.
+    """
+    if os.path.isdir(path):
+        names = sorted(os.listdir(path))
+        if any(name.endswith(".parquet") for name in names):
+            return {name[:-len(".parquet")]: _load_parquet(os.path.join(path, name)) for name in names if name.endswith(".parquet")}
+        return {name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode="r", allow_pickle=False)
+                for name in names if name.endswith(".npy")}
+    if zipfile.is_zipfile(path):
+        return np.load(path, allow_pickle=False)
+    import h5py
+    return h5py.File(path, "r")
+
+
+if __name__ == "__main__":
+    from .Collection import Collection
+    parser = argparse.ArgumentParser(description="Exports a session to columnar datasets.")
+    parser.add_argument("session", help="cdi_output directory or packed session file")
+    parser.add_argument("output", help="output file or directory")
+    parser.add_argument("--format", choices=formats, default="npz")
+    parser.add_argument("--dtype", choices=("float64", "float32", "raw"), default="float64")
+    parser.add_argument("--chunk-size", type=int, default=256, help="rows of spectra written at a time")
+    parser.add_argument("--cut-to-hello", action="store_true")
+    args = parser.parse_args()
+    C = Collection(args.session, lazy=True, cut_to_hello=args.cut_to_hello, dtype=args.dtype)
+    C.export(args.output, format=args.format, chunk_size=args.chunk_size)
+    print(f"Exported {len(C)} packets of {args.session} to {args.output}.")
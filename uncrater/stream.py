@@ -0,0 +1,110 @@
+# Streaming access to the packets of a session, one assembled unit at a time
+from .Packet import *
+from .Collection import scan_session, EntryFilter
+from .assembly import PacketAssembler, unit_member
+
+
+def _unit(family, members):
+    # units in the form of the lists of Collection
+    if family == "spectra":
+        return "spectrum", members
+    if family == "tr_spectra":
+        return "tr_spectrum", members
+    if family == "waveform":
+        return "waveform", members["meta"]
+    pages = 3 if family == "cal_data" else 8
+    return family, [members.get(page) for page in range(pages)]
+
+
+def iter_packets(path, cut_to_hello=False, include_appids=None, exclude_appids=None, time_range=None,
+                 index_range=None, reorder_gap=None):
+    """ Yields the packets of a cdi_output directory or a packed session in order, grouped
+        into the units Collection assembles them into, as (kind, unit) tuples:
+            ("spectrum", {"meta": P, 0: P, ...})     metadata packet and its products
+            ("tr_spectrum", {"meta": P, 0: P, ...})  TR products of the same metadata, if any
+            ("cal_data", [P, P, P])                  calibrator data pages
+            ("rawpfb", [P, ...])                     8 raw PFB parts
+            ("cal_debug", [P, ...])                  8 calibrator debug pages
+            ("waveform", P)                          waveform metadata, channels in P.packets
+            ("packet", P)                            any other packet
+        The assembly is that of Collection, with the same PacketAssembler: spectra belong
+        to the last metadata packet, calibrator pages to the last start page, or, with
+        reorder_gap, to the unit with their unique_packet_id. Missing pages or products
+        are None or absent. A unit is yielded once the next one of its kind starts or, by
+        unique_packet_id, once it is complete or given up on; packets that come later,
+        or without their start page, are yielded as packets. The filters are those of
+        Collection. Only the units in progress are held in memory, so sessions of any
+        length can be reduced in constant memory.
+    """
+    entries = scan_session(path)
+    if cut_to_hello:
+        hellos = [i for i, entry in enumerate(entries) if appid_is_hello(entry[1])]
+        if len(hellos) > 0:
+            entries = entries[hellos[-1]:]
+    entry_filter = EntryFilter(include_appids, exclude_appids, time_range, index_range)
+    if entry_filter.active:
+        entries = entry_filter.select(entries)
+
+    version = None
+    assembler = PacketAssembler(reorder_gap, retain=reorder_gap)
+    units = {}  # units in progress by (family, key)
+
+    def assembled(events):
+        for event in events:
+            kind, family, key = event[:3]
+            if kind == "open":
+                units[family, key] = event[3]
+                if family in ("spectra", "tr_spectra"):
+                    for slot, packet in event[3].items():
+                        if slot != "meta":
+                            packet.read()
+            elif kind == "join":
+                packet = event[4]
+                if family in ("spectra", "tr_spectra"):
+                    packet.read()
+                if (family, key) in units:
+                    units[family, key][event[3]] = packet
+                else:
+                    yield "packet", packet
+            elif kind == "close":
+                yield _unit(family, units.pop((family, key)))
+            elif family not in ("spectra", "tr_spectra"):
+                # orphans; spectral packets cannot be decoded without their metadata
+                for packet in event[3].values():
+                    yield "packet", packet
+
+    for position, (seq, appid, size, mtime, source) in enumerate(entries):
+        if appid_is_hello(appid):
+            hello = Packet(appid, blob_fn=source)
+            hello.read()
+            version = hello.SW_version
+
+        ## sometimes there is initial garbage to throw out
+        if assembler.skips(appid):
+            continue
+
+        packet = Packet(appid, blob_fn=source, version=version)
+        member = unit_member(appid)
+        # spectral packets are read once they have their metadata, calibrator pages once
+        # they know their start page
+        if member is None or member[1] == "meta":
+            packet.read()
+        if version is None and packet._version is not None:
+            version = packet._version
+        events = assembler.add(appid, packet, position + 1)
+        if member is not None and member[0] not in ("spectra", "tr_spectra"):
+            packet.read()
+        if member is None and not isinstance(packet, (Packet_Waveform, Packet_Waveform_Meta)):
+            yield "packet", packet
+        yield from assembled(events)
+
+    yield from assembled(assembler.flush())
+
+
+def iter_spectra(path, cut_to_hello=False, **kwargs):
+    """ Yields the spectra of a session one at a time, as the {"meta": P, 0: P, ...}
+        dicts of Collection.spectra, see iter_packets.
+    """
+    for kind, unit in iter_packets(path, cut_to_hello, **kwargs):
+        if kind == "spectrum":
+            yield unit
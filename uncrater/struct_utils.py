@@ -0,0 +1,45 @@
+# Bulk decoding of ctypes structures from pycoreloop into numpy structured arrays
+import ctypes
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def ctypes_to_dtype(ctype) -> np.dtype:
+    """Returns a little endian numpy dtype with the same memory layout as a ctypes type.
+
+    Nested structures become nested structured dtypes, ctypes arrays become subarrays
+    and char arrays become fixed size byte strings, matching what ctypes returns.
+    """
+    if issubclass(ctype, ctypes.Structure):
+        names, formats, offsets = [], [], []
+        for field in ctype._fields_:
+            name, ftype = field[0], field[1]
+            names.append(name)
+            formats.append(ctypes_to_dtype(ftype))
+            offsets.append(getattr(ctype, name).offset)
+        return np.dtype({"names": names, "formats": formats, "offsets": offsets,
+                         "itemsize": ctypes.sizeof(ctype)})
+    if issubclass(ctype, ctypes.Array):
+        if ctype._type_ is ctypes.c_char:
+            return np.dtype(f"S{ctype._length_}")
+        return np.dtype((ctypes_to_dtype(ctype._type_), (ctype._length_,)))
+    if ctype is ctypes.c_char:
+        return np.dtype("S1")
+    return np.dtype(ctype).newbyteorder("<")
+
+
+def decode_structs(blobs, ctype) -> np.ndarray:
+    """Decodes a sequence of packet blobs holding ctype into one structured array.
+
+    Blobs longer than the structure are trimmed, as from_buffer_copy would do.
+    """
+    dtype = ctypes_to_dtype(ctype)
+    size = dtype.itemsize
+    chunks = []
+    for i, blob in enumerate(blobs):
+        if len(blob) < size:
+            raise ValueError(f"Blob {i} has {len(blob)} bytes, {ctype.__name__} needs {size}")
+        chunks.append(memoryview(blob)[:size])
+    return np.frombuffer(b"".join(chunks), dtype=dtype)
@@ -4,6 +4,8 @@ from .Packet import appId_from_value
 
 import numpy as np
 
+from .struct_utils import ctypes_to_dtype
+
 
 def Time2Time(time1, time2):
     """Converts the the two time values to a single time expressed in seconds.
@@ -12,6 +14,13 @@ def Time2Time(time1, time2):
     time = ((((time2 & 0xFFFF) << 32)+time1)>>4)*1/4096
     return time
 
+def Time2Time_array(time_32, time_16):
+    """Time2Time for whole arrays of time_32 and time_16 counters, e.g. the uint32
+    columns of a record table. Returns float64 seconds.
+    """
+    ticks = ((np.asarray(time_16, dtype=np.int64) & 0xFFFF) << 32) + np.asarray(time_32, dtype=np.int64)
+    return (ticks >> 4) / 4096
+
 def appid_is_spectrum(appid):
     return ((appid>=id.AppID_SpectraHigh) and (appid<id.AppID_SpectraLow+16))
 
@@ -26,26 +35,34 @@ def appid_to_str(appid):
     return appId_from_value[appid]
 
 
+adc_stat_keys = ('min', 'max', 'valid_count', 'invalid_count_max', 'invalid_count_min', 'total_count', 'mean', 'rms')
+telemetry_keys = ('V1_0', 'V1_8', 'V2_5', 'T_FPGA')
+
 def process_ADC_stats(ADC_stat):
     """Process the ADC stats from the housekeeping packet
     """
-    minv = np.array([x.min-0x1fff for x in ADC_stat])
-    maxv = np.array([x.max-0x1fff for x in ADC_stat])
-    valid_count = np.array([x.valid_count for x in ADC_stat])
-    invalid_count_max = np.array([x.invalid_count_max for x in ADC_stat])
-    invalid_count_min = np.array([x.invalid_count_min for x in ADC_stat])
-    sumx = np.array([x.sumv for x in ADC_stat])
-    sumxx = np.array([x.sumv2 for x in ADC_stat])
-    w = np.where(valid_count>0)
-    mean = np.zeros(4)
-    var = np.zeros(4)
-    mean[w] = sumx[w]/valid_count[w]-0x1fff
-    var[w] = sumxx[w]/valid_count[w]-(sumx[w]/valid_count[w])**2
-    mean[valid_count == 0] = 0 
-    var[valid_count ==0 ] = 0
-    total_count = valid_count+invalid_count_min+invalid_count_max
+    records = np.frombuffer(ADC_stat, dtype=ctypes_to_dtype(ADC_stat._type_))
+    return {k: v[0] for k, v in process_ADC_stats_batch(records[None]).items()}
+
+def process_ADC_stats_batch(ADC_stat):
+    """process_ADC_stats for many packets at once. ADC_stat is a structured array of
+    shape (N, 4) with the fields of the ADC_stat struct, e.g. C.column('base.ADC_stat').
+    Returns the same keys as (N, 4) arrays.
+    """
+    minv = ADC_stat['min'].astype(np.int64)-0x1fff
+    maxv = ADC_stat['max'].astype(np.int64)-0x1fff
+    valid_count = ADC_stat['valid_count'].astype(np.int64)
+    invalid_count_max = ADC_stat['invalid_count_max'].astype(np.int64)
+    invalid_count_min = ADC_stat['invalid_count_min'].astype(np.int64)
+    sumx = ADC_stat['sumv'].astype(np.float64)
+    sumxx = ADC_stat['sumv2'].astype(np.float64)
+    valid = valid_count > 0
+    meanx = np.divide(sumx, valid_count, out=np.zeros(sumx.shape), where=valid)
+    mean = np.where(valid, meanx-0x1fff, 0.)
+    var = np.divide(sumxx, valid_count, out=np.zeros(sumxx.shape), where=valid) - meanx**2
     var[var<0] = 0
     rms = np.sqrt(var)
+    total_count = valid_count+invalid_count_min+invalid_count_max
 
     toret = {'min':minv, 'max':maxv, 'valid_count':valid_count, 'invalid_count_max':invalid_count_max, 'invalid_count_min':invalid_count_min, 'total_count':total_count, 'mean':mean, 'rms':rms}
     return toret
@@ -66,6 +83,14 @@ def process_telemetry(TVS_sensors):
     toret['T_FPGA'] = bits2celsius(TVS_sensors[3])
     return toret
 
+def process_telemetry_batch(TVS_sensors):
+    """process_telemetry for many packets at once. TVS_sensors is an (N, 4) array of
+    the raw sensor readings, e.g. C.column('base.TVS_sensors'). Returns (N,) arrays.
+    """
+    TVS_sensors = np.asarray(TVS_sensors, dtype=np.float64)
+    return {'V1_0': TVS_sensors[:, 0]/16000, 'V1_8': TVS_sensors[:, 1]/16000,
+            'V2_5': TVS_sensors[:, 2]/16000, 'T_FPGA': TVS_sensors[:, 3]/128-273.15}
+
 
 def cordic2rad (val):
     b30 = (1<<30)
@@ -73,18 +98,24 @@ def cordic2rad (val):
     b32 = (1<<32)
     sign = (val & b31) >> 30
     val = val & (b31-1)
-    if type(val)==int:
-        if (val>b30):
-            val = val-b31
-        assert (val<=b31)    
-    else:
-        val[val>b30] = val[val>b30]-b31
-        assert (np.all(val<=b31))
+    if type(val)!=int:
+        return cordic2rad_array(val)
+    if (val>b30):
+        val = val-b31
+    assert (val<=b31)    
     
     rad =  val/(b30)*np.pi  * (-1)**sign
 
     return rad
 
+def cordic2rad_array(val):
+    """cordic2rad for arrays of CORDIC words, returns float64 radians."""
+    b30 = (1<<30)
+    b31 = (1<<31)
+    val = np.asarray(val, dtype=np.int64) & (b31-1)
+    # bit 31 gives (-1)**0 or (-1)**2 in cordic2rad, i.e. it never flips the sign
+    return np.where(val>b30, val-b31, val)/b30*np.pi
+
 def rad2cordic(val):
     b30 = (1<<30)
     b32 = (1<<32)
@@ -94,6 +125,15 @@ def rad2cordic(val):
         val = val+2*np.pi
     return round(abs(val/np.pi*b30))+(b32*(val<0))
 
+def rad2cordic_array(val):
+    """rad2cordic for arrays of angles, returns int64 CORDIC words."""
+    b30 = (1<<30)
+    b32 = (1<<32)
+    val = np.asarray(val, dtype=np.float64)
+    val = val - 2*np.pi*(val>np.pi) + 2*np.pi*(val<-np.pi)
+    # np.rint rounds halves to even, as round() does
+    return np.rint(np.abs(val/np.pi*b30)).astype(np.int64)+b32*(val<0)
+
 def cordic_add (val1,val2):
     val = (val1+val2)
     topbits = (val>>30)
@@ -105,6 +145,13 @@ def cordic_add (val1,val2):
 
     return val
 
+def cordic_add_array(val1, val2):
+    """cordic_add for arrays of CORDIC words, returns int64 words."""
+    val = np.asarray(val1, dtype=np.int64)+np.asarray(val2, dtype=np.int64)
+    topbits = val>>30
+    val = val & 0x3FFFFFFF
+    return val | np.where(topbits==0b01, 0b11<<30, np.where(topbits==0b10, 0b01<<30, 0))
+
 def _as_memoryview(stream):
     if isinstance(stream, memoryview):
         return stream
@@ -121,31 +168,32 @@ def rle_decode(stream, original_size):
     if len(stream) == original_size:
         return stream
         
-    data = _as_memoryview(stream)
-    result = bytearray()
-    i = 0
+    data = np.frombuffer(_as_memoryview(stream), dtype=np.uint8)
     n = len(data)
-    while i < n:
-        byte = data[i]
-        if byte == 0x8C:
-            if i + 1 >= n:
-                raise ValueError("Incomplete 0x8C run marker")
-            count = data[i + 1]
-            if count == 0:
-                result.append(0x8C)
-            else:
-                result.extend(b"\x00" * count)
-            i += 2
-        elif byte == 0x8D:
-            if i + 1 >= n:
-                raise ValueError("Incomplete 0x8D run marker")
-            count = data[i + 1]
-            if count == 0:
-                result.append(0x8D)
-            else:
-                result.extend(b"\xFF" * count)
-            i += 2
-        else:
-            result.append(byte)
-            i += 1
-    return bytes(result)
+    # a byte following a marker is its count and never a marker itself,
+    # so walk the candidates and drop those that are counts
+    markers = []
+    last = -2
+    for i in np.flatnonzero((data == 0x8C) | (data == 0x8D)).tolist():
+        if i == last + 1:
+            continue
+        if i + 1 >= n:
+            raise ValueError(f"Incomplete 0x{data[i]:X} run marker")
+        markers.append(i)
+        last = i
+    markers = np.array(markers, dtype=np.int64)
+    counts = data[markers + 1].astype(np.int64)
+
+    # literals and escaped markers expand to one byte, runs to count bytes, count bytes to none
+    out_len = np.ones(n, dtype=np.int64)
+    out_len[markers] = np.where(counts > 0, counts, 1)
+    out_len[markers + 1] = 0
+    offsets = np.cumsum(out_len) - out_len
+    result = np.empty(int(out_len.sum()), dtype=np.uint8)
+
+    literal = out_len == 1
+    literal[markers[counts > 0]] = False
+    result[offsets[literal]] = data[literal]
+    for i, count in zip(markers[counts > 0].tolist(), counts[counts > 0].tolist()):
+        result[offsets[i]:offsets[i] + count] = 0x00 if data[i] == 0x8C else 0xFF
+    return result.tobytes()